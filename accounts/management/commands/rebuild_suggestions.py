@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from accounts.suggestions import SuggestionGraph, save_suggestions
+
+
+class Command(BaseCommand):
+    help = "Recompute who-to-follow suggestions for every user."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        graph = SuggestionGraph()
+        processed = 0
+        batch = {}
+        for user_id, suggestions in graph:
+            batch[user_id] = suggestions
+            if len(batch) == options["batch_size"]:
+                save_suggestions(batch)
+                processed += len(batch)
+                batch = {}
+        save_suggestions(batch)
+        processed += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"{processed}人のおすすめユーザーを更新しました"))
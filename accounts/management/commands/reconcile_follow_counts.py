@@ -0,0 +1,48 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.tasks import recount_follows
+from jobs.queue import enqueue
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Recompute User.following_count/followers_count from FriendShip."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--enqueue",
+            action="store_true",
+            help="Queue one background job per batch instead of running inline.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_pk = 0
+        updated = 0
+        batches = 0
+        while True:
+            pks = list(
+                User.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            with transaction.atomic():
+                if options["enqueue"]:
+                    enqueue(
+                        "accounts.recount_follows",
+                        {"first_pk": pks[0], "last_pk": pks[-1]},
+                    )
+                else:
+                    updated += recount_follows(pks[0], pks[-1])
+            batches += 1
+            last_pk = pks[-1]
+        if options["enqueue"]:
+            self.stdout.write(self.style.SUCCESS(f"{batches}件のジョブを登録しました"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{updated}人のユーザーを更新しました"))
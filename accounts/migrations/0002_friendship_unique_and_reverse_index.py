@@ -0,0 +1,43 @@
+# Generated by Django 4.0.10 on 2026-10-17 21:59
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+BATCH_SIZE = 1000
+
+
+def remove_duplicate_friendships(apps, schema_editor):
+    FriendShip = apps.get_model('accounts', 'FriendShip')
+    duplicates = (
+        FriendShip.objects.values('follow', 'followed')
+        .annotate(keep=Min('id'), count=Count('id'))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    while True:
+        batch = list(duplicates[:BATCH_SIZE])
+        if not batch:
+            break
+        for row in batch:
+            FriendShip.objects.filter(
+                follow=row['follow'], followed=row['followed']
+            ).exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_friendships, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['followed', 'follow'], name='friendship_followed_follow_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='friendship',
+            constraint=models.UniqueConstraint(fields=('follow', 'followed'), name='friendship_follow_followed_unique'),
+        ),
+    ]
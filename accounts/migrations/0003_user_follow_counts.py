@@ -0,0 +1,47 @@
+# Generated by Django 4.0.10 on 2026-10-17 22:00
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_follow_counts(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    FriendShip = apps.get_model('accounts', 'FriendShip')
+    following = (
+        FriendShip.objects.filter(follow=OuterRef('pk'))
+        .values('follow')
+        .annotate(count=Count('*'))
+        .values('count')
+    )
+    followers = (
+        FriendShip.objects.filter(followed=OuterRef('pk'))
+        .values('followed')
+        .annotate(count=Count('*'))
+        .values('count')
+    )
+    User.objects.update(
+        following_count=Coalesce(Subquery(following), 0),
+        followers_count=Coalesce(Subquery(followers), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_friendship_unique_and_reverse_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_follow_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.10 on 2026-10-17 22:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_user_follow_counts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='friendship',
+            name='follow',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='follow', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='friendship',
+            name='followed',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='followed', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['follow', '-id'], name='friendship_follow_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['followed', '-id'], name='friendship_followed_id_idx'),
+        ),
+    ]
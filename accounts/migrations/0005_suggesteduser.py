@@ -0,0 +1,32 @@
+# Generated by Django 4.0.10 on 2026-10-17 22:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_friendship_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SuggestedUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('suggested', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='suggestions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='suggesteduser',
+            index=models.Index(fields=['user', '-score'], name='suggesteduser_user_score_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='suggesteduser',
+            constraint=models.UniqueConstraint(fields=('user', 'suggested'), name='suggesteduser_user_suggested_unique'),
+        ),
+    ]
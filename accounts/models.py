@@ -14,6 +14,8 @@ class User(AbstractUser):
     )
     email = models.EmailField(max_length=254)
     slug_username = models.SlugField(max_length=150, blank=False, unique=True)
+    following_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
 
     def save(self, *args, **kwargs):
         self.slug_username = self.username
@@ -21,12 +23,61 @@ class User(AbstractUser):
 
 
 class FriendShip(models.Model):
+    # Both columns lead a composite index below, so the single-column
+    # foreign key indexes would be redundant.
     follow = models.ForeignKey(
-        settings.AUTH_USER_MODEL, related_name="follow", on_delete=models.CASCADE
+        settings.AUTH_USER_MODEL,
+        related_name="follow",
+        on_delete=models.CASCADE,
+        db_index=False,
     )
     followed = models.ForeignKey(
-        settings.AUTH_USER_MODEL, related_name="followed", on_delete=models.CASCADE
+        settings.AUTH_USER_MODEL,
+        related_name="followed",
+        on_delete=models.CASCADE,
+        db_index=False,
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["follow", "followed"], name="friendship_follow_followed_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["followed", "follow"], name="friendship_followed_follow_idx"
+            ),
+            models.Index(fields=["follow", "-id"], name="friendship_follow_id_idx"),
+            models.Index(fields=["followed", "-id"], name="friendship_followed_id_idx"),
+        ]
+
     def __str__(self):
         return "{} -> {}".format(self.follow.username, self.followed.username)
+
+
+class SuggestedUser(models.Model):
+    """A precomputed who-to-follow suggestion; see accounts.suggestions."""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="suggestions",
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
+    suggested = models.ForeignKey(
+        settings.AUTH_USER_MODEL, related_name="+", on_delete=models.CASCADE
+    )
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "suggested"], name="suggesteduser_user_suggested_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-score"], name="suggesteduser_user_score_idx"
+            ),
+        ]
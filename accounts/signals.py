@@ -0,0 +1,50 @@
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mysite.cache import profile_headers, timeline_pages, user_counters
+
+from .models import FriendShip, SuggestedUser
+from .tasks import schedule_suggestions_refresh
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=FriendShip)
+def increment_follow_counts(sender, instance, created, raw, **kwargs):
+    # loaddata brings its own counts and suggestions
+    if created and not raw:
+        User.objects.filter(pk=instance.follow_id).update(
+            following_count=F("following_count") + 1
+        )
+        User.objects.filter(pk=instance.followed_id).update(
+            followers_count=F("followers_count") + 1
+        )
+        invalidate_follow_caches(instance)
+        SuggestedUser.objects.filter(
+            user_id=instance.follow_id, suggested_id=instance.followed_id
+        ).delete()
+        schedule_suggestions_refresh(instance.follow_id)
+
+
+@receiver(post_delete, sender=FriendShip)
+def decrement_follow_counts(sender, instance, **kwargs):
+    User.objects.filter(pk=instance.follow_id, following_count__gt=0).update(
+        following_count=F("following_count") - 1
+    )
+    User.objects.filter(pk=instance.followed_id, followers_count__gt=0).update(
+        followers_count=F("followers_count") - 1
+    )
+    invalidate_follow_caches(instance)
+    schedule_suggestions_refresh(instance.follow_id)
+
+
+def invalidate_follow_caches(friendship):
+    user_counters.invalidate(friendship.follow_id, friendship.followed_id)
+    timeline_pages.invalidate(friendship.follow_id)
+
+
+@receiver(post_save, sender=User)
+def invalidate_profile_header(sender, instance, **kwargs):
+    profile_headers.invalidate(instance.slug_username)
@@ -0,0 +1,197 @@
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from datetime import timedelta
+from itertools import chain
+from operator import itemgetter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from tweets.models import Like, Tweet
+
+from .models import FriendShip, SuggestedUser
+
+User = get_user_model()
+
+
+def rank(user_id, following, friends_of_friends, co_likers):
+    """Score candidates by how many of the user's followings follow them and
+    how many recent likes they share with the user, and return the top
+    ``(candidate, score)`` pairs. The arguments repeat a candidate once per
+    path to it."""
+    scores = Counter()
+    for candidate in friends_of_friends:
+        scores[candidate] += settings.SUGGESTIONS_FOLLOW_WEIGHT
+    for candidate in co_likers:
+        scores[candidate] += settings.SUGGESTIONS_LIKE_WEIGHT
+    excluded = set(following)
+    excluded.add(user_id)
+    return heapq.nlargest(
+        settings.SUGGESTIONS_PER_USER,
+        (
+            (candidate, score)
+            for candidate, score in scores.items()
+            if candidate not in excluded
+        ),
+        key=lambda item: (item[1], -item[0]),
+    )
+
+
+def _like_window_start():
+    return timezone.now() - timedelta(days=settings.SUGGESTIONS_LIKE_DAYS)
+
+
+class Adjacency:
+    """Compressed sparse rows: the neighbours of row ``i`` are
+    ``targets[offsets[i]:offsets[i + 1]]``. Two flat int arrays take a few
+    bytes per edge, where a dict of lists takes tens."""
+
+    def __init__(self, size, rows, targets):
+        self.offsets = array("q", [0]) * (size + 1)
+        for row in rows:
+            self.offsets[row + 1] += 1
+        for i in range(size):
+            self.offsets[i + 1] += self.offsets[i]
+        free = self.offsets[:-1]
+        self.targets = array("i", [0]) * len(targets)
+        for row, target in zip(rows, targets):
+            self.targets[free[row]] = target
+            free[row] += 1
+
+    def __getitem__(self, row):
+        return self.targets[self.offsets[row] : self.offsets[row + 1]]
+
+
+class SuggestionGraph:
+    """The follow graph and recent likes of every user, loaded once for a
+    batch run. Users and tweets are numbered densely so that the edges fit in
+    Adjacency arrays."""
+
+    def __init__(self):
+        self.user_ids = array(
+            "q", User.objects.order_by("pk").values_list("pk", flat=True)
+        )
+        size = len(self.user_ids)
+
+        rows, targets = array("i"), array("i")
+        follows = FriendShip.objects.values_list("follow_id", "followed_id")
+        for follow_id, followed_id in follows.iterator(chunk_size=10000):
+            follow, followed = self.index(follow_id), self.index(followed_id)
+            if follow is not None and followed is not None:
+                rows.append(follow)
+                targets.append(followed)
+        self.follows = Adjacency(size, rows, targets)
+
+        users, tweets = array("i"), array("i")
+        tweet_id, tweet_count = None, 0
+        likes = (
+            Like.objects.filter(created_at__gte=_like_window_start())
+            .order_by("tweet_id")
+            .values_list("tweet_id", "user_id")
+        )
+        # a tweet's likers are spread over their own shards
+        likes = heapq.merge(
+            *(
+                queryset.iterator(chunk_size=10000)
+                for queryset in likes.on_all_shards()
+            ),
+            key=itemgetter(0),
+        )
+        for like_tweet_id, user_id in likes:
+            user = self.index(user_id)
+            if user is None:
+                continue
+            if like_tweet_id != tweet_id:
+                tweet_id = like_tweet_id
+                tweet_count += 1
+            tweets.append(tweet_count - 1)
+            users.append(user)
+        self.liked = Adjacency(size, users, tweets)
+        self.likers = Adjacency(tweet_count, tweets, users)
+
+    def index(self, user_id):
+        # None for users created or deleted while the graph was loading
+        i = bisect_left(self.user_ids, user_id)
+        if i < len(self.user_ids) and self.user_ids[i] == user_id:
+            return i
+        return None
+
+    def suggest(self, i):
+        following = self.follows[i]
+        friends_of_friends = (k for j in following for k in self.follows[j])
+        co_likers = (
+            k
+            for tweet in self.liked[i]
+            if len(self.likers[tweet]) <= settings.SUGGESTIONS_MAX_LIKERS
+            for k in self.likers[tweet]
+        )
+        return [
+            (self.user_ids[k], score)
+            for k, score in rank(i, following, friends_of_friends, co_likers)
+        ]
+
+    def __iter__(self):
+        """Yield ``(user_id, suggestions)`` for every user."""
+        for i, user_id in enumerate(self.user_ids):
+            yield user_id, self.suggest(i)
+
+
+def suggest_for_user(user_id):
+    """Suggestions for one user with a few indexed queries, for refreshing a
+    user whose follows changed without loading the whole graph."""
+    following = list(
+        FriendShip.objects.filter(follow_id=user_id).values_list(
+            "followed_id", flat=True
+        )
+    )
+    friends_of_friends = FriendShip.objects.filter(follow_id__in=following).values_list(
+        "followed_id", flat=True
+    )
+    since = _like_window_start()
+    liked = list(
+        Like.objects.for_user(user_id)
+        .filter(created_at__gte=since)
+        .values_list("tweet_id", flat=True)
+    )
+    # the tweets, their likes and the user's likes can be on different shards
+    liked = [
+        pk
+        for tweets in Tweet.objects.filter(
+            pk__in=liked, like_count__lte=settings.SUGGESTIONS_MAX_LIKERS
+        ).on_all_shards()
+        for pk in tweets.values_list("pk", flat=True)
+    ]
+    co_likers = Like.objects.filter(tweet_id__in=liked, created_at__gte=since)
+    co_likers = chain.from_iterable(
+        queryset.values_list("user_id", flat=True).iterator()
+        for queryset in co_likers.on_all_shards()
+    )
+    return rank(user_id, following, friends_of_friends.iterator(), co_likers)
+
+
+def save_suggestions(suggestions):
+    """Replace the stored suggestions of the users in ``{user_id:
+    [(suggested_id, score), ...]}``."""
+    with transaction.atomic():
+        SuggestedUser.objects.filter(user_id__in=suggestions).delete()
+        SuggestedUser.objects.bulk_create(
+            [
+                SuggestedUser(user_id=user_id, suggested_id=suggested_id, score=score)
+                for user_id, ranked in suggestions.items()
+                for suggested_id, score in ranked
+            ]
+        )
+
+
+def get_suggestions(user):
+    return [
+        suggestion.suggested
+        for suggestion in SuggestedUser.objects.filter(user=user)
+        .select_related("suggested")
+        .only("suggested", "suggested__username")
+        .order_by("-score", "suggested_id")[: settings.SUGGESTIONS_PER_USER]
+    ]
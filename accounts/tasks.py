@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from jobs.queue import enqueue, register
+from mysite.cache import user_counters
+
+from .models import FriendShip
+from .suggestions import save_suggestions, suggest_for_user
+
+User = get_user_model()
+
+
+@register("accounts.recount_follows")
+def recount_follows(first_pk, last_pk):
+    following = (
+        FriendShip.objects.filter(follow=OuterRef("pk"))
+        .values("follow")
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    followers = (
+        FriendShip.objects.filter(followed=OuterRef("pk"))
+        .values("followed")
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    users = User.objects.filter(pk__gte=first_pk, pk__lte=last_pk)
+    updated = users.update(
+        following_count=Coalesce(Subquery(following), 0),
+        followers_count=Coalesce(Subquery(followers), 0),
+    )
+    user_counters.invalidate(*users.values_list("pk", flat=True))
+    return updated
+
+
+@register("accounts.refresh_suggestions")
+def refresh_suggestions(user_id):
+    save_suggestions({user_id: suggest_for_user(user_id)})
+
+
+def schedule_suggestions_refresh(user_id):
+    # one job per user and slot, run when the slot ends, so that a burst of
+    # follows is covered by a single refresh
+    seconds = settings.SUGGESTIONS_REFRESH_SECONDS
+    now = timezone.now()
+    slot = int(now.timestamp()) // seconds + 1
+    enqueue(
+        "accounts.refresh_suggestions",
+        {"user_id": user_id},
+        key=f"refresh_suggestions:{user_id}:{slot}",
+        run_after=now + timedelta(seconds=slot * seconds - now.timestamp()),
+    )
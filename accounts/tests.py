@@ -1,12 +1,26 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
 from django.contrib.auth import SESSION_KEY, get_user_model
 from django.contrib.messages import get_messages
-from django.test import TestCase
+from django.core import serializers
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 
+from jobs.models import Job
 from mysite import settings
-from tweets.models import Tweet
+from mysite.cache import profile_headers
+from tweets.models import Like, Tweet
+from tweets.tests import ShardedTestCase
 
-from .models import FriendShip
+from .models import FriendShip, SuggestedUser
+from .suggestions import suggest_for_user
+from .tasks import refresh_suggestions
 
 User = get_user_model()
 
@@ -281,9 +295,9 @@ class TestUserProfileView(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, "accounts/profile.html")
-        self.assertQuerysetEqual(
+        self.assertEqual(
             response.context["tweets"],
-            Tweet.objects.filter(user=self.user2).order_by("-created_at"),
+            list(Tweet.objects.filter(user=self.user2).order_by("-created_at")),
         )
         self.assertEqual(
             response.context["follow_count"],
@@ -294,6 +308,74 @@ class TestUserProfileView(TestCase):
             FriendShip.objects.filter(followed=self.user2).count(),
         )
 
+    @override_settings(TWEETS_PAGE_SIZE=2)
+    def test_success_get_paginated(self):
+        tweets = [
+            Tweet.objects.create(user=self.user2, content=f"new{i}") for i in range(3)
+        ]
+        url = reverse("accounts:user_profile", kwargs={"slug_username": "testuser2"})
+        response = self.client.get(url)
+        self.assertEqual(response.context["tweets"], tweets[:0:-1])
+        page = response.context["page"]
+        self.assertTrue(page.has_older)
+        self.assertContains(response, f"?older={page.older_cursor}")
+        response = self.client.get(url, {"older": page.older_cursor})
+        self.assertEqual(
+            response.context["tweets"],
+            [tweets[0], Tweet.objects.get(user=self.user2, content="tweet2")],
+        )
+        self.assertFalse(response.context["page"].has_older)
+        self.assertEqual(self.client.get(url, {"older": "invalid"}).status_code, 404)
+
+    def test_success_get_connected(self):
+        response = self.client.get(
+            reverse("accounts:user_profile", kwargs={"slug_username": "testuser1"})
+        )
+        self.assertTrue(response.context["connected"])
+        FriendShip.objects.filter(follow=self.user2, followed=self.user1).delete()
+        response = self.client.get(
+            reverse("accounts:user_profile", kwargs={"slug_username": "testuser1"})
+        )
+        self.assertFalse(response.context["connected"])
+
+
+class TestProfileCache(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(
+            username="testuser1", email="test@test.test", password="testpassword"
+        )
+        self.user2 = User.objects.create_user(
+            username="testuser2", email="test@test.test", password="testpassword"
+        )
+        self.client.login(username="testuser1", password="testpassword")
+
+    def get_profile(self, username):
+        return self.client.get(
+            reverse("accounts:user_profile", kwargs={"slug_username": username})
+        )
+
+    def test_success_cache_profile_header(self):
+        self.get_profile("testuser2")
+        header = profile_headers.get("testuser2")
+        self.assertEqual(header.pk, self.user2.pk)
+        self.assertEqual(header.get_deferred_fields() & {"password"}, {"password"})
+
+    def test_success_invalidate_counters_on_follow(self):
+        self.assertEqual(self.get_profile("testuser2").context["follower_count"], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("accounts:follow", kwargs={"username": "testuser2"})
+            )
+        self.assertEqual(self.get_profile("testuser2").context["follower_count"], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("accounts:unfollow", kwargs={"username": "testuser2"})
+            )
+        self.assertEqual(self.get_profile("testuser2").context["follower_count"], 0)
+
+    def test_failure_get_with_not_exist_user(self):
+        self.assertEqual(self.get_profile("testuser3").status_code, 404)
+
 
 class TestUserProfileEditView(TestCase):
     def test_success_get(self):
@@ -331,6 +413,23 @@ class TestFollowView(TestCase):
         self.assertTrue(
             FriendShip.objects.filter(follow=self.user1, followed=self.user2).exists()
         )
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user1.following_count, 1)
+        self.assertEqual(self.user2.followers_count, 1)
+
+    def test_success_post_reads_primary_afterwards(self):
+        response = self.client.post(
+            reverse("accounts:follow", kwargs={"username": "testuser2"})
+        )
+        self.assertIn(settings.REPLICA_STICKY_COOKIE, response.cookies)
+
+    def test_failure_get(self):
+        response = self.client.get(
+            reverse("accounts:follow", kwargs={"username": "testuser2"})
+        )
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(FriendShip.objects.count(), 0)
 
     def test_failure_post_with_not_exist_user(self):
         response = self.client.post(
@@ -342,6 +441,21 @@ class TestFollowView(TestCase):
         self.assertEqual(message, "testuser3は存在しません")
         self.assertEqual(FriendShip.objects.count(), 0)
 
+    def test_failure_post_with_followed_user(self):
+        FriendShip.objects.create(follow=self.user1, followed=self.user2)
+        response = self.client.post(
+            reverse("accounts:follow", kwargs={"username": "testuser2"}), None
+        )
+        self.assertEqual(response.status_code, 302)
+        messages = list(get_messages(response.wsgi_request))
+        self.assertEqual(str(messages[0]), "あなたはすでにtestuser2をフォローしています")
+        self.assertEqual(FriendShip.objects.count(), 1)
+
+    def test_failure_create_duplicated_friendship(self):
+        FriendShip.objects.create(follow=self.user1, followed=self.user2)
+        with self.assertRaises(IntegrityError):
+            FriendShip.objects.create(follow=self.user1, followed=self.user2)
+
     def test_failure_post_with_self(self):
         response = self.client.post(
             reverse("accounts:follow", kwargs={"username": "testuser1"}), None
@@ -375,6 +489,17 @@ class TestUnfollowView(TestCase):
             reverse("accounts:user_profile", kwargs={"slug_username": "testuser2"}),
         )
         self.assertEqual(FriendShip.objects.count(), 0)
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user1.following_count, 0)
+        self.assertEqual(self.user2.followers_count, 0)
+
+    def test_failure_get(self):
+        response = self.client.get(
+            reverse("accounts:unfollow", kwargs={"username": "testuser2"})
+        )
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(FriendShip.objects.count(), 1)
 
     def test_failure_post_with_not_exist_tweet(self):
         response = self.client.post(
@@ -397,6 +522,171 @@ class TestUnfollowView(TestCase):
         self.assertEqual(FriendShip.objects.count(), 1)
 
 
+class TestReconcileFollowCountsCommand(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(
+            username="testuser1", email="test@test.test", password="testpassword"
+        )
+        self.user2 = User.objects.create_user(
+            username="testuser2", email="test@test.test", password="testpassword"
+        )
+        FriendShip.objects.create(follow=self.user1, followed=self.user2)
+        User.objects.update(following_count=7, followers_count=7)
+
+    def test_success_reconcile(self):
+        call_command("reconcile_follow_counts", batch_size=1, stdout=StringIO())
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(
+            (self.user1.following_count, self.user1.followers_count), (1, 0)
+        )
+        self.assertEqual(
+            (self.user2.following_count, self.user2.followers_count), (0, 1)
+        )
+
+
+class TestShardedSuggestions(ShardedTestCase):
+    def test_success_likes_on_shard(self):
+        other = User.objects.create_user(
+            username="other", email="other@test.test", password="testpassword"
+        )
+        tweet = Tweet(user=other, content="tweet", like_count=2)
+        tweet.save()
+        for user in [self.user, other]:
+            Like(user=user, tweet=tweet).save()
+        self.assertEqual(suggest_for_user(self.user.pk), [(other.pk, 0.5)])
+        call_command("rebuild_suggestions", stdout=StringIO())
+        self.assertEqual(
+            list(SuggestedUser.objects.filter(user=self.user).values_list("suggested")),
+            [(other.pk,)],
+        )
+
+
+class TestSuggestions(TestCase):
+    def setUp(self):
+        self.users = {
+            name: User.objects.create_user(
+                username=name, email="test@test.test", password="testpassword"
+            )
+            for name in ["alice", "bob", "carol", "dave", "erin", "frank"]
+        }
+        for follow, followed in [
+            ("alice", "bob"),
+            ("alice", "carol"),
+            ("bob", "alice"),
+            ("bob", "dave"),
+            ("bob", "erin"),
+            ("carol", "bob"),
+            ("carol", "dave"),
+        ]:
+            FriendShip.objects.create(
+                follow=self.users[follow], followed=self.users[followed]
+            )
+        tweet = Tweet.objects.create(user=self.users["carol"], content="tweet")
+        for name in ["alice", "frank"]:
+            Like.objects.create(user=self.users[name], tweet=tweet)
+        Tweet.objects.filter(pk=tweet.pk).update(like_count=2)
+        self.client.login(username="alice", password="testpassword")
+
+    def suggested(self, name):
+        return [
+            (User.objects.get(pk=pk).username, score)
+            for pk, score in SuggestedUser.objects.filter(user=self.users[name])
+            .order_by("-score")
+            .values_list("suggested", "score")
+        ]
+
+    def test_success_rebuild_command(self):
+        out = StringIO()
+        call_command("rebuild_suggestions", batch_size=4, stdout=out)
+        self.assertIn("6人", out.getvalue())
+        self.assertEqual(
+            self.suggested("alice"), [("dave", 2.0), ("erin", 1.0), ("frank", 0.5)]
+        )
+        for user in self.users.values():
+            self.assertEqual(
+                [(pk, score) for pk, score in suggest_for_user(user.pk)],
+                list(
+                    SuggestedUser.objects.filter(user=user)
+                    .order_by("-score", "suggested")
+                    .values_list("suggested", "score")
+                ),
+            )
+
+    def test_success_skip_popular_tweets(self):
+        with self.settings(SUGGESTIONS_MAX_LIKERS=1):
+            call_command("rebuild_suggestions", stdout=StringIO())
+            self.assertEqual(suggest_for_user(self.users["alice"].pk)[-1][1], 1.0)
+        self.assertEqual(self.suggested("alice"), [("dave", 2.0), ("erin", 1.0)])
+
+    def test_success_refresh_on_follow(self):
+        call_command("rebuild_suggestions", stdout=StringIO())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("accounts:follow", kwargs={"username": "dave"}))
+        self.assertEqual(self.suggested("alice"), [("erin", 1.0), ("frank", 0.5)])
+        self.assertTrue(
+            Job.objects.filter(
+                name="accounts.refresh_suggestions",
+                payload={"user_id": self.users["alice"].pk},
+            ).exists()
+        )
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": "bob"}))
+        refresh_suggestions(self.users["alice"].pk)
+        self.assertEqual(self.suggested("alice"), [("bob", 1.0), ("frank", 0.5)])
+
+    def test_success_one_refresh_per_burst(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for username in ["dave", "erin"]:
+                self.client.post(
+                    reverse("accounts:follow", kwargs={"username": username})
+                )
+            self.client.post(reverse("accounts:unfollow", kwargs={"username": "bob"}))
+        jobs = Job.objects.filter(name="accounts.refresh_suggestions")
+        self.assertEqual(
+            list(jobs.values_list("payload", flat=True)),
+            [{"user_id": self.users["alice"].pk}],
+        )
+        self.assertGreater(jobs.get().run_after, timezone.now())
+
+    def test_success_skip_on_loaddata(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "follows.json")
+            with open(path, "w") as fixture:
+                serializers.serialize(
+                    "json",
+                    [
+                        FriendShip(
+                            follow=self.users["alice"], followed=self.users["erin"]
+                        )
+                    ],
+                    stream=fixture,
+                )
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command("loaddata", path, stdout=StringIO())
+        self.assertTrue(
+            FriendShip.objects.filter(
+                follow=self.users["alice"], followed=self.users["erin"]
+            ).exists()
+        )
+        self.assertEqual(User.objects.get(username="alice").following_count, 2)
+        self.assertEqual(User.objects.get(username="erin").followers_count, 1)
+        self.assertFalse(Job.objects.exists())
+
+    def test_success_show_on_profile_and_home(self):
+        call_command("rebuild_suggestions", stdout=StringIO())
+        profile = reverse("accounts:user_profile", kwargs={"slug_username": "erin"})
+        for url in [profile, reverse("tweets:home")]:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(
+                    response.context["suggestions"],
+                    [self.users["dave"], self.users["erin"], self.users["frank"]],
+                )
+                self.assertContains(
+                    response, reverse("accounts:follow", kwargs={"username": "frank"})
+                )
+
+
 class TestFollowingListView(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -423,3 +713,68 @@ class TestFollowerListView(TestCase):
             reverse("accounts:follower_list", kwargs={"username": "testuser"})
         )
         self.assertEqual(response.status_code, 200)
+
+
+@override_settings(FOLLOW_LIST_PAGE_SIZE=2)
+class TestFollowListPagination(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="test@test.test", password="testpassword"
+        )
+        self.others = [
+            User.objects.create_user(
+                username=f"other{i}", email="test@test.test", password="testpassword"
+            )
+            for i in range(3)
+        ]
+        for other in self.others:
+            FriendShip.objects.create(follow=self.user, followed=other)
+            FriendShip.objects.create(follow=other, followed=self.user)
+        self.client.login(username="testuser", password="testpassword")
+
+    def test_success_get_following_pages(self):
+        url = reverse("accounts:following_list", kwargs={"username": "testuser"})
+        response = self.client.get(url)
+        self.assertEqual(response.context["follow_count"], 3)
+        self.assertEqual(
+            [f.followed for f in response.context["followings"]],
+            [self.others[2], self.others[1]],
+        )
+        response = self.client.get(
+            url, {"older": response.context["page"].older_cursor}
+        )
+        self.assertEqual(
+            [f.followed for f in response.context["followings"]], [self.others[0]]
+        )
+        self.assertFalse(response.context["page"].has_older)
+
+    def test_success_get_follower_pages(self):
+        url = reverse("accounts:follower_list", kwargs={"username": "testuser"})
+        response = self.client.get(url)
+        self.assertEqual(response.context["followed_count"], 3)
+        self.assertEqual(len(response.context["followers"]), 2)
+        self.assertTrue(response.context["page"].has_older)
+
+    def test_failure_get_with_not_exist_user(self):
+        response = self.client.get(
+            reverse("accounts:following_list", kwargs={"username": "nobody"})
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_success_export(self):
+        response = self.client.get(
+            reverse("accounts:follower_export", kwargs={"username": "testuser"})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            json.loads(b"".join(response.streaming_content)),
+            [
+                {"id": other.id, "username": other.username}
+                for other in self.others[::-1]
+            ],
+        )
+        response = self.client.get(
+            reverse("accounts:following_export", kwargs={"username": "testuser"})
+        )
+        self.assertEqual(len(json.loads(b"".join(response.streaming_content))), 3)
@@ -25,6 +25,16 @@ urlpatterns = [
         views.FollowerListView.as_view(),
         name="follower_list",
     ),
+    path(
+        "<str:username>/following_list/export/",
+        views.following_export_view,
+        name="following_export",
+    ),
+    path(
+        "<str:username>/follower_list/export/",
+        views.follower_export_view,
+        name="follower_export",
+    ),
     path("<str:username>/follow/", views.follow_view, name="follow"),
     path("<str:username>/unfollow/", views.unfollow_view, name="unfollow"),
 ]
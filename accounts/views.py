@@ -1,15 +1,26 @@
+import json
+
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, get_user_model, login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import Http404, HttpResponseRedirect
+from django.db import transaction
+from django.http import Http404, HttpResponseRedirect, StreamingHttpResponse
 from django.urls import reverse_lazy
+from django.views.decorators.http import require_POST
 from django.views.generic import CreateView, DetailView, TemplateView
 
 from accounts.models import FriendShip
-from tweets.models import Like, Tweet
+from jobs.queue import enqueue
+from mysite.cache import profile_headers, user_counters
+from mysite.pagination import KeysetPaginator
+from tweets.models import Tweet
+from tweets.timeline import remove_from_timeline
+from tweets.viewer import get_viewer_state
 
 from .forms import SignUpForm
+from .suggestions import get_suggestions
 
 User = get_user_model()
 
@@ -29,6 +40,29 @@ class SignUpView(CreateView):
         return response
 
 
+def get_profile_or_404(username):
+    # Only the identity columns are cached; counts live in user_counters and
+    # credentials never leave the database.
+    user = profile_headers.get_or_set(
+        username,
+        lambda: User.objects.only("id", "username", "slug_username")
+        .filter(slug_username=username)
+        .first(),
+    )
+    if user is None:
+        raise Http404()
+    return user
+
+
+def get_user_counters(user):
+    return user_counters.get_or_set(
+        user.pk,
+        lambda: User.objects.filter(pk=user.pk)
+        .values("following_count", "followers_count")
+        .get(),
+    )
+
+
 class UserProfileView(LoginRequiredMixin, DetailView):
     model = User
     template_name = "accounts/profile.html"
@@ -36,33 +70,35 @@ class UserProfileView(LoginRequiredMixin, DetailView):
     slug_field = "slug_username"
     slug_url_kwarg = "slug_username"
 
+    def get_object(self, queryset=None):
+        return get_profile_or_404(self.kwargs["slug_username"])
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["tweets"] = (
-            Tweet.objects.filter(user__username=self.kwargs["slug_username"])
-            .select_related("user")
-            .prefetch_related("like_set")
-            .order_by("-created_at")
+        # all of a user's tweets are on one shard, in their (user, created_at,
+        # id) index
+        paginator = KeysetPaginator(
+            Tweet.objects.for_user(self.object.pk).with_users(),
+            settings.TWEETS_PAGE_SIZE,
+        )
+        context["page"] = paginator.get_page(
+            older=self.request.GET.get("older"), newer=self.request.GET.get("newer")
         )
-        context["follow_count"] = FriendShip.objects.filter(
-            follow__username=self.kwargs["slug_username"]
-        ).count()
-        context["follower_count"] = FriendShip.objects.filter(
-            followed__username=self.kwargs["slug_username"]
-        ).count()
-        if self.request.user.username is not self.kwargs["slug_username"]:
-            result = FriendShip.objects.filter(
-                follow__username=self.request.user.username
-            ).filter(followed__username=self.kwargs["slug_username"])
-            context["connected"] = True if result else False
-        context["liked_list"] = Like.objects.filter(user=self.request.user).values_list(
-            "tweet", flat=True
+        context["tweets"] = context["page"].object_list
+        counters = get_user_counters(self.object)
+        context["follow_count"] = counters["following_count"]
+        context["follower_count"] = counters["followers_count"]
+        context["viewer"] = get_viewer_state(self.request).load(
+            tweets=context["tweets"], users=[self.object]
         )
+        context["connected"] = context["viewer"].is_following(self.object)
+        context["suggestions"] = get_suggestions(self.request.user)
 
         return context
 
 
 @login_required
+@require_POST
 def follow_view(request, *args, **kwargs):
     try:
         follow = User.objects.get(username=request.user.username)
@@ -73,7 +109,16 @@ def follow_view(request, *args, **kwargs):
     if follow == followed:
         messages.warning(request, "自分自身はフォローできません")
     else:
-        _, created = FriendShip.objects.get_or_create(follow=follow, followed=followed)
+        with transaction.atomic():
+            friendship, created = FriendShip.objects.get_or_create(
+                follow=follow, followed=followed
+            )
+            if created:
+                enqueue(
+                    "tweets.backfill_timeline",
+                    {"user_id": follow.pk, "followed_id": followed.pk},
+                    key=f"backfill_timeline:{friendship.pk}",
+                )
 
         if created:
             messages.success(request, f"あなたは{followed.username}をフォローしました")
@@ -88,6 +133,7 @@ def follow_view(request, *args, **kwargs):
 
 
 @login_required
+@require_POST
 def unfollow_view(request, *args, **kwargs):
     try:
         follow = User.objects.get(username=request.user.username)
@@ -95,8 +141,13 @@ def unfollow_view(request, *args, **kwargs):
         if follow == followed:
             messages.warning(request, "自分自身に対してフォローやフォロー解除はできません")
         else:
-            unfollow = FriendShip.objects.get(follow=follow, followed=followed)
-            unfollow.delete()
+            with transaction.atomic():
+                deleted, _ = FriendShip.objects.filter(
+                    follow=follow, followed=followed
+                ).delete()
+                if not deleted:
+                    raise FriendShip.DoesNotExist()
+                remove_from_timeline(follow, followed)
             messages.success(request, f"あなたは{followed.username}をフォロー解除しました")
     except User.DoesNotExist:
         messages.warning(request, f"{kwargs['username']}は存在しません")
@@ -111,18 +162,41 @@ def unfollow_view(request, *args, **kwargs):
     )
 
 
+def get_follow_list_page(request, queryset):
+    paginator = KeysetPaginator(queryset, settings.FOLLOW_LIST_PAGE_SIZE, keys=("id",))
+    return paginator.get_page(
+        older=request.GET.get("older"), newer=request.GET.get("newer")
+    )
+
+
+def stream_follow_list(queryset, field):
+    def rows():
+        yield "["
+        usernames = (
+            queryset.order_by("-id")
+            .values_list(f"{field}_id", f"{field}__username")
+            .iterator(chunk_size=settings.FOLLOW_EXPORT_CHUNK_SIZE)
+        )
+        for i, (pk, username) in enumerate(usernames):
+            yield ("," if i else "") + json.dumps({"id": pk, "username": username})
+        yield "]"
+
+    return StreamingHttpResponse(rows(), content_type="application/json")
+
+
 class FollowingListView(LoginRequiredMixin, TemplateView):
     template_name = "accounts/following_list.html"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        user = get_profile_or_404(kwargs["username"])
         context["username"] = kwargs["username"]
-        context["followings"] = FriendShip.objects.select_related(
-            "follow", "followed"
-        ).filter(follow__username=self.kwargs["username"])
-        context["follow_count"] = FriendShip.objects.filter(
-            follow__username=self.kwargs["username"]
-        ).count()
+        context["page"] = get_follow_list_page(
+            self.request,
+            FriendShip.objects.filter(follow=user).select_related("followed"),
+        )
+        context["followings"] = context["page"].object_list
+        context["follow_count"] = get_user_counters(user)["following_count"]
         return context
 
 
@@ -131,11 +205,24 @@ class FollowerListView(LoginRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        user = get_profile_or_404(kwargs["username"])
         context["username"] = kwargs["username"]
-        context["followers"] = FriendShip.objects.select_related(
-            "follow", "followed"
-        ).filter(followed__username=self.kwargs["username"])
-        context["followed_count"] = FriendShip.objects.filter(
-            followed__username=self.kwargs["username"]
-        ).count()
+        context["page"] = get_follow_list_page(
+            self.request,
+            FriendShip.objects.filter(followed=user).select_related("follow"),
+        )
+        context["followers"] = context["page"].object_list
+        context["followed_count"] = get_user_counters(user)["followers_count"]
         return context
+
+
+@login_required
+def following_export_view(request, username):
+    user = get_profile_or_404(username)
+    return stream_follow_list(FriendShip.objects.filter(follow=user), "followed")
+
+
+@login_required
+def follower_export_view(request, username):
+    user = get_profile_or_404(username)
+    return stream_follow_list(FriendShip.objects.filter(followed=user), "follow")
@@ -0,0 +1,168 @@
+"""Compare the sync and async tweets views under concurrent load.
+
+Starts the ASGI server twice, once with TWEETS_ASYNC_VIEWS=0 and once with
+TWEETS_ASYNC_VIEWS=1, drives each with a small keep-alive HTTP/1.1 load
+generator and prints requests/sec and latency percentiles per endpoint.
+
+    python benchmarks/async_views.py --username alice --password secret
+
+The user must exist and should have a populated timeline. Needs uvicorn
+(or pass another server with --server).
+"""
+import argparse
+import asyncio
+import http.cookiejar
+import os
+import re
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER = (
+    "uvicorn mysite.asgi:application --host 127.0.0.1 --port {port} --log-level warning"
+)
+
+
+def login(base_url, username, password):
+    """Log in through the login form and return the cookie header and the
+    CSRF token for POST requests."""
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    page = opener.open(f"{base_url}/accounts/login/").read().decode()
+    token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', page).group(1)
+    data = urllib.parse.urlencode(
+        {"username": username, "password": password, "csrfmiddlewaretoken": token}
+    ).encode()
+    opener.open(f"{base_url}/accounts/login/", data)
+    cookies = {cookie.name: cookie.value for cookie in jar}
+    if "sessionid" not in cookies:
+        sys.exit("login failed")
+    cookie = "; ".join(f"{name}={value}" for name, value in cookies.items())
+    return cookie, cookies["csrftoken"]
+
+
+async def worker(host, port, requests, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while requests:
+            request = requests.pop()
+            started = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode().partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+def build_request(method, path, host, cookie, csrf_token):
+    lines = [
+        f"{method} {path} HTTP/1.1",
+        f"Host: {host}",
+        f"Cookie: {cookie}",
+        f"X-CSRFToken: {csrf_token}",
+        f"Referer: http://{host}/",
+        "Content-Length: 0",
+        "",
+        "",
+    ]
+    return "\r\n".join(lines).encode()
+
+
+async def load(host, port, method, path, total, concurrency, cookie, csrf_token):
+    request = build_request(method, path, f"{host}:{port}", cookie, csrf_token)
+    requests = [request] * total
+    latencies, errors = [], []
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(worker(host, port, requests, latencies, errors) for _ in range(concurrency))
+    )
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "errors": len(errors),
+    }
+
+
+def wait_for_server(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"{base_url}/accounts/login/")
+            return
+        except OSError:
+            time.sleep(0.2)
+    sys.exit("server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--tweet-id", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--server", default=SERVER)
+    args = parser.parse_args()
+
+    host = "127.0.0.1"
+    base_url = f"http://{host}:{args.port}"
+    endpoints = [
+        ("GET", "/tweets/home/"),
+        ("GET", f"/tweets/{args.tweet_id}/"),
+        ("POST", f"/tweets/{args.tweet_id}/like/"),
+        ("POST", f"/tweets/{args.tweet_id}/unlike/"),
+    ]
+    print(
+        f"{'views':6} {'endpoint':28} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}"
+    )
+    for mode in ("sync", "async"):
+        env = dict(os.environ, TWEETS_ASYNC_VIEWS="1" if mode == "async" else "0")
+        server = subprocess.Popen(
+            args.server.format(port=args.port).split(), cwd=BASE_DIR, env=env
+        )
+        try:
+            wait_for_server(base_url)
+            cookie, csrf_token = login(base_url, args.username, args.password)
+            for method, path in endpoints:
+                result = asyncio.run(
+                    load(
+                        host,
+                        args.port,
+                        method,
+                        path,
+                        args.requests,
+                        args.concurrency,
+                        cookie,
+                        csrf_token,
+                    )
+                )
+                print(
+                    f"{mode:6} {method + ' ' + path:28} {result['rps']:8.1f} "
+                    f"{result['p50']:8.1f} {result['p99']:8.1f} {result['errors']:6}"
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Compare write throughput of the database profiles under like/follow load.
+
+Runs the same workload once per DATABASE_PROFILE, each in its own process
+against a fresh database: --threads threads like/unlike tweets and
+follow/unfollow users through the app's own write paths for --seconds, and
+the committed operations/sec and "database is locked" failures are printed.
+
+    python benchmarks/db_writes.py --profiles sqlite-plain sqlite
+
+SQLite databases are created in a temporary directory. The postgresql
+profile migrates whatever database the POSTGRES_* variables point at, so
+only use it with a scratch database.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def like_or_unlike(user, tweet):
+    from tweets.likes import like_tweet, unlike_tweet
+
+    if not like_tweet(user, tweet.pk):
+        unlike_tweet(user, tweet.pk)
+
+
+def follow_or_unfollow(user, other):
+    from django.db import transaction
+
+    from accounts.models import FriendShip
+
+    with transaction.atomic():
+        _, created = FriendShip.objects.get_or_create(follow=user, followed=other)
+        if not created:
+            FriendShip.objects.filter(follow=user, followed=other).delete()
+
+
+def run_worker(args):
+    sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+    import django
+
+    django.setup()
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.db import OperationalError, connection
+
+    from tweets.models import Tweet
+
+    User = get_user_model()
+    call_command("migrate", verbosity=0)
+    User.objects.bulk_create(
+        [
+            User(username=f"bench{i}", slug_username=f"bench{i}")
+            for i in range(args.users)
+        ]
+    )
+    users = list(User.objects.filter(username__startswith="bench"))
+    Tweet.objects.bulk_create(
+        [
+            Tweet(user=users[i % len(users)], content=f"tweet {i}")
+            for i in range(args.tweets)
+        ]
+    )
+    tweets = list(Tweet.objects.all())
+    connection.close()
+
+    done, locked = [], []
+    deadline = time.monotonic() + args.seconds
+
+    def work(seed):
+        rng = random.Random(seed)
+        ops = errors = 0
+        try:
+            while time.monotonic() < deadline:
+                user = rng.choice(users)
+                try:
+                    if rng.random() < 0.5:
+                        like_or_unlike(user, rng.choice(tweets))
+                    else:
+                        other = rng.choice(users)
+                        if other != user:
+                            follow_or_unfollow(user, other)
+                    ops += 1
+                except OperationalError:
+                    errors += 1
+        finally:
+            connection.close()
+            done.append(ops)
+            locked.append(errors)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    print(json.dumps({"ops": sum(done) / elapsed, "locked": sum(locked)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", nargs="+", default=["sqlite-plain", "sqlite"])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--tweets", type=int, default=1000)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker(args)
+        return
+
+    print(f"{'profile':14} {'ops/s':>8} {'locked':>8}")
+    for profile in args.profiles:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DATABASE_PROFILE=profile,
+                SQLITE_PATH=os.path.join(tmp, "bench.sqlite3"),
+            )
+            output = subprocess.run(
+                [sys.executable, __file__, "--worker", *sys.argv[1:]],
+                env=env,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+        result = json.loads(output.splitlines()[-1])
+        print(f"{profile:14} {result['ops']:8.1f} {result['locked']:8}")
+
+
+if __name__ == "__main__":
+    main()
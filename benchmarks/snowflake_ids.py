@@ -0,0 +1,62 @@
+"""Measure snowflake id generation throughput per process.
+
+Starts --processes processes that generate ids for --seconds through
+mysite.snowflake.next_id, the same call the Tweet and Like primary keys use.
+Each process leases its own worker id, so the database must be migrated.
+Prints ids/sec per process and in total, and checks that no id was generated
+twice.
+
+    python benchmarks/snowflake_ids.py --processes 1 2 4
+
+A generator hands out at most 4096 ids per millisecond, so a single process
+cannot exceed about 4M ids/sec whatever the hardware.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def generate(seconds):
+    sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+    os.environ["SNOWFLAKE_IDS"] = "1"
+    import django
+
+    django.setup()
+    from mysite.snowflake import next_id
+
+    ids = []
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    while time.perf_counter() < deadline:
+        # check the clock once per thousand ids, not per id
+        for _ in range(1000):
+            ids.append(next_id())
+    return ids, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+
+    print(f"{'processes':>9} {'ids/s/process':>14} {'ids/s total':>12} {'unique':>7}")
+    for processes in args.processes:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(generate, [args.seconds] * processes)
+        rates = [len(ids) / elapsed for ids, elapsed in results]
+        total = sum(len(ids) for ids, _ in results)
+        unique = len({i for ids, _ in results for i in ids}) == total
+        print(
+            f"{processes:9} {sum(rates) / processes:14,.0f} {sum(rates):12,.0f} "
+            f"{'yes' if unique else 'NO':>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from jobs.queue import claim_batch, prune_jobs, run_job
+
+# seconds between two deletions of old finished jobs
+PRUNE_INTERVAL = 3600
+
+
+def _forget_connections():
+    # A forked child shares the parent's sockets: closing a connection there
+    # would end the parent's session (PostgreSQL sends Terminate on the
+    # socket). Dropping the objects lets the child open its own.
+    for connection in connections.all():
+        connection.connection = None
+
+
+def _run(job_id):
+    # every pool thread/process holds its own connection
+    close_old_connections()
+    try:
+        return run_job(job_id)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--batch-size", type=int, default=20)
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+        parser.add_argument(
+            "--processes",
+            action="store_true",
+            help="Use a process pool instead of a thread pool.",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit once the queue is empty."
+        )
+
+    def handle(self, *args, **options):
+        processes = options["processes"]
+        if processes:
+            executor = ProcessPoolExecutor(
+                options["workers"], initializer=_forget_connections
+            )
+        else:
+            executor = ThreadPoolExecutor(options["workers"])
+        done = failed = 0
+        prune_at = 0
+        with executor:
+            while True:
+                if time.monotonic() >= prune_at:
+                    prune_jobs()
+                    prune_at = time.monotonic() + PRUNE_INTERVAL
+                job_ids = claim_batch(options["batch_size"])
+                if not job_ids:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+                    continue
+                if processes:
+                    # the pool forks when a job is submitted, and the claim
+                    # has just reopened this process's connections
+                    connections.close_all()
+                for ok in executor.map(_run, job_ids):
+                    done += ok
+                    failed += not ok
+        self.stdout.write(self.style.SUCCESS(f"{done}件のジョブを実行しました（失敗: {failed}件）"))
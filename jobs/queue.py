@@ -0,0 +1,121 @@
+import logging
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+handlers = {}
+
+
+def register(name):
+    """Register a job handler. A job can run more than once (retries, expired
+    leases), so handlers must be idempotent."""
+
+    def decorator(func):
+        handlers[name] = func
+        return func
+
+    return decorator
+
+
+def enqueue(name, payload=None, key=None, max_attempts=None, run_after=None):
+    """Queue ``name`` to run with ``payload`` once the current transaction
+    commits. Jobs sharing an idempotency ``key`` are only ever queued once,
+    as long as the first one is kept (see prune_jobs).
+    """
+    payload = payload or {}
+    if settings.JOBS_EAGER:
+        transaction.on_commit(lambda: handlers[name](**payload))
+        return
+    job = Job(
+        name=name,
+        payload=payload,
+        idempotency_key=key,
+        max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS,
+        run_after=run_after or timezone.now(),
+    )
+    transaction.on_commit(lambda: Job.objects.bulk_create([job], ignore_conflicts=True))
+
+
+def claim_batch(size):
+    """Lease up to ``size`` runnable jobs to this worker and return their ids.
+
+    Jobs whose lease has expired (their worker died) become runnable again.
+    The conditional update is what claims a job, so concurrent workers never
+    run the same job twice.
+    """
+    now = timezone.now()
+    runnable = Q(status=Job.Status.PENDING, run_after__lte=now) | Q(
+        status=Job.Status.RUNNING, locked_until__lt=now
+    )
+    ids = list(
+        Job.objects.filter(runnable)
+        .order_by("run_after", "id")
+        .values_list("id", flat=True)[:size]
+    )
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    Job.objects.filter(runnable, id__in=ids).update(
+        status=Job.Status.RUNNING,
+        locked_by=token,
+        locked_until=now + timedelta(seconds=settings.JOBS_LEASE),
+        attempts=F("attempts") + 1,
+    )
+    return list(Job.objects.filter(locked_by=token).values_list("id", flat=True))
+
+
+def run_job(job_id):
+    job = Job.objects.get(pk=job_id)
+    try:
+        handlers[job.name](**job.payload)
+    except Exception:
+        logger.exception("job %s (%s) failed", job.pk, job.name)
+        fail_job(job, traceback.format_exc())
+        return False
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.Status.DONE, locked_by="", locked_until=None, last_error=""
+    )
+    return True
+
+
+def fail_job(job, error):
+    if job.attempts >= job.max_attempts:
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.Status.FAILED, locked_by="", locked_until=None, last_error=error
+        )
+        return
+    # exponential backoff: delay, 2 * delay, 4 * delay, ...
+    delay = settings.JOBS_RETRY_DELAY * 2 ** (job.attempts - 1)
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.Status.PENDING,
+        run_after=timezone.now() + timedelta(seconds=delay),
+        locked_by="",
+        locked_until=None,
+        last_error=error,
+    )
+
+
+def prune_jobs(batch_size=1000):
+    """Delete the jobs that finished (done or failed for good) more than
+    JOBS_RETENTION seconds ago, in batches, and return how many."""
+    if settings.JOBS_RETENTION is None:
+        return 0
+    cutoff = timezone.now() - timedelta(seconds=settings.JOBS_RETENTION)
+    finished = Job.objects.filter(
+        status__in=[Job.Status.DONE, Job.Status.FAILED], updated_at__lt=cutoff
+    )
+    deleted = 0
+    while True:
+        pks = list(finished.values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += Job.objects.filter(pk__in=pks).delete()[0]
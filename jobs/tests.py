@@ -0,0 +1,176 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .management.commands import runjobs
+from .models import Job
+from .queue import claim_batch, enqueue, handlers, prune_jobs, register, run_job
+
+calls = []
+
+
+@register("jobs.tests.record")
+def record(value):
+    calls.append(value)
+
+
+@register("jobs.tests.fail")
+def fail():
+    raise ValueError("fail")
+
+
+class TestEnqueue(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_success_enqueue_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            enqueue("jobs.tests.record", {"value": 1})
+            self.assertEqual(Job.objects.count(), 0)
+        self.assertEqual(len(callbacks), 1)
+        job = Job.objects.get()
+        self.assertEqual(job.payload, {"value": 1})
+        self.assertEqual(job.status, Job.Status.PENDING)
+
+    def test_success_enqueue_with_idempotency_key(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue("jobs.tests.record", {"value": 1}, key="record:1")
+            enqueue("jobs.tests.record", {"value": 1}, key="record:1")
+        self.assertEqual(Job.objects.count(), 1)
+
+    @override_settings(JOBS_EAGER=True)
+    def test_success_enqueue_eager(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue("jobs.tests.record", {"value": 1})
+        self.assertEqual(calls, [1])
+        self.assertEqual(Job.objects.count(), 0)
+
+
+class TestRunJob(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_success_run(self):
+        job = Job.objects.create(name="jobs.tests.record", payload={"value": 2})
+        self.assertEqual(claim_batch(10), [job.pk])
+        self.assertEqual(claim_batch(10), [])
+        self.assertTrue(run_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.DONE)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(calls, [2])
+
+    def test_success_claim_skips_future_jobs(self):
+        Job.objects.create(
+            name="jobs.tests.record",
+            payload={"value": 2},
+            run_after=timezone.now() + timedelta(minutes=1),
+        )
+        self.assertEqual(claim_batch(10), [])
+
+    def test_success_claim_expired_lease(self):
+        job = Job.objects.create(
+            name="jobs.tests.record",
+            payload={"value": 2},
+            status=Job.Status.RUNNING,
+            locked_until=timezone.now() - timedelta(seconds=1),
+        )
+        self.assertEqual(claim_batch(10), [job.pk])
+
+    def test_failure_retry_with_backoff(self):
+        job = Job.objects.create(name="jobs.tests.fail", max_attempts=2)
+        claim_batch(10)
+        with self.assertLogs("jobs.queue", level="ERROR"):
+            self.assertFalse(run_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.PENDING)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn("ValueError", job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        claim_batch(10)
+        with self.assertLogs("jobs.queue", level="ERROR"):
+            self.assertFalse(run_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+
+class TestRunJobsCommand(TransactionTestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_success_run_once(self):
+        for value in range(5):
+            Job.objects.create(name="jobs.tests.record", payload={"value": value})
+        call_command("runjobs", once=True, workers=2, batch_size=2, stdout=StringIO())
+        self.assertEqual(sorted(calls), [0, 1, 2, 3, 4])
+        self.assertEqual(Job.objects.filter(status=Job.Status.DONE).count(), 5)
+
+    def test_success_processes_close_connections_before_dispatch(self):
+        events = []
+
+        class Executor(ThreadPoolExecutor):
+            # stands in for the process pool, which forks on dispatch
+            def __init__(self, workers, initializer):
+                super().__init__(workers)
+
+            def map(self, fn, *iterables):
+                events.append("dispatch")
+                return super().map(fn, *iterables)
+
+        for value in range(3):
+            Job.objects.create(name="jobs.tests.record", payload={"value": value})
+        with mock.patch.object(runjobs, "ProcessPoolExecutor", Executor):
+            with mock.patch.object(
+                runjobs.connections, "close_all", lambda: events.append("close")
+            ):
+                call_command(
+                    "runjobs",
+                    once=True,
+                    processes=True,
+                    batch_size=2,
+                    stdout=StringIO(),
+                )
+        self.assertEqual(events, ["close", "dispatch", "close", "dispatch"])
+
+    def test_success_forget_connections_without_closing(self):
+        connection = connections["default"]
+        connection.ensure_connection()
+        inherited = connection.connection
+        self.addCleanup(setattr, connection, "connection", inherited)
+        runjobs._forget_connections()
+        self.assertIsNone(connection.connection)
+        # still open for the parent process
+        inherited.execute("SELECT 1")
+
+    def test_success_registered_handlers(self):
+        self.assertIn("tweets.fan_out_tweet", handlers)
+
+
+class TestPruneJobs(TestCase):
+    def test_success_prune_old_finished_jobs(self):
+        statuses = [Job.Status.DONE, Job.Status.FAILED, Job.Status.PENDING]
+        old = [Job.objects.create(name="old", status=status) for status in statuses]
+        Job.objects.filter(pk__in=[job.pk for job in old]).update(
+            updated_at=timezone.now() - timedelta(days=8)
+        )
+        recent = Job.objects.create(name="recent", status=Job.Status.DONE)
+        self.assertEqual(prune_jobs(batch_size=1), 2)
+        self.assertEqual(
+            set(Job.objects.values_list("pk", flat=True)), {old[2].pk, recent.pk}
+        )
+
+    def test_success_keep_forever(self):
+        job = Job.objects.create(name="old", status=Job.Status.DONE)
+        Job.objects.filter(pk=job.pk).update(
+            updated_at=timezone.now() - timedelta(days=8)
+        )
+        with self.settings(JOBS_RETENTION=None):
+            self.assertEqual(prune_jobs(), 0)
@@ -13,4 +13,36 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from asgiref.sync import sync_to_async  # noqa: E402
+from django.db import connections  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from tweets.stream import event_stream  # noqa: E402
+
+EVENTS_PATH = reverse('tweets:events')
+
+
+async def lifespan(scope, receive, send):
+    # Django's handler rejects lifespan scopes; answer them so servers can
+    # tell startup finished and shut workers down cleanly.
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await sync_to_async(connections.close_all)()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    # Server-sent events are long-lived streams; they bypass the Django
+    # handler, which would tie up a thread per connection.
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+    elif scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+        await event_stream(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -0,0 +1,28 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """The sqlite3 backend plus the ``init_command`` and ``transaction_mode``
+    OPTIONS that Django 5.1 added, so that pragmas can be set on every new
+    connection. Switch ENGINE back once on 5.1."""
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.init_command = params.pop("init_command", "")
+        self.transaction_mode = params.pop("transaction_mode", None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        if self.init_command:
+            conn.executescript(self.init_command)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        # IMMEDIATE takes the write lock up front: a deferred transaction
+        # that reads first and then writes fails at once with "database is
+        # locked" when another writer got in between, busy timeout or not.
+        if self.transaction_mode:
+            self.cursor().execute(f"BEGIN {self.transaction_mode}")
+        else:
+            super()._start_transaction_under_autocommit()
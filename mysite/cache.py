@@ -0,0 +1,158 @@
+import threading
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+MISSING = object()
+
+
+class CacheMetrics:
+    """Hit/miss counters per key family.
+
+    Counts are buffered in-process and added to the shared cache every
+    ``CACHE_METRICS_FLUSH_EVERY`` lookups, so that every worker process
+    reports into the same totals without an extra round trip per lookup.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = Counter()
+
+    @property
+    def cache(self):
+        return caches[settings.CACHE_ALIAS]
+
+    def record(self, family, hit, count=1):
+        if not count:
+            return
+        with self.lock:
+            self.pending[(family, "hits" if hit else "misses")] += count
+            if sum(self.pending.values()) < settings.CACHE_METRICS_FLUSH_EVERY:
+                return
+            pending, self.pending = self.pending, Counter()
+        self.flush(pending)
+
+    def flush(self, pending=None):
+        if pending is None:
+            with self.lock:
+                pending, self.pending = self.pending, Counter()
+        for (family, kind), count in pending.items():
+            key = f"metrics:{family}:{kind}"
+            self.cache.add(key, 0, timeout=None)
+            self.cache.incr(key, count)
+
+    def stats(self):
+        self.flush()
+        keys = {
+            (family, kind): f"metrics:{family}:{kind}"
+            for family in families
+            for kind in ("hits", "misses")
+        }
+        values = self.cache.get_many(keys.values())
+        return {
+            family: {
+                kind: values.get(keys[(family, kind)], 0) for kind in ("hits", "misses")
+            }
+            for family in families
+        }
+
+    def reset(self):
+        with self.lock:
+            self.pending.clear()
+        self.cache.delete_many(
+            [
+                f"metrics:{family}:{kind}"
+                for family in families
+                for kind in ("hits", "misses")
+            ]
+        )
+
+
+metrics = CacheMetrics()
+families = {}
+
+
+class CacheFamily:
+    """A group of cache keys that share a layout, a timeout and a version.
+
+    Bump the family's entry in ``CACHE_KEY_VERSIONS`` whenever the shape of
+    the cached value changes; old entries are then simply never read again.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        families[name] = self
+
+    @property
+    def cache(self):
+        return caches[settings.CACHE_ALIAS]
+
+    @property
+    def version(self):
+        return settings.CACHE_KEY_VERSIONS.get(self.name, 1)
+
+    @property
+    def timeout(self):
+        return settings.CACHE_TIMEOUTS.get(self.name, 300)
+
+    def key(self, ident):
+        return f"{self.name}:v{self.version}:{ident}"
+
+    def get(self, ident, default=None):
+        value = self.cache.get(self.key(ident), MISSING)
+        metrics.record(self.name, value is not MISSING)
+        return default if value is MISSING else value
+
+    def get_many(self, idents):
+        keys = {self.key(ident): ident for ident in idents}
+        found = self.cache.get_many(keys)
+        metrics.record(self.name, True, len(found))
+        metrics.record(self.name, False, len(keys) - len(found))
+        return {keys[key]: value for key, value in found.items()}
+
+    def set(self, ident, value):
+        self.cache.set(self.key(ident), value, self.timeout)
+
+    def set_many(self, values):
+        if values:
+            self.cache.set_many(
+                {self.key(ident): value for ident, value in values.items()},
+                self.timeout,
+            )
+
+    def get_or_set(self, ident, default):
+        value = self.get(ident, MISSING)
+        if value is MISSING:
+            value = default()
+            self.set(ident, value)
+        return value
+
+    def delete(self, *idents):
+        if idents:
+            self.cache.delete_many([self.key(ident) for ident in idents])
+
+    def versions(self, idents):
+        """A token per ident that changes whenever the ident is invalidated.
+        A token the cache lost is replaced by a new one, so losing it reads
+        as a change, never as none."""
+        found = self.get_many(idents)
+        missing = {ident: uuid.uuid4().hex for ident in idents if ident not in found}
+        self.set_many(missing)
+        return {**found, **missing}
+
+    def invalidate(self, *idents):
+        # Deleting before the write commits would let a concurrent reader
+        # cache the old value again straight away.
+        transaction.on_commit(lambda: self.delete(*idents))
+
+
+tweet_cards = CacheFamily("tweet_card")
+user_counters = CacheFamily("user_counters")
+profile_headers = CacheFamily("profile_header")
+timeline_pages = CacheFamily("timeline_page")
+trends = CacheFamily("trends")
+tweet_versions = CacheFamily("tweet_version")
+author_posts = CacheFamily("author_posts")
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+class Broker:
+    """Publish/subscribe transport for live events.
+
+    ``publish`` is called from ordinary (sync) request and job code;
+    ``subscribe`` is used from the event stream and returns a subscription
+    with ``async get()`` -> ``(channel, event)`` and ``async close()``.
+    """
+
+    def publish(self, channel, event):
+        raise NotImplementedError
+
+    def subscribe(self, channels):
+        raise NotImplementedError
+
+
+class LocalSubscription:
+    def __init__(self, broker, channels):
+        self.broker = broker
+        self.channels = channels
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+
+    def deliver(self, channel, event):
+        # A subscriber that stops reading loses events rather than memory.
+        if not self.queue.full():
+            self.queue.put_nowait((channel, event))
+
+    async def get(self):
+        return await self.queue.get()
+
+    async def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker(Broker):
+    """Delivers events to subscribers in this process only; the default, and
+    what the tests use."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+
+    def publish(self, channel, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(
+                    subscription.deliver, channel, event
+                )
+            except RuntimeError:
+                # its event loop is gone without closing the subscription
+                self.unsubscribe(subscription)
+
+    def subscribe(self, channels):
+        subscription = LocalSubscription(self, channels)
+        with self.lock:
+            for channel in channels:
+                self.subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                subscribers = self.subscriptions.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.subscriptions[channel]
+
+
+class RedisSubscription:
+    def __init__(self, pubsub, channels):
+        self.pubsub = pubsub
+        self.channels = channels
+        self.messages = None
+
+    async def get(self):
+        if self.messages is None:
+            await self.pubsub.subscribe(*self.channels)
+            self.messages = self.pubsub.listen()
+        async for message in self.messages:
+            if message["type"] == "message":
+                return message["channel"].decode(), json.loads(message["data"])
+
+    async def close(self):
+        await self.pubsub.reset()
+
+
+class RedisBroker(Broker):
+    """Fans events out through Redis pub/sub, so that events published by
+    one process (e.g. a job worker) reach streams held by another. Needs the
+    ``redis`` package."""
+
+    def __init__(self):
+        import redis
+        import redis.asyncio
+
+        self.client = redis.Redis.from_url(settings.EVENTS_REDIS_URL)
+        self.async_client = redis.asyncio.from_url(settings.EVENTS_REDIS_URL)
+
+    def publish(self, channel, event):
+        self.client.publish(channel, json.dumps(event))
+
+    def subscribe(self, channels):
+        return RedisSubscription(self.async_client.pubsub(), channels)
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    return import_string(settings.EVENTS_BROKER)()
+
+
+def publish_on_commit(channel, event):
+    transaction.on_commit(lambda: get_broker().publish(channel, event))
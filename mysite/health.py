@@ -0,0 +1,48 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.utils.decorators import sync_and_async_middleware
+
+
+def check_connections(aliases):
+    """Close the persistent connections of ``aliases`` that stopped working
+    (the server restarted, a proxy dropped them), so that the request opens
+    new ones instead of failing on its first query."""
+    for alias in aliases:
+        connection = connections[alias]
+        if (
+            connection.connection is not None
+            and not connection.in_atomic_block
+            and not connection.is_usable()
+        ):
+            connection.close()
+
+
+@sync_and_async_middleware
+def connection_health_middleware(get_response):
+    """CONN_HEALTH_CHECKS for Django 4.0, which ignores the option: test the
+    reused connections of the databases that set it before each request.
+    Django 4.1+ does this itself, on a connection's first use."""
+
+    aliases = [
+        alias
+        for alias, settings_dict in connections.settings.items()
+        if settings_dict.get("CONN_HEALTH_CHECKS")
+    ]
+
+    if asyncio.iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            if aliases:
+                # connections belong to the thread that runs sync code
+                await sync_to_async(check_connections)(aliases)
+            return await get_response(request)
+
+    else:
+
+        def middleware(request):
+            check_connections(aliases)
+            return get_response(request)
+
+    return middleware
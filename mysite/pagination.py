@@ -0,0 +1,168 @@
+import base64
+from dataclasses import dataclass, field
+
+from django.db.models import Q
+from django.http import Http404
+
+
+class InvalidCursor(Http404):
+    pass
+
+
+@dataclass
+class KeysetPage:
+    object_list: list
+    has_older: bool = False
+    has_newer: bool = False
+    older_cursor: str = None
+    newer_cursor: str = None
+    keys: list = field(default_factory=list, repr=False)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """Paginate a queryset newest-first by a tuple of strictly ordered keys.
+
+    Unlike OFFSET paging each page is a range scan starting right after the
+    cursor, so it costs the same wherever it is in the stream, provided an
+    index covers ``keys`` in order. ``.values()`` querysets work too, as
+    long as the rows include ``keys``.
+    """
+
+    def __init__(self, queryset, page_size, keys=("created_at", "id")):
+        self.queryset = queryset
+        self.page_size = page_size
+        self.keys = tuple(keys)
+
+    def key(self, obj):
+        if isinstance(obj, dict):
+            return tuple(obj[key] for key in self.keys)
+        return tuple(getattr(obj, key) for key in self.keys)
+
+    def encode(self, values):
+        raw = "|".join(
+            value.isoformat() if hasattr(value, "isoformat") else str(value)
+            for value in values
+        )
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    def decode(self, cursor):
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            parts = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+            if len(parts) != len(self.keys):
+                raise ValueError(cursor)
+            return tuple(
+                self.key_field(key).to_python(part)
+                for key, part in zip(self.keys, parts)
+            )
+        except Exception:
+            raise InvalidCursor("不正なカーソルです")
+
+    def key_field(self, key):
+        # a key is a model field or an annotation, such as a score
+        annotation = self.queryset.query.annotations.get(key)
+        if annotation is not None:
+            return annotation.output_field
+        return self.queryset.model._meta.get_field(key)
+
+    def _boundary(self, values, lookup):
+        # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y)
+        condition = Q()
+        for i, key in enumerate(self.keys):
+            term = Q(**{f"{key}__{lookup}": values[i]})
+            for prev_key, prev_value in zip(self.keys[:i], values[:i]):
+                term &= Q(**{prev_key: prev_value})
+            condition |= term
+        return condition
+
+    def fetch(self, older=None, newer=None, after=None):
+        """Return up to ``page_size + 1`` rows newest-first and whether the
+        extra row was found in the requested direction.
+
+        ``after`` keeps only rows newer than the cursor but, unlike ``newer``,
+        still starts from the newest row: it is the "what is new since"
+        query, and ``has_more`` then means the page does not reach the cursor.
+        """
+        limit = self.page_size + 1
+        if newer is not None:
+            queryset = self.queryset.filter(
+                self._boundary(self.decode(newer), "gt")
+            ).order_by(*self.keys)
+            rows = list(queryset[:limit])
+            has_more = len(rows) > self.page_size
+            return list(reversed(rows[: self.page_size])), has_more
+
+        queryset = self.queryset
+        if older is not None:
+            queryset = queryset.filter(self._boundary(self.decode(older), "lt"))
+        if after is not None:
+            queryset = queryset.filter(self._boundary(self.decode(after), "gt"))
+        rows = list(queryset.order_by(*[f"-{key}" for key in self.keys])[:limit])
+        return rows[: self.page_size], len(rows) > self.page_size
+
+    def get_page(self, older=None, newer=None, after=None):
+        rows, has_more = self.fetch(older=older, newer=newer, after=after)
+        if newer is not None and not rows:
+            return self.get_page()
+        keys = [self.key(row) for row in rows]
+        return self.build_page(rows, keys, has_more, older=older, newer=newer)
+
+    def build_page(self, object_list, keys, has_more, older=None, newer=None):
+        if newer is not None:
+            has_newer, has_older = has_more, True
+        else:
+            has_newer, has_older = older is not None, has_more
+        page = KeysetPage(
+            object_list,
+            has_older=has_older and bool(object_list),
+            has_newer=has_newer and bool(object_list),
+            keys=keys,
+        )
+        if object_list:
+            page.older_cursor = self.encode(keys[-1])
+            page.newer_cursor = self.encode(keys[0])
+        return page
+
+
+class MergedKeysetPaginator:
+    """Merge several keyset-paginated sources into a single stream.
+
+    ``sources`` is a list of ``(paginator, transform)`` pairs whose keys
+    compare against each other; ``transform`` maps a source row to the
+    object shown on the page. Rows with equal keys are shown once.
+    """
+
+    def __init__(self, sources, page_size):
+        self.sources = sources
+        self.page_size = page_size
+
+    def encode(self, values):
+        return self.sources[0][0].encode(values)
+
+    def get_page(self, older=None, newer=None, after=None):
+        rows = {}
+        has_more = False
+        for paginator, transform in self.sources:
+            objs, more = paginator.fetch(older=older, newer=newer, after=after)
+            has_more |= more
+            for obj in objs:
+                rows.setdefault(paginator.key(obj), transform(obj))
+        keys = sorted(rows, reverse=True)
+        if len(keys) > self.page_size:
+            has_more = True
+            # the rows closest to the cursor win, on either side of it
+            keys = (
+                keys[-self.page_size :] if newer is not None else keys[: self.page_size]
+            )
+        if newer is not None and not keys:
+            return self.get_page()
+        paginator = self.sources[0][0]
+        return paginator.build_page(
+            [rows[key] for key in keys], keys, has_more, older=older, newer=newer
+        )
@@ -0,0 +1,78 @@
+import asyncio
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+# Set by sticky_primary_middleware for the requests that may read stale
+# data; jobs, commands and migrations read their own writes on the primary.
+_read_replica = ContextVar("read_replica", default=False)
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class ReplicaRouter:
+    """Reads of read-only requests go to a random alias of DATABASE_REPLICAS;
+    everything else, and all writes and migrations, to ``default``."""
+
+    def db_for_read(self, model, **hints):
+        if settings.DATABASE_REPLICAS and _read_replica.get():
+            return random.choice(settings.DATABASE_REPLICAS)
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == "default"
+
+
+@sync_and_async_middleware
+def sticky_primary_middleware(get_response):
+    """Let safe requests read from the replicas, except for
+    REPLICA_STICKY_SECONDS after the user's own write, so that they see it
+    despite replication lag."""
+
+    def use_replica(request):
+        return (
+            request.method in SAFE_METHODS
+            and settings.REPLICA_STICKY_COOKIE not in request.COOKIES
+        )
+
+    def mark(request, response):
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(
+                settings.REPLICA_STICKY_COOKIE,
+                "1",
+                max_age=settings.REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+    if asyncio.iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            token = _read_replica.set(use_replica(request))
+            try:
+                response = await get_response(request)
+            finally:
+                _read_replica.reset(token)
+            return mark(request, response)
+
+    else:
+
+        def middleware(request):
+            token = _read_replica.set(use_replica(request))
+            try:
+                response = get_response(request)
+            finally:
+                _read_replica.reset(token)
+            return mark(request, response)
+
+    return middleware
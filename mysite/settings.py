@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -40,10 +43,13 @@ INSTALLED_APPS = [
     "accounts.apps.AccountsConfig",
     "tweets.apps.TweetsConfig",
     "welcome.apps.WelcomeConfig",
+    "jobs.apps.JobsConfig",
 ]
 
 MIDDLEWARE = [
+    "mysite.health.connection_health_middleware",
     "django.middleware.security.SecurityMiddleware",
+    "mysite.replicas.sticky_primary_middleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -72,17 +78,183 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "mysite.wsgi.application"
 
+TEST_RUNNER = "mysite.test_runner.CacheClearingRunner"
+
 
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# DATABASE_PROFILE picks one of:
+#   sqlite        SQLITE_PATH in WAL mode: readers no longer block the writer
+#                 and writers wait for each other instead of failing.
+#   sqlite-plain  Django's defaults (rollback journal), for comparison.
+#   postgresql    POSTGRES_* variables, with persistent connections.
+DATABASE_PROFILE = os.environ.get("DATABASE_PROFILE", "sqlite")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", BASE_DIR / "db.sqlite3")
+
+if DATABASE_PROFILE == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "mysite.backends.sqlite3",
+            "NAME": SQLITE_PATH,
+            "OPTIONS": {
+                # synchronous=NORMAL is durable in WAL mode except on power
+                # loss; cache_size is in KiB when negative.
+                "init_command": (
+                    "PRAGMA journal_mode=WAL;"
+                    "PRAGMA synchronous=NORMAL;"
+                    "PRAGMA busy_timeout=5000;"
+                    "PRAGMA cache_size=-20000;"
+                ),
+                "transaction_mode": "IMMEDIATE",
+            },
+        }
+    }
+elif DATABASE_PROFILE == "sqlite-plain":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": SQLITE_PATH,
+        }
     }
+elif DATABASE_PROFILE == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("POSTGRES_DB", "mysite"),
+            "USER": os.environ.get("POSTGRES_USER", ""),
+            "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+            "HOST": os.environ.get("POSTGRES_HOST", ""),
+            "PORT": os.environ.get("POSTGRES_PORT", ""),
+            # reuse a connection for this many seconds instead of opening
+            # one per request
+            "CONN_MAX_AGE": int(os.environ.get("DATABASE_CONN_MAX_AGE", 60)),
+            # test reused connections before each request (Django 4.1+, and
+            # mysite.health.connection_health_middleware before that)
+            "CONN_HEALTH_CHECKS": True,
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"Unknown DATABASE_PROFILE: {DATABASE_PROFILE}")
+
+# Sharding: comma-separated SQLITE_SHARD_PATHS add the aliases shard0,
+# shard1, ... that hold the Tweet and Like rows, placed by user id (see
+# mysite.sharding). Foreign keys cannot span databases, so SQLite stops
+# enforcing them once there are shards.
+shard_paths = [
+    path for path in os.environ.get("SQLITE_SHARD_PATHS", "").split(",") if path
+]
+if shard_paths:
+    if DATABASE_PROFILE != "sqlite":
+        raise ImproperlyConfigured("SQLITE_SHARD_PATHS needs DATABASE_PROFILE=sqlite")
+    DATABASES["default"]["OPTIONS"]["init_command"] += "PRAGMA foreign_keys=OFF;"
+for i, path in enumerate(shard_paths):
+    DATABASES[f"shard{i}"] = {**DATABASES["default"], "NAME": path}
+TWEET_SHARDS = [f"shard{i}" for i in range(len(shard_paths))]
+
+# Snowflake ids: Tweet and Like primary keys generated in the process
+# (mysite.snowflake), time-ordered and unique across databases. Shards need
+# them, since each shard would otherwise number its rows on its own. Each
+# process leases its own worker id (0-1023) in the default database for
+# SNOWFLAKE_LEASE_SECONDS and renews it while it keeps generating ids.
+SNOWFLAKE_IDS = os.environ.get("SNOWFLAKE_IDS") == "1" or bool(TWEET_SHARDS)
+SNOWFLAKE_LEASE_SECONDS = 300
+
+# Read replicas: comma-separated SQLITE_REPLICA_PATHS or POSTGRES_REPLICA_HOSTS
+# add the aliases replica1, replica2, ... that mysite.replicas.ReplicaRouter
+# spreads reads over. For REPLICA_STICKY_SECONDS after a user's own write
+# (marked by a cookie) their reads stay on the primary.
+if DATABASE_PROFILE == "postgresql":
+    replica_settings = [
+        {"HOST": host}
+        for host in os.environ.get("POSTGRES_REPLICA_HOSTS", "").split(",")
+        if host
+    ]
+else:
+    replica_settings = [
+        {"NAME": path}
+        for path in os.environ.get("SQLITE_REPLICA_PATHS", "").split(",")
+        if path
+    ]
+for i, replica in enumerate(replica_settings, 1):
+    DATABASES[f"replica{i}"] = {
+        **DATABASES["default"],
+        **replica,
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias.startswith("replica")]
+DATABASE_ROUTERS = ["mysite.sharding.ShardRouter", "mysite.replicas.ReplicaRouter"]
+REPLICA_STICKY_SECONDS = 10
+REPLICA_STICKY_COOKIE = "use_primary"
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# Local memory by default; point REDIS_URL at a Redis-protocol server in production.
+
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["REDIS_URL"],
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+CACHE_ALIAS = "default"
+
+# Bump a family's version when the shape of its cached values changes.
+CACHE_KEY_VERSIONS = {
+    "tweet_card": 2,
+    "user_counters": 1,
+    "profile_header": 1,
+    "timeline_page": 2,
+    "trends": 1,
+    "tweet_version": 1,
+    "author_posts": 1,
 }
 
+# Seconds
+CACHE_TIMEOUTS = {
+    "tweet_card": 3600,
+    "user_counters": 300,
+    "profile_header": 3600,
+    "timeline_page": 30,
+    # refreshed every TRENDS_REFRESH_SECONDS; outlives a few missed refreshes
+    "trends": 600,
+    # the ETags of the API; likes and deletes replace a tweet's version, and
+    # the timeout bounds how long a recount can go unnoticed
+    "tweet_version": 3600,
+    # compared with the tokens saved in cached timeline pages
+    "author_posts": 3600,
+}
+
+CACHE_METRICS_FLUSH_EVERY = 100
+
+
+# Live events (server-sent events, served under ASGI only)
+# LocalBroker only reaches streams in the publishing process; with REDIS_URL
+# set, events published by job workers reach every web process.
+
+if os.environ.get("REDIS_URL"):
+    EVENTS_BROKER = "mysite.events.RedisBroker"
+    EVENTS_REDIS_URL = os.environ["REDIS_URL"]
+else:
+    EVENTS_BROKER = "mysite.events.LocalBroker"
+
+# Seconds between keepalive comments, and the client's reconnect delay
+EVENTS_KEEPALIVE = 15
+EVENTS_RETRY = 5
+# Events buffered per connection before a slow client starts missing them
+EVENTS_QUEUE_SIZE = 100
+# Most tweets one page may follow the like counts of
+EVENTS_MAX_TWEETS = 200
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -134,3 +306,64 @@ AUTH_USER_MODEL = "accounts.User"
 LOGIN_URL = "accounts:login"
 LOGIN_REDIRECT_URL = "tweets:home"
 LOGOUT_REDIRECT_URL = "accounts:login"
+
+# Number of tweets per timeline page
+TWEETS_PAGE_SIZE = 20
+
+# Tweet search. None picks SQLite FTS5 on SQLite and the portable
+# tweets.search.NgramTableBackend elsewhere; or give a dotted backend path.
+TWEETS_SEARCH_BACKEND = None
+# Ranking: a tweet that consists of the query alone ranks as if posted this
+# many days later; one that the query covers half of, half as many.
+TWEETS_SEARCH_RELEVANCE_DAYS = 1
+
+# Trends: activity is counted in buckets of TRENDS_BUCKET_SECONDS and the
+# top TRENDS_TOP_K of each window (name: minutes) is recomputed every
+# TRENDS_REFRESH_SECONDS by the tweets.refresh_trends job. A post counts as
+# TRENDS_POST_WEIGHT likes.
+TRENDS_BUCKET_SECONDS = 300
+TRENDS_WINDOWS = {"1h": 60, "24h": 24 * 60}
+TRENDS_TOP_K = 10
+TRENDS_REFRESH_SECONDS = 120
+TRENDS_POST_WEIGHT = 2
+
+# Serve home, detail and like/unlike with the async views (under ASGI)
+TWEETS_ASYNC_VIEWS = os.environ.get("TWEETS_ASYNC_VIEWS") == "1"
+
+# Most tweets a single batch like/unlike request may touch
+LIKE_BATCH_MAX_SIZE = 100
+
+# Follow lists: users per page, and rows fetched per round trip when exporting
+FOLLOW_LIST_PAGE_SIZE = 50
+FOLLOW_EXPORT_CHUNK_SIZE = 2000
+
+# Who-to-follow: each user followed by one of your followings scores
+# SUGGESTIONS_FOLLOW_WEIGHT per path, each one who liked the same tweet in
+# the last SUGGESTIONS_LIKE_DAYS scores SUGGESTIONS_LIKE_WEIGHT. Tweets with
+# more likers than SUGGESTIONS_MAX_LIKERS say little about taste and are
+# skipped. Follows queue a refresh of the follower's suggestions, at most one
+# per SUGGESTIONS_REFRESH_SECONDS.
+SUGGESTIONS_PER_USER = 5
+SUGGESTIONS_FOLLOW_WEIGHT = 1.0
+SUGGESTIONS_LIKE_WEIGHT = 0.5
+SUGGESTIONS_LIKE_DAYS = 30
+SUGGESTIONS_MAX_LIKERS = 500
+SUGGESTIONS_REFRESH_SECONDS = 60
+
+# Home timeline inboxes: authors with more followers than the threshold are
+# merged in at read time instead of being copied to every follower.
+TIMELINE_FANOUT_THRESHOLD = 1000
+TIMELINE_FANOUT_BATCH_SIZE = 1000
+TIMELINE_BACKFILL_SIZE = 100
+# Most new tweets the home page polls for before it reloads instead
+TIMELINE_SINCE_LIMIT = 50
+
+# Background jobs, run by `python manage.py runjobs`.
+# With JOBS_EAGER the handlers run in-process right after the commit instead.
+JOBS_EAGER = False
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_DELAY = 10  # seconds, doubled after each failed attempt
+JOBS_LEASE = 300  # seconds before a job left running by a dead worker is retried
+# Seconds finished jobs are kept before runjobs deletes them (None: forever).
+# An idempotency key stops duplicates only while its job is kept.
+JOBS_RETENTION = 7 * 24 * 3600
@@ -0,0 +1,116 @@
+import heapq
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections
+
+from .pagination import KeysetPaginator
+
+# Models stored on the shard of their ``user_id``.
+SHARDED_MODELS = {"tweets.tweet", "tweets.like"}
+
+
+def jump_hash(key, buckets):
+    """Jump consistent hash (Lamping and Veach): map ``key`` to one of
+    ``buckets``. Going from n to n + 1 buckets moves only 1/(n + 1) of the
+    keys, all of them to the new bucket."""
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def shard_for_user(user_id):
+    """The alias holding the user's rows, or None (let the routers decide)
+    when sharding is off."""
+    if not settings.TWEET_SHARDS:
+        return None
+    return settings.TWEET_SHARDS[jump_hash(user_id, len(settings.TWEET_SHARDS))]
+
+
+def all_shards():
+    return settings.TWEET_SHARDS or [None]
+
+
+def merge_newest_first(iterables, key):
+    """k-way merge of iterables that are each sorted newest-first."""
+    return heapq.merge(*iterables, key=key, reverse=True)
+
+
+def delete_rows(model, alias, pks, batch_size=500):
+    """Delete rows of ``model`` on ``alias`` by primary key, in plain SQL.
+
+    The ORM's delete first collects the related rows to cascade to, and on a
+    shard their tables do not exist. Returns the number of rows deleted.
+    """
+    connection = connections[alias]
+    qn = connection.ops.quote_name
+    opts = model._meta
+    pks = list(pks)
+    deleted = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(pks), batch_size):
+            batch = pks[start : start + batch_size]
+            cursor.execute(
+                f"DELETE FROM {qn(opts.db_table)} WHERE {qn(opts.pk.column)} "
+                f"IN ({', '.join(['%s'] * len(batch))})",
+                batch,
+            )
+            deleted += cursor.rowcount
+    return deleted
+
+
+class ShardRouter:
+    """Sends a Tweet or Like instance (and a user's related tweets and likes)
+    to the shard of its user. Queries without an instance carry no user id;
+    they go through the ShardedQuerySet helpers."""
+
+    def _shard(self, model, instance):
+        if not settings.TWEET_SHARDS or model._meta.label_lower not in SHARDED_MODELS:
+            return None
+        if isinstance(instance, model):
+            return shard_for_user(instance.user_id)
+        if isinstance(instance, get_user_model()):
+            return shard_for_user(instance.pk)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints.get("instance"))
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints.get("instance"))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if SHARDED_MODELS & {obj1._meta.label_lower, obj2._meta.label_lower}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.TWEET_SHARDS:
+            return f"{app_label}.{model_name}" in SHARDED_MODELS
+        return None
+
+
+class ShardedKeysetPaginator(KeysetPaginator):
+    """A KeysetPaginator over the same query on every shard: each shard
+    fetches its own page and the pages are k-way merged by key."""
+
+    def fetch(self, older=None, newer=None, after=None):
+        pages, has_more = [], False
+        for alias in all_shards():
+            shard = KeysetPaginator(
+                self.queryset.using(alias), self.page_size, keys=self.keys
+            )
+            rows, more = shard.fetch(older=older, newer=newer, after=after)
+            pages.append(rows)
+            has_more |= more
+        rows = list(merge_newest_first(pages, key=self.key))
+        if len(rows) > self.page_size:
+            has_more = True
+            # as in MergedKeysetPaginator: the rows closest to the cursor
+            rows = (
+                rows[-self.page_size :] if newer is not None else rows[: self.page_size]
+            )
+        return rows, has_more
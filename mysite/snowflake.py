@@ -0,0 +1,243 @@
+import atexit
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, IntegrityError, connections
+
+# 41 bits of milliseconds since EPOCH_MS (about 69 years), 10 bits of worker
+# id and 12 bits of sequence: 63 bits, so ids stay positive in a BIGINT.
+EPOCH_MS = 1577836800000  # 2020-01-01 UTC
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+# expires_at of a worker id that no process holds
+RELEASED = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _now_ms():
+    return time.time_ns() // 1_000_000
+
+
+class SnowflakeGenerator:
+    """Time-ordered 64-bit ids, unique across processes as long as every
+    running process has its own worker id (see WorkerLease).
+
+    Ids from one generator strictly increase: within a millisecond the
+    sequence counts up, when it runs out the generator waits for the next
+    millisecond, and when the clock steps back it keeps counting from the
+    last millisecond it used instead of reusing ids.
+    """
+
+    def __init__(self, worker_id, clock=_now_ms):
+        if not 0 <= worker_id <= MAX_WORKER:
+            raise ImproperlyConfigured(
+                f"Snowflake worker ids must be between 0 and {MAX_WORKER}"
+            )
+        self.worker_id = worker_id
+        self.clock = clock
+        self.last_ms = -1
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            now = max(self.clock(), self.last_ms)
+            if now == self.last_ms:
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:
+                    while now <= self.last_ms:
+                        now = self.clock()
+            else:
+                self.sequence = 0
+            self.last_ms = now
+            return (
+                (now - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS)
+                | self.worker_id << SEQUENCE_BITS
+                | self.sequence
+            )
+
+
+def snowflake_time_ms(snowflake):
+    """The Unix time in milliseconds at which ``snowflake`` was generated."""
+    return (snowflake >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS
+
+
+class WorkerLease:
+    """A worker id leased from the SnowflakeWorker table, so that no two
+    running processes share one, however they were started.
+
+    The lease lasts SNOWFLAKE_LEASE_SECONDS and is renewed once half of it
+    has passed, on the next id. A process that lost its lease (it was paused
+    longer than that and another process took the id) leases another id
+    before generating more. The table is written on a connection of its own,
+    so that a lease commits whatever transaction the caller is in.
+    """
+
+    def __init__(self, seconds, clock=time.time):
+        self.seconds = seconds
+        self.clock = clock
+        self.holder = (
+            f"{socket.gethostname()[:60]}:{os.getpid()}:{uuid.uuid4().hex[:12]}"
+        )
+        self.worker_id = None
+        self.renew_at = 0
+        self.lock = threading.Lock()
+
+    def current(self):
+        # checked on every id, so without the lock until renewal is due
+        if self.clock() < self.renew_at:
+            return self.worker_id
+        with self.lock:
+            now = self.clock()
+            if now >= self.renew_at:
+                now = datetime.fromtimestamp(now, tz=dt_timezone.utc)
+                with self.cursor() as (cursor, sql):
+                    if self.worker_id is None or not self.renew(cursor, sql, now):
+                        self.claim(cursor, sql, now)
+                self.renew_at = now.timestamp() + self.seconds / 2
+            return self.worker_id
+
+    @contextmanager
+    def cursor(self):
+        # tweets.models imports this module for its primary keys
+        from tweets.models import SnowflakeWorker
+
+        connection = connections.create_connection(DEFAULT_DB_ALIAS)
+        try:
+            qn = connection.ops.quote_name
+            opts = SnowflakeWorker._meta
+            sql = {
+                "table": qn(opts.db_table),
+                "worker_id": qn(opts.get_field("worker_id").column),
+                "holder": qn(opts.get_field("holder").column),
+                "expires_at": qn(opts.get_field("expires_at").column),
+                "adapt": connection.ops.adapt_datetimefield_value,
+            }
+            with connection.cursor() as cursor:
+                yield cursor, sql
+        finally:
+            connection.close()
+
+    def renew(self, cursor, sql, now):
+        cursor.execute(
+            f"UPDATE {sql['table']} SET {sql['expires_at']} = %s "
+            f"WHERE {sql['worker_id']} = %s AND {sql['holder']} = %s",
+            [sql["adapt"](self.expiry(now)), self.worker_id, self.holder],
+        )
+        return cursor.rowcount == 1
+
+    def claim(self, cursor, sql, now):
+        while True:
+            # the longest expired first, the safest with clocks that disagree
+            cursor.execute(
+                f"SELECT {sql['worker_id']} FROM {sql['table']} "
+                f"WHERE {sql['expires_at']} < %s ORDER BY {sql['expires_at']} LIMIT 10",
+                [sql["adapt"](now)],
+            )
+            expired = cursor.fetchall()
+            for (worker_id,) in expired:
+                # another process may take the same one first
+                cursor.execute(
+                    f"UPDATE {sql['table']} SET {sql['holder']} = %s, "
+                    f"{sql['expires_at']} = %s "
+                    f"WHERE {sql['worker_id']} = %s AND {sql['expires_at']} < %s",
+                    [
+                        self.holder,
+                        sql["adapt"](self.expiry(now)),
+                        worker_id,
+                        sql["adapt"](now),
+                    ],
+                )
+                if cursor.rowcount == 1:
+                    self.worker_id = worker_id
+                    return
+            if expired:
+                # other processes took them all first
+                continue
+            # every id so far is held: add the next one
+            cursor.execute(
+                f"SELECT COALESCE(MAX({sql['worker_id']}) + 1, 0) FROM {sql['table']}"
+            )
+            (worker_id,) = cursor.fetchone()
+            if worker_id > MAX_WORKER:
+                raise ImproperlyConfigured(
+                    f"All {MAX_WORKER + 1} snowflake worker ids are leased"
+                )
+            try:
+                cursor.execute(
+                    f"INSERT INTO {sql['table']} ({sql['worker_id']}, {sql['holder']}, "
+                    f"{sql['expires_at']}) VALUES (%s, %s, %s)",
+                    [worker_id, self.holder, sql["adapt"](self.expiry(now))],
+                )
+            except IntegrityError:
+                # another process added it first
+                continue
+            self.worker_id = worker_id
+            return
+
+    def expiry(self, now):
+        return now + timedelta(seconds=self.seconds)
+
+    def release(self):
+        """Hand the worker id back, for the next process to lease."""
+        with self.lock:
+            if self.worker_id is None:
+                return
+            self.renew_at = 0
+            with self.cursor() as (cursor, sql):
+                cursor.execute(
+                    f"UPDATE {sql['table']} SET {sql['expires_at']} = %s "
+                    f"WHERE {sql['worker_id']} = %s AND {sql['holder']} = %s",
+                    [sql["adapt"](RELEASED), self.worker_id, self.holder],
+                )
+            self.worker_id = None
+
+
+class LeasedSnowflakeGenerator(SnowflakeGenerator):
+    """A SnowflakeGenerator whose worker id comes from a WorkerLease."""
+
+    def __init__(self, lease, clock=_now_ms):
+        super().__init__(0, clock=clock)
+        self.lease = lease
+
+    def __call__(self):
+        # checked before every id: a lost lease is replaced before any id is
+        # generated under it
+        self.worker_id = self.lease.current()
+        return super().__call__()
+
+
+def _release_at_exit(lease):
+    try:
+        lease.release()
+    except DatabaseError:
+        # the database went away first; the lease expires on its own
+        pass
+
+
+_generator = None
+_generator_pid = None
+
+
+def next_id():
+    """Primary key default of the sharded models: a new snowflake when
+    SNOWFLAKE_IDS is on, else None so that the database assigns the id."""
+    global _generator, _generator_pid
+    if not settings.SNOWFLAKE_IDS:
+        return None
+    # a forked process leases its own worker id instead of continuing its
+    # parent's
+    if _generator_pid != os.getpid():
+        lease = WorkerLease(settings.SNOWFLAKE_LEASE_SECONDS)
+        atexit.register(_release_at_exit, lease)
+        _generator, _generator_pid = LeasedSnowflakeGenerator(lease), os.getpid()
+    return _generator()
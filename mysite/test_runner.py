@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.test.runner import (
+    DiscoverRunner,
+    ParallelTestSuite,
+    RemoteTestResult,
+    RemoteTestRunner,
+)
+from django.test.utils import override_settings
+
+
+class CacheClearingResult:
+    """Clear every cache before each test.
+
+    Test databases are rolled back between tests, so primary keys get
+    reused; anything cached under them would leak into the next test.
+    """
+
+    def startTest(self, test):
+        for cache in caches.all():
+            cache.clear()
+        super().startTest(test)
+
+
+class CacheClearingRemoteResult(CacheClearingResult, RemoteTestResult):
+    pass
+
+
+class CacheClearingRemoteRunner(RemoteTestRunner):
+    resultclass = CacheClearingRemoteResult
+
+
+class CacheClearingParallelSuite(ParallelTestSuite):
+    # --parallel runs the tests in worker processes, with their own results
+    runner_class = CacheClearingRemoteRunner
+
+
+class CacheClearingRunner(DiscoverRunner):
+    """Runs the tests against in-process caches, cleared before each test.
+
+    A shared cache (Redis) would be seen by every --parallel worker, whose
+    databases reuse the same primary keys, and clearing it would wipe
+    whatever else uses it.
+    """
+
+    parallel_test_suite = CacheClearingParallelSuite
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.local_caches = override_settings(
+            CACHES={
+                alias: {
+                    "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                    "LOCATION": f"test-{alias}",
+                }
+                for alias in settings.CACHES
+            }
+        )
+        self.local_caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.local_caches.disable()
+        super().teardown_test_environment(**kwargs)
+
+    def get_resultclass(self):
+        base = super().get_resultclass()
+        if base is None:
+            from unittest import TextTestResult as base
+
+        return type("Result", (CacheClearingResult, base), {})
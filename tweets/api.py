@@ -0,0 +1,104 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_safe
+
+from accounts.views import get_profile_or_404
+from mysite.cache import tweet_versions
+from mysite.pagination import KeysetPaginator
+
+from .models import Tweet
+from .timeline import home_timeline_ids
+
+
+def serialize_tweet(tweet):
+    return {
+        "id": str(tweet.id),
+        "user": tweet.user.username,
+        "content": tweet.content,
+        "created_at": tweet.created_at,
+        "like_count": tweet.like_count,
+    }
+
+
+def tweets_etag(request, ids):
+    # Tweets never change once posted: the URL, the ids in stream order and
+    # their versions say all there is to say about the response.
+    digest = hashlib.sha1(request.get_full_path().encode())
+    versions = tweet_versions.versions(ids)
+    for pk in ids:
+        digest.update(f"|{pk}:{versions[pk]}".encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def conditional_json(request, ids, load):
+    """Answer 304 when the client already has the tweets ``ids``, otherwise
+    send ``load()`` with a strong ETag the client can revalidate with. The
+    ETag comes first, so a 304 reads no tweet rows."""
+    etag = tweets_etag(request, ids)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(load())
+    response.headers["ETag"] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def ordered_tweets(ids):
+    tweets = Tweet.objects.with_users().in_bulk_across_shards(ids)
+    return [tweets[pk] for pk in ids if pk in tweets]
+
+
+def page_json(request, page):
+    def load():
+        return {
+            "tweets": [
+                serialize_tweet(tweet) for tweet in ordered_tweets(page.object_list)
+            ],
+            "older": page.older_cursor if page.has_older else None,
+            "newer": page.newer_cursor if page.has_newer else None,
+        }
+
+    return conditional_json(request, page.object_list, load)
+
+
+@login_required
+@require_safe
+def home_timeline_api(request):
+    page = home_timeline_ids(
+        request.user,
+        settings.TWEETS_PAGE_SIZE,
+        older=request.GET.get("older"),
+        newer=request.GET.get("newer"),
+    )
+    return page_json(request, page)
+
+
+@login_required
+@require_safe
+def user_tweets_api(request, username):
+    user = get_profile_or_404(username)
+    paginator = KeysetPaginator(
+        Tweet.objects.for_user(user.pk).values_list("created_at", "id", named=True),
+        settings.TWEETS_PAGE_SIZE,
+    )
+    page = paginator.get_page(
+        older=request.GET.get("older"), newer=request.GET.get("newer")
+    )
+    page.object_list = [row.id for row in page.object_list]
+    return page_json(request, page)
+
+
+@login_required
+@require_safe
+def tweet_detail_api(request, pk):
+    def load():
+        tweets = ordered_tweets([pk])
+        if not tweets:
+            raise Http404()
+        return serialize_tweet(tweets[0])
+
+    return conditional_json(request, [pk], load)
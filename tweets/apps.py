@@ -2,5 +2,8 @@ from django.apps import AppConfig
 
 
 class TweetsConfig(AppConfig):
-    default_auto_field = 'django.db.models.BigAutoField'
-    name = 'tweets'
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "tweets"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,84 @@
+"""Async counterparts of the tweets views, used when TWEETS_ASYNC_VIEWS is on.
+
+Django 4.0 has no async ORM or async-aware view decorators yet, so database
+work and template rendering run through ``sync_to_async`` (one thread hop
+each); the views themselves never block the event loop.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, HttpResponseNotAllowed
+from django.shortcuts import render
+
+from accounts.suggestions import get_suggestions
+
+from .likes import like_tweet, unlike_tweet
+from .models import Tweet
+from .timeline import home_timeline_page
+from .viewer import get_viewer_state
+from .views import like_state_response
+
+
+def async_login_required(methods):
+    """``login_required`` plus ``require_http_methods`` for async views."""
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            # resolving request.user reads the session from the database
+            if not await sync_to_async(lambda: request.user.is_authenticated)():
+                return redirect_to_login(request.get_full_path())
+            return await view(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@async_login_required(["GET", "HEAD"])
+async def home_view(request):
+    page = await sync_to_async(home_timeline_page)(
+        request.user,
+        settings.TWEETS_PAGE_SIZE,
+        older=request.GET.get("older"),
+        newer=request.GET.get("newer"),
+    )
+    viewer = await sync_to_async(get_viewer_state(request).load)(
+        tweets=page.object_list
+    )
+    suggestions = await sync_to_async(get_suggestions)(request.user)
+    context = {
+        "tweets": page.object_list,
+        "page": page,
+        "viewer": viewer,
+        "suggestions": suggestions,
+    }
+    return await sync_to_async(render)(request, "tweets/home.html", context)
+
+
+@async_login_required(["GET", "HEAD"])
+async def tweet_detail_view(request, pk):
+    tweet = await sync_to_async(
+        Tweet.objects.with_users().filter(pk=pk).first_across_shards
+    )()
+    if tweet is None:
+        raise Http404()
+    viewer = await sync_to_async(get_viewer_state(request).load)(tweets=[tweet])
+    context = {"object": tweet, "tweet": tweet, "viewer": viewer}
+    return await sync_to_async(render)(request, "tweets/detail.html", context)
+
+
+@async_login_required(["POST"])
+async def like_view(request, pk):
+    changed = await sync_to_async(like_tweet)(request.user, pk)
+    return await sync_to_async(like_state_response)(pk, True, changed)
+
+
+@async_login_required(["POST"])
+async def unlike_view(request, pk):
+    changed = await sync_to_async(unlike_tweet)(request.user, pk)
+    return await sync_to_async(like_state_response)(pk, False, changed)
@@ -0,0 +1,89 @@
+import re
+import unicodedata
+
+from django.contrib.auth import get_user_model
+
+from .models import Hashtag, Mention, TweetHashtag
+
+User = get_user_model()
+
+# Japanese has no spaces, so only latin letters and digits (as in e-mail
+# addresses and "&#123;") keep a "#" or "@" from starting an entity.
+HASHTAG = re.compile(r"(?<![0-9A-Za-z&#＃])[#＃](\w+)")
+MENTION = re.compile(r"(?<![0-9A-Za-z_@.+-])@([\w.+-]+)")
+ASCII_PREFIX = re.compile(r"[0-9A-Za-z_.+-]+")
+
+
+def normalize_hashtag(name):
+    return unicodedata.normalize("NFKC", name).lower()
+
+
+def extract_hashtags(text):
+    return list(
+        dict.fromkeys(normalize_hashtag(name) for name in HASHTAG.findall(text))
+    )
+
+
+def extract_mentions(text):
+    """Return the candidate usernames of each mention, longest first.
+
+    "@aliceさん" may be user "aliceさん" or "alice" followed by an honorific,
+    so both are returned and whichever exists wins.
+    """
+    text = unicodedata.normalize("NFKC", text)
+    mentions = []
+    for name in MENTION.findall(text):
+        # a mention at the end of a sentence keeps the full stop out
+        candidates = [name.rstrip(".")]
+        prefix = ASCII_PREFIX.match(name)
+        if prefix and prefix.group().rstrip(".") != candidates[0]:
+            candidates.append(prefix.group().rstrip("."))
+        mentions.append(candidates)
+    return mentions
+
+
+def save_entities(tweets):
+    """Store the hashtags and mentions of ``tweets``. Running it again for the
+    same tweets is harmless."""
+    tweets = list(tweets)
+    tags = {tweet.pk: extract_hashtags(tweet.content) for tweet in tweets}
+    mentions = {tweet.pk: extract_mentions(tweet.content) for tweet in tweets}
+
+    names = {name for names in tags.values() for name in names}
+    Hashtag.objects.bulk_create(
+        [Hashtag(name=name) for name in names], ignore_conflicts=True
+    )
+    hashtag_ids = dict(Hashtag.objects.filter(name__in=names).values_list("name", "id"))
+    TweetHashtag.objects.bulk_create(
+        [
+            TweetHashtag(
+                hashtag_id=hashtag_ids[name], tweet=tweet, created_at=tweet.created_at
+            )
+            for tweet in tweets
+            for name in tags[tweet.pk]
+        ],
+        ignore_conflicts=True,
+    )
+
+    usernames = {
+        name
+        for names in mentions.values()
+        for candidates in names
+        for name in candidates
+    }
+    user_ids = dict(
+        User.objects.filter(username__in=usernames).values_list("username", "id")
+    )
+    mentioned = {}
+    for tweet in tweets:
+        for candidates in mentions[tweet.pk]:
+            found = [user_ids[name] for name in candidates if name in user_ids]
+            if found:
+                mentioned[(tweet.pk, found[0])] = tweet
+    Mention.objects.bulk_create(
+        [
+            Mention(user_id=user_id, tweet=tweet, created_at=tweet.created_at)
+            for (_, user_id), tweet in mentioned.items()
+        ],
+        ignore_conflicts=True,
+    )
@@ -0,0 +1,35 @@
+from mysite.events import publish_on_commit
+
+
+def timeline_channel(user_id):
+    return f"timeline:{user_id}"
+
+
+def author_channel(user_id):
+    return f"user:{user_id}"
+
+
+def tweet_channel(tweet_id):
+    return f"tweet:{tweet_id}"
+
+
+# Tweet ids go out as strings: snowflake ids are above 2**53, where
+# JavaScript numbers lose precision.
+
+
+def publish_new_tweet(tweet, user_ids):
+    event = {"type": "tweet", "id": str(tweet.pk)}
+    for user_id in user_ids:
+        publish_on_commit(timeline_channel(user_id), event)
+
+
+def publish_authored_tweet(tweet):
+    publish_on_commit(
+        author_channel(tweet.user_id), {"type": "tweet", "id": str(tweet.pk)}
+    )
+
+
+def publish_like_count(tweet_id, count):
+    publish_on_commit(
+        tweet_channel(tweet_id), {"type": "like", "id": str(tweet_id), "count": count}
+    )
@@ -0,0 +1,165 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from mysite.cache import tweet_versions
+from mysite.sharding import shard_for_user
+from mysite.snowflake import next_id
+
+from .models import Like, Tweet
+from .trends import record_likes
+
+
+def _insert_likes_sql(connection, count, check_tweets):
+    """One INSERT of ``count`` likes by one user that skips the likes already
+    there and returns the tweet ids of the rows it inserted, so that the
+    caller counts exactly the likes that are new.
+
+    With ``check_tweets`` the rows come from a SELECT that also skips the
+    tweets that do not exist, which needs the tweets on the same database.
+    """
+    like = Like._meta
+    tweet = Tweet._meta
+    qn = connection.ops.quote_name
+    tweet_column = qn(like.get_field("tweet").column)
+    # with SNOWFLAKE_IDS the ids come from the process, else the database
+    snowflakes = settings.SNOWFLAKE_IDS
+    columns = [
+        qn(like.get_field("user").column),
+        tweet_column,
+        qn(like.get_field("created_at").column),
+    ]
+    if snowflakes:
+        columns.insert(0, qn(like.pk.column))
+    if check_tweets:
+        # rows of (id, tweet_id) or (tweet_id): VALUES names them column1, ...
+        rows = ", ".join(["(%s, %s)" if snowflakes else "(%s)"] * count)
+        tweet_id = "v.column2" if snowflakes else "v.column1"
+        values = (
+            ["v.column1", "%s", tweet_id, "%s"]
+            if snowflakes
+            else ["%s", tweet_id, "%s"]
+        )
+        source = (
+            f"SELECT {', '.join(values)} FROM (VALUES {rows}) AS v "
+            f"WHERE EXISTS (SELECT 1 FROM {qn(tweet.db_table)} "
+            f"WHERE {qn(tweet.pk.column)} = {tweet_id})"
+        )
+    else:
+        row = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        source = "VALUES " + ", ".join([row] * count)
+    return (
+        f"INSERT INTO {qn(like.db_table)} ({', '.join(columns)}) {source} "
+        f"ON CONFLICT ({qn(like.get_field('user').column)}, {tweet_column}) "
+        f"DO NOTHING RETURNING {tweet_column}"
+    )
+
+
+def _adjust_like_counts(deltas):
+    """Apply ``{tweet_id: +1/-1}`` to the counters: one UPDATE per direction
+    (and shard)."""
+    for delta in (1, -1):
+        pks = [pk for pk, change in deltas.items() if change == delta]
+        if not pks:
+            continue
+        for tweets in Tweet.objects.filter(pk__in=pks).on_all_shards():
+            tweets.update(like_count=F("like_count") + delta)
+    tweet_versions.invalidate(*deltas)
+    record_likes(deltas)
+
+
+def _insert_likes(user, tweet_ids):
+    """Insert the likes in one statement and return the ids of the tweets
+    whose like is new: not those already liked or that do not exist."""
+    if not tweet_ids:
+        return []
+    created_at = timezone.now()
+    alias = shard_for_user(user.pk)
+    if alias is None:
+        params = [user.pk, created_at]
+        for tweet_id in tweet_ids:
+            if settings.SNOWFLAKE_IDS:
+                params.append(next_id())
+            params.append(tweet_id)
+        sql = _insert_likes_sql(connection, len(tweet_ids), check_tweets=True)
+    else:
+        # The likes go to the liker's shard and the tweets are on their
+        # authors', so the INSERT cannot check that the tweets exist.
+        tweets = Tweet.objects.filter(pk__in=tweet_ids).values_list("pk", flat=True)
+        existing = {pk for queryset in tweets.on_all_shards() for pk in queryset}
+        tweet_ids = [pk for pk in tweet_ids if pk in existing]
+        if not tweet_ids:
+            return []
+        params = []
+        for tweet_id in tweet_ids:
+            if settings.SNOWFLAKE_IDS:
+                params.append(next_id())
+            params += [user.pk, tweet_id, created_at]
+        sql = _insert_likes_sql(connections[alias], len(tweet_ids), check_tweets=False)
+    with connections[alias or DEFAULT_DB_ALIAS].cursor() as cursor:
+        cursor.execute(sql, params)
+        return [tweet_id for tweet_id, in cursor.fetchall()]
+
+
+def _delete_likes(user, tweet_ids):
+    """Delete the likes in one statement and return the ids of the tweets
+    whose like was really there."""
+    if not tweet_ids:
+        return []
+    connection = connections[shard_for_user(user.pk) or DEFAULT_DB_ALIAS]
+    like = Like._meta
+    qn = connection.ops.quote_name
+    tweet_column = qn(like.get_field("tweet").column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {qn(like.db_table)} "
+            f"WHERE {qn(like.get_field('user').column)} = %s "
+            f"AND {tweet_column} IN ({', '.join(['%s'] * len(tweet_ids))}) "
+            f"RETURNING {tweet_column}",
+            [user.pk, *tweet_ids],
+        )
+        return [tweet_id for tweet_id, in cursor.fetchall()]
+
+
+def like_tweet(user, tweet_id):
+    """Like the tweet and return True if the like is new.
+
+    Liking twice, or liking a tweet that does not exist, changes nothing.
+    The counter is only touched when a row was really inserted.
+    """
+    with transaction.atomic():
+        changed = bool(_insert_likes(user, [tweet_id]))
+        if changed:
+            _adjust_like_counts({tweet_id: 1})
+    return changed
+
+
+def unlike_tweet(user, tweet_id):
+    """Remove the like and return True if there was one to remove."""
+    with transaction.atomic(using=shard_for_user(user.pk)):
+        changed = bool(_delete_likes(user, [tweet_id]))
+        if changed:
+            _adjust_like_counts({tweet_id: -1})
+    return changed
+
+
+def like_batch(user, actions):
+    """Apply ``{tweet_id: liked}`` and return ``{tweet_id: +1/-1}`` for the
+    likes that really changed.
+
+    As in like_tweet, each change is counted from the row its statement
+    inserted or deleted, not from a read made beforehand, so concurrent
+    batches cannot count a like twice or take a counter below zero.
+    """
+    deltas = {}
+    with transaction.atomic():
+        liked = [tweet_id for tweet_id, like in actions.items() if like]
+        for tweet_id in _insert_likes(user, liked):
+            deltas[tweet_id] = 1
+        unliked = [tweet_id for tweet_id, like in actions.items() if not like]
+        for tweet_id in _delete_likes(user, unliked):
+            deltas[tweet_id] = -1
+        if deltas:
+            _adjust_like_counts(deltas)
+    return deltas
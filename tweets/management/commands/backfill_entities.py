@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tweets.entities import save_entities
+from tweets.models import Tweet
+
+
+class Command(BaseCommand):
+    help = "Extract hashtags and mentions from existing tweets."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        last_pk = 0
+        processed = 0
+        while True:
+            tweets = Tweet.objects.only(
+                "id", "content", "created_at"
+            ).batch_across_shards(last_pk, options["batch_size"])
+            if not tweets:
+                break
+            with transaction.atomic():
+                save_entities(tweets)
+            processed += len(tweets)
+            last_pk = tweets[-1].pk
+        self.stdout.write(self.style.SUCCESS(f"{processed}件のツイートを処理しました"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from mysite.cache import metrics
+
+
+class Command(BaseCommand):
+    help = "Show cache hit/miss counts per key family."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset", action="store_true", help="Zero the counters afterwards."
+        )
+
+    def handle(self, *args, **options):
+        for family, counts in sorted(metrics.stats().items()):
+            total = counts["hits"] + counts["misses"]
+            ratio = counts["hits"] / total if total else 0
+            self.stdout.write(
+                f"{family}: hits={counts['hits']} misses={counts['misses']} "
+                f"hit_ratio={ratio:.1%}"
+            )
+        if options["reset"]:
+            metrics.reset()
@@ -0,0 +1,218 @@
+import gzip
+import multiprocessing
+import os
+from array import array
+from datetime import timedelta
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections
+from django.db.models import Max
+from django.utils import timezone
+
+from accounts.models import FriendShip
+from accounts.tasks import recount_follows
+from tweets.models import Like, Tweet
+from tweets.workload import Workload, chunks, like_counts, run_chunk, save
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic users, a power-law follow graph, tweets and likes "
+        "for load tests, into the database or a JSON Lines fixture."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--tweets", type=int, default=10000)
+        parser.add_argument("--likes", type=int, default=50000)
+        parser.add_argument(
+            "--follows", type=float, default=20, help="Average follows per user."
+        )
+        parser.add_argument(
+            "--skew", type=float, default=1.0, help="Zipf exponent of popularity."
+        )
+        parser.add_argument(
+            "--days", type=int, default=30, help="Spread tweets over this many days."
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--password", default="password")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Processes generating the rows; this one saves them.",
+        )
+        parser.add_argument(
+            "--output",
+            help="Write a .jsonl or .jsonl.gz fixture for an empty database "
+            "instead of saving the rows.",
+        )
+
+    def handle(self, *args, **options):
+        if min(options["users"], options["tweets"], options["likes"]) < 0:
+            raise CommandError("件数には0以上を指定してください")
+        if options["likes"] > options["users"] * options["tweets"]:
+            raise CommandError("いいね数がユーザー数×ツイート数を超えています")
+        to_db = not options["output"]
+        first_user_id = first_tweet_id = first_like_id = 1
+        if to_db:
+            first_user_id += User.objects.aggregate(pk=Max("pk"))["pk"] or 0
+            first_tweet_id += max(
+                tweets.aggregate(pk=Max("pk"))["pk"] or 0
+                for tweets in Tweet.objects.on_all_shards()
+            )
+            first_like_id += max(
+                likes.aggregate(pk=Max("pk"))["pk"] or 0
+                for likes in Like.objects.on_all_shards()
+            )
+        end = timezone.now()
+        plan = Workload(
+            users=options["users"],
+            tweets=options["tweets"],
+            likes=options["likes"],
+            follows=options["follows"],
+            skew=options["skew"],
+            seed=options["seed"],
+            first_user_id=first_user_id,
+            first_tweet_id=first_tweet_id,
+            first_like_id=first_like_id,
+            start=end - timedelta(days=options["days"]),
+            end=end,
+            # one hash for everyone: hashing is what makes create_user slow
+            password=make_password(options["password"]),
+            batch_size=options["batch_size"],
+        )
+        size = self.batch_size = options["batch_size"]
+        counts = like_counts(plan)
+        # the ids of the likes are handed out here too, so the workers need
+        # no snowflake worker ids
+        first_likes = list(accumulate(counts, initial=0))
+        tweet_tasks = [
+            (
+                plan,
+                "tweets",
+                start,
+                stop,
+                (counts[start:stop], first_likes[start]),
+                to_db,
+            )
+            for start, stop in chunks(plan.tweets, size)
+        ]
+        follow_tasks = [
+            (plan, "follows", start, stop, None, to_db)
+            for start, stop in chunks(plan.users, size)
+        ]
+
+        workers = max(1, options["workers"])
+        if workers > 1:
+            # forked workers must not share the parent's connections, even
+            # though they do not query
+            connections.close_all()
+        with multiprocessing.Pool(workers) if workers > 1 else _Inline() as pool:
+            if to_db:
+                self.run(pool, self.user_tasks(plan, to_db=True))
+                self.run(pool, follow_tasks)
+                for start, stop in chunks(plan.users, size):
+                    recount_follows(plan.user_id(start), plan.user_id(stop - 1))
+                self.run(pool, tweet_tasks)
+                self.reset_sequences()
+            else:
+                with _open(options["output"]) as fixture:
+                    # loaddata checks foreign keys at the end, so the users
+                    # can come last, once their follow counts are known
+                    following = array("q", [0]) * plan.users
+                    followers = array("q", [0]) * plan.users
+                    for out_degrees, in_degrees in self.run(
+                        pool, follow_tasks, fixture
+                    ):
+                        for user_id, count in out_degrees.items():
+                            following[user_id - first_user_id] += count
+                        for user_id, count in in_degrees.items():
+                            followers[user_id - first_user_id] += count
+                    self.run(pool, tweet_tasks, fixture)
+                    self.run(
+                        pool,
+                        self.user_tasks(plan, False, following, followers),
+                        fixture,
+                    )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"ユーザー{plan.users}人、ツイート{plan.tweets}件、いいね{plan.likes}件を生成しました"
+            )
+        )
+        if to_db:
+            self.stdout.write(
+                "タイムライン・検索・おすすめユーザーは rebuild_timelines、"
+                "rebuild_search_index、rebuild_suggestions で作り直してください"
+            )
+
+    def user_tasks(self, plan, to_db, following=None, followers=None):
+        return [
+            (
+                plan,
+                "users",
+                start,
+                stop,
+                (
+                    following[start:stop] if following else None,
+                    followers[start:stop] if followers else None,
+                ),
+                to_db,
+            )
+            for start, stop in chunks(plan.users, plan.batch_size)
+        ]
+
+    def run(self, pool, tasks, fixture=None):
+        """Run the chunks in order of submission, saving their rows or
+        writing them to ``fixture``, and return the degree counters of
+        follow chunks."""
+        degrees = []
+        for objs, text, chunk_degrees in pool.imap(run_chunk, tasks):
+            if objs is not None:
+                # the workers only generate: concurrent writers would wait on
+                # each other, and SQLite would fail them with "locked"
+                save(objs, self.batch_size)
+            if fixture is not None:
+                fixture.write(text)
+            if chunk_degrees is not None:
+                degrees.append(chunk_degrees)
+        return degrees
+
+    def reset_sequences(self):
+        # the rows were inserted with explicit ids
+        for alias in {"default", *settings.TWEET_SHARDS}:
+            connection = connections[alias]
+            models = [User, FriendShip, Tweet, Like]
+            if alias != "default":
+                models = [Tweet, Like]
+            statements = connection.ops.sequence_reset_sql(no_style(), models)
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+
+class _Inline:
+    """The part of multiprocessing.Pool used above, in this process."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def imap(self, func, iterable):
+        return map(func, iterable)
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt", encoding="utf-8")
+    return open(path, "w", encoding="utf-8")
@@ -0,0 +1,58 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mysite.sharding import delete_rows, shard_for_user
+from tweets.models import Like, Tweet
+from tweets.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Move Tweet and Like rows to the shard of their user, e.g. after adding a shard."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only count the rows to move."
+        )
+
+    def handle(self, *args, **options):
+        if not settings.TWEET_SHARDS:
+            raise CommandError("シャードが設定されていません（SQLITE_SHARD_PATHS）")
+        for model in (Tweet, Like):
+            moved = sum(
+                self.rebalance(model, source, options["batch_size"], options["dry_run"])
+                for source in ["default", *settings.TWEET_SHARDS]
+            )
+            self.stdout.write(self.style.SUCCESS(f"{model.__name__}: {moved}件を移動しました"))
+
+    def rebalance(self, model, source, batch_size, dry_run):
+        last_pk = 0
+        moved = 0
+        while True:
+            rows = list(
+                model.objects.using(source)
+                .filter(pk__gt=last_pk)
+                .order_by("pk")[:batch_size]
+            )
+            if not rows:
+                return moved
+            last_pk = rows[-1].pk
+            targets = defaultdict(list)
+            for row in rows:
+                target = shard_for_user(row.user_id)
+                if target != source:
+                    targets[target].append(row)
+            for target, batch in targets.items():
+                moved += len(batch)
+                if dry_run:
+                    continue
+                # Copy, then delete: an interrupted run leaves a duplicate
+                # that the next run removes, never a lost row. The delete
+                # skips cascades and signals, as the rows live on.
+                model.objects.using(target).bulk_create(batch, ignore_conflicts=True)
+                delete_rows(model, source, [row.pk for row in batch])
+                if model is Tweet:
+                    # the search index is per shard
+                    get_search_backend().index(batch)
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from jobs.queue import enqueue
+from tweets.models import Tweet
+from tweets.tasks import recount_likes
+
+
+class Command(BaseCommand):
+    help = "Recompute Tweet.like_count from the Like table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--enqueue",
+            action="store_true",
+            help="Queue one background job per batch instead of running inline.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_pk = 0
+        updated = 0
+        batches = 0
+        while True:
+            pks = [
+                tweet.pk
+                for tweet in Tweet.objects.only("id").batch_across_shards(
+                    last_pk, batch_size
+                )
+            ]
+            if not pks:
+                break
+            with transaction.atomic():
+                if options["enqueue"]:
+                    enqueue(
+                        "tweets.recount_likes",
+                        {"first_pk": pks[0], "last_pk": pks[-1]},
+                    )
+                else:
+                    updated += recount_likes(pks[0], pks[-1])
+            batches += 1
+            last_pk = pks[-1]
+        if options["enqueue"]:
+            self.stdout.write(self.style.SUCCESS(f"{batches}件のジョブを登録しました"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{updated}件のツイートを更新しました"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tweets.models import Tweet
+from tweets.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Re-index every tweet for search, e.g. after bulk loads."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        last_pk = 0
+        indexed = 0
+        while True:
+            tweets = Tweet.objects.only(
+                "id", "user_id", "content", "created_at"
+            ).batch_across_shards(last_pk, options["batch_size"])
+            if not tweets:
+                break
+            with transaction.atomic():
+                backend.index(tweets)
+            indexed += len(tweets)
+            last_pk = tweets[-1].pk
+        self.stdout.write(self.style.SUCCESS(f"{indexed}件のツイートを索引しました"))
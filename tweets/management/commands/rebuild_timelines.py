@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from accounts.models import FriendShip
+from tweets.timeline import backfill_timeline
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Fill home timeline inboxes from existing tweets and follow edges."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by("pk").iterator(chunk_size=options["batch_size"])
+        count = 0
+        for user in users:
+            backfill_timeline(user, user)
+            followed_ids = FriendShip.objects.filter(follow=user).values_list(
+                "followed_id", flat=True
+            )
+            for followed in User.objects.filter(pk__in=followed_ids):
+                backfill_timeline(user, followed)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"{count}人のタイムラインを再構築しました"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tweets.tasks import schedule_trends_refresh
+from tweets.trends import refresh_trends
+
+
+class Command(BaseCommand):
+    help = "Recompute the cached trends and drop expired trend buckets."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--schedule",
+            action="store_true",
+            help="Also queue the recurring tweets.refresh_trends job.",
+        )
+
+    def handle(self, *args, **options):
+        refresh_trends()
+        if options["schedule"]:
+            schedule_trends_refresh(timezone.now())
+        self.stdout.write(self.style.SUCCESS("トレンドを更新しました"))
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.10 on 2026-10-17 21:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_like_count(apps, schema_editor):
+    Tweet = apps.get_model('tweets', 'Tweet')
+    Like = apps.get_model('tweets', 'Like')
+    counts = (
+        Like.objects.filter(tweet=OuterRef('pk'))
+        .values('tweet')
+        .annotate(count=Count('*'))
+        .values('count')
+    )
+    Tweet.objects.update(like_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0002_tweet_created_at_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_like_count, migrations.RunPython.noop),
+    ]
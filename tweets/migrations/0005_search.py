@@ -0,0 +1,45 @@
+# Generated by Django 4.0.10 on 2026-10-17 22:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_fts_table(apps, schema_editor):
+    # Only SQLite gets the FTS5 index; other databases use SearchTerm.
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE tweets_tweet_search USING fts5(body, tokenize='unicode61')"
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE tweets_tweet_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0004_timelineentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=2)),
+                ('created_at', models.DateTimeField()),
+                ('tweet', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tweets.tweet')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchterm',
+            index=models.Index(fields=['term', '-created_at', '-tweet'], name='searchterm_term_created_at_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='searchterm',
+            constraint=models.UniqueConstraint(fields=('tweet', 'term'), name='searchterm_tweet_term_unique'),
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
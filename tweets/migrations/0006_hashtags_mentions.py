@@ -0,0 +1,57 @@
+# Generated by Django 4.0.10 on 2026-10-17 22:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tweets', '0005_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Hashtag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=140, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TweetHashtag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('hashtag', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='tweets.hashtag')),
+                ('tweet', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='hashtags', to='tweets.tweet')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Mention',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('tweet', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='tweets.tweet')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tweethashtag',
+            index=models.Index(fields=['hashtag', '-created_at', '-tweet'], name='tweethashtag_created_at_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='tweethashtag',
+            constraint=models.UniqueConstraint(fields=('tweet', 'hashtag'), name='tweethashtag_tweet_hashtag_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='mention',
+            index=models.Index(fields=['user', '-created_at', '-tweet'], name='mention_user_created_at_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='mention',
+            constraint=models.UniqueConstraint(fields=('tweet', 'user'), name='mention_tweet_user_unique'),
+        ),
+    ]
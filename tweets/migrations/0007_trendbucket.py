@@ -0,0 +1,32 @@
+# Generated by Django 4.0.10 on 2026-10-17 22:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0006_hashtags_mentions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('tag', 'Hashtag'), ('tweet', 'Tweet')], max_length=5)),
+                ('object_id', models.BigIntegerField()),
+                ('bucket', models.DateTimeField()),
+                ('posts', models.IntegerField(default=0)),
+                ('likes', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='trendbucket',
+            index=models.Index(fields=['bucket'], name='trendbucket_bucket_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='trendbucket',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id', 'bucket'), name='trendbucket_kind_object_bucket_unique'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.0.10 on 2026-10-17 22:52
+
+from django.db import migrations, models
+import mysite.snowflake
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0007_trendbucket'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='like',
+            name='id',
+            field=models.BigAutoField(default=mysite.snowflake.next_id, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='tweet',
+            name='id',
+            field=models.BigAutoField(default=mysite.snowflake.next_id, primary_key=True, serialize=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.0.10 on 2026-10-18 09:12
+
+from django.db import migrations
+
+
+def create_fts_table(apps, schema_editor):
+    # Each shard indexes its own tweets; default already has the table.
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS tweets_tweet_search USING fts5(body, tokenize='unicode61')"
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite' and schema_editor.connection.alias != 'default':
+        schema_editor.execute('DROP TABLE IF EXISTS tweets_tweet_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0008_snowflake_ids'),
+    ]
+
+    operations = [
+        # the hint lets the shard router run this on the shards too
+        migrations.RunPython(create_fts_table, drop_fts_table, hints={'model_name': 'tweet'}),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.0.10 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0009_search_on_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnowflakeWorker',
+            fields=[
+                ('worker_id', models.PositiveSmallIntegerField(primary_key=True, serialize=False)),
+                ('holder', models.CharField(blank=True, max_length=100)),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.0.10 on 2026-10-18 11:20
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce, Length
+
+
+def fill_tweet_length(apps, schema_editor):
+    # tweets on shards are not on this database; rebuild_search_index
+    # fills theirs
+    SearchTerm = apps.get_model('tweets', 'SearchTerm')
+    Tweet = apps.get_model('tweets', 'Tweet')
+    alias = schema_editor.connection.alias
+    lengths = Tweet.objects.using(alias).filter(pk=OuterRef('tweet_id')).values(length=Length('content'))
+    SearchTerm.objects.using(alias).update(tweet_length=Coalesce(Subquery(lengths[:1]), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0010_snowflakeworker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchterm',
+            name='tweet_length',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_tweet_length, migrations.RunPython.noop),
+    ]
@@ -1,22 +1,245 @@
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, pre_delete
 from django.utils import timezone
 
+from mysite.sharding import all_shards, delete_rows, shard_for_user
+from mysite.snowflake import next_id
+
+
+class ShardedQuerySet(models.QuerySet):
+    """Helpers for models stored on the shard of their user (see
+    mysite.sharding). Without TWEET_SHARDS they are plain queries."""
+
+    def for_user(self, user_id):
+        return self.using(shard_for_user(user_id)).filter(user_id=user_id)
+
+    def on_all_shards(self):
+        return [self.using(alias) for alias in all_shards()]
+
+    def first_across_shards(self):
+        for queryset in self.on_all_shards():
+            found = queryset.first()
+            if found is not None:
+                return found
+        return None
+
+    def in_bulk_across_shards(self, ids):
+        found = {}
+        for queryset in self.on_all_shards():
+            found.update(queryset.in_bulk(ids))
+        return found
+
+    def batch_across_shards(self, after_pk, size):
+        """The ``size`` rows with the smallest pks above ``after_pk`` over all
+        shards, in pk order: batches for walking a whole table."""
+        rows = [
+            row
+            for queryset in self.filter(pk__gt=after_pk).on_all_shards()
+            for row in queryset.order_by("pk")[:size]
+        ]
+        return sorted(rows, key=lambda row: row.pk)[:size]
+
+    def with_users(self):
+        # a shard has no user table to join
+        if settings.TWEET_SHARDS:
+            return self.prefetch_related("user")
+        return self.select_related("user")
+
 
 class Tweet(models.Model):
+    id = models.BigAutoField(primary_key=True, default=next_id)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content = models.TextField(max_length=140)
     created_at = models.DateTimeField(default=timezone.now)
+    like_count = models.PositiveIntegerField(default=0)
+
+    objects = ShardedQuerySet.as_manager()
+
+    def delete(self, using=None, keep_parents=False):
+        if not settings.TWEET_SHARDS:
+            return super().delete(using=using, keep_parents=keep_parents)
+        # The cascade cannot run on the shard: the likes are on the likers'
+        # shards and the other rows pointing at the tweet are on default.
+        alias = self._state.db or shard_for_user(self.user_id)
+        deleted = {}
+        pre_delete.send(sender=Tweet, instance=self, using=alias)
+        with transaction.atomic():
+            for model in (TimelineEntry, SearchTerm, TweetHashtag, Mention):
+                count, _ = model.objects.filter(tweet_id=self.pk).delete()
+                deleted[model._meta.label] = count
+        likes = Like.objects.filter(tweet_id=self.pk).values_list("pk", flat=True)
+        deleted[Like._meta.label] = sum(
+            delete_rows(Like, queryset.db, list(queryset))
+            for queryset in likes.on_all_shards()
+        )
+        deleted[Tweet._meta.label] = delete_rows(Tweet, alias, [self.pk])
+        post_delete.send(sender=Tweet, instance=self, using=alias)
+        return sum(deleted.values()), deleted
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="tweet_created_at_id_idx"),
+            models.Index(
+                fields=["user", "-created_at", "-id"],
+                name="tweet_user_created_at_id_idx",
+            ),
+        ]
 
 
 class Like(models.Model):
+    id = models.BigAutoField(primary_key=True, default=next_id)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ShardedQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
                 fields=["user", "tweet"], name="like_user_tweet_unique"
             ),
         ]
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="timeline_entries",
+        on_delete=models.CASCADE,
+    )
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE)
+    author = models.ForeignKey(
+        settings.AUTH_USER_MODEL, related_name="+", on_delete=models.CASCADE
+    )
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "tweet"], name="timelineentry_user_tweet_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-created_at", "-tweet"],
+                name="timeline_user_created_at_idx",
+            ),
+            models.Index(fields=["user", "author"], name="timeline_user_author_idx"),
+        ]
+
+
+class SearchTerm(models.Model):
+    """Inverted index for tweet search on databases without a native
+    full-text index; see tweets.search.NgramTableBackend."""
+
+    term = models.CharField(max_length=2)
+    tweet = models.ForeignKey(
+        Tweet, related_name="+", on_delete=models.CASCADE, db_index=False
+    )
+    created_at = models.DateTimeField()
+    # in characters, for ranking
+    tweet_length = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["tweet", "term"], name="searchterm_tweet_term_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["term", "-created_at", "-tweet"],
+                name="searchterm_term_created_at_idx",
+            ),
+        ]
+
+
+class Hashtag(models.Model):
+    name = models.CharField(max_length=140, unique=True)
+
+    def __str__(self):
+        return f"#{self.name}"
+
+
+class TweetHashtag(models.Model):
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, db_index=False)
+    tweet = models.ForeignKey(
+        Tweet, related_name="hashtags", on_delete=models.CASCADE, db_index=False
+    )
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["tweet", "hashtag"], name="tweethashtag_tweet_hashtag_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["hashtag", "-created_at", "-tweet"],
+                name="tweethashtag_created_at_idx",
+            ),
+        ]
+
+
+class Mention(models.Model):
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="mentions",
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
+    tweet = models.ForeignKey(
+        Tweet, related_name="mentions", on_delete=models.CASCADE, db_index=False
+    )
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["tweet", "user"], name="mention_tweet_user_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-created_at", "-tweet"],
+                name="mention_user_created_at_idx",
+            ),
+        ]
+
+
+class TrendBucket(models.Model):
+    """Post and like activity of one hashtag or tweet during one time bucket;
+    see tweets.trends."""
+
+    class Kind(models.TextChoices):
+        HASHTAG = "tag"
+        TWEET = "tweet"
+
+    kind = models.CharField(max_length=5, choices=Kind.choices)
+    object_id = models.BigIntegerField()
+    bucket = models.DateTimeField()
+    posts = models.IntegerField(default=0)
+    likes = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "object_id", "bucket"],
+                name="trendbucket_kind_object_bucket_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["bucket"], name="trendbucket_bucket_idx"),
+        ]
+
+
+class SnowflakeWorker(models.Model):
+    """One row per snowflake worker id, leased by a process until
+    ``expires_at``; see mysite.snowflake.WorkerLease."""
+
+    worker_id = models.PositiveSmallIntegerField(primary_key=True)
+    holder = models.CharField(max_length=100, blank=True)
+    expires_at = models.DateTimeField()
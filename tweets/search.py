@@ -0,0 +1,239 @@
+import re
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import Count, F, FloatField, Func, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Greatest, Length
+from django.utils.module_loading import import_string
+
+from mysite.pagination import KeysetPage, KeysetPaginator
+from mysite.sharding import ShardedKeysetPaginator, all_shards, shard_for_user
+
+from .models import SearchTerm, Tweet
+
+FTS_TABLE = "tweets_tweet_search"
+
+WORD = re.compile(r"\w+")
+
+
+def normalize(text):
+    # NFKC folds full-width latin and half-width kana onto one form.
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def index_terms(text):
+    """Split text into overlapping bigrams, plus the last character of each
+    word on its own, so that every character starts at least one term.
+
+    Japanese has no spaces between words, so bigrams are what makes any
+    substring of two or more characters findable.
+    """
+    terms = []
+    for word in WORD.findall(normalize(text)):
+        terms.extend(word[i : i + 2] for i in range(len(word) - 1))
+        terms.append(word[-1])
+    return terms
+
+
+class EpochDays(Func):
+    """Days since the Unix epoch of a datetime expression, as a float."""
+
+    output_field = FloatField()
+    template = "EXTRACT(EPOCH FROM %(expressions)s) / 86400.0"
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler,
+            connection,
+            template="(julianday(%(expressions)s) - 2440587.5)",
+            **extra_context,
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler,
+            connection,
+            template="UNIX_TIMESTAMP(%(expressions)s) / 86400.0",
+            **extra_context,
+        )
+
+
+def query_terms(query):
+    """Return ``(terms, prefix)`` per word of the query. A word matches when
+    all its bigrams occur consecutively; a one-character word matches any
+    term starting with it."""
+    words = []
+    for word in WORD.findall(normalize(query)):
+        if len(word) == 1:
+            words.append(([word], True))
+        else:
+            words.append(([word[i : i + 2] for i in range(len(word) - 1)], False))
+    return words
+
+
+class SearchBackend:
+    """Keeps a search index of tweet contents and pages through matches.
+
+    ``search`` returns a KeysetPage of tweet ids, best match first, whose
+    ``older_cursor`` continues the same query.
+
+    Matches are ranked by recency plus relevance: the score is the tweet's
+    ``created_at`` in days, plus TWEETS_SEARCH_RELEVANCE_DAYS times the share
+    of the tweet that the query covers. A tweet that is only the query thus
+    ranks as if posted that many days later. Unlike bm25, whose statistics
+    change with every tweet indexed, the score depends only on the tweet and
+    the query, so a ``(score, id)`` cursor never skips or repeats results.
+    """
+
+    def index(self, tweets):
+        raise NotImplementedError
+
+    def remove(self, tweet_ids):
+        raise NotImplementedError
+
+    def search(self, query, page_size, older=None):
+        raise NotImplementedError
+
+    def score(self, query, created_at, length):
+        """The score expression of a match, given expressions for the
+        tweet's ``created_at`` and length in characters."""
+        covered = sum(len(word) for word in WORD.findall(normalize(query)))
+        return Cast(
+            EpochDays(created_at)
+            + Value(settings.TWEETS_SEARCH_RELEVANCE_DAYS * covered)
+            / Greatest(length, Value(covered)),
+            FloatField(),
+        )
+
+    def paginate(self, paginator, older=None, id_key="id"):
+        page = paginator.get_page(older=older)
+        page.object_list = [row[id_key] for row in page.object_list]
+        return page
+
+
+class Fts5Backend(SearchBackend):
+    """SQLite FTS5 over the bigram terms, one index per shard holding the
+    shard's tweets, so that a match joins the tweets on the same database.
+    """
+
+    def index(self, tweets):
+        tweets = list(tweets)
+        self.remove([tweet.pk for tweet in tweets])
+        shards = defaultdict(list)
+        for tweet in tweets:
+            shards[shard_for_user(tweet.user_id) or DEFAULT_DB_ALIAS].append(tweet)
+        for alias, batch in shards.items():
+            with connections[alias].cursor() as cursor:
+                cursor.executemany(
+                    f"INSERT INTO {FTS_TABLE} (rowid, body) VALUES (%s, %s)",
+                    [
+                        (tweet.pk, " ".join(index_terms(tweet.content)))
+                        for tweet in batch
+                    ],
+                )
+
+    def remove(self, tweet_ids):
+        # only the ids are known, not the authors
+        for alias in all_shards():
+            with connections[alias or DEFAULT_DB_ALIAS].cursor() as cursor:
+                cursor.executemany(
+                    f"DELETE FROM {FTS_TABLE} WHERE rowid = %s",
+                    [(pk,) for pk in tweet_ids],
+                )
+
+    def match_expression(self, query):
+        return " AND ".join(
+            f'"{terms[0]}"*' if prefix else '"' + " ".join(terms) + '"'
+            for terms, prefix in query_terms(query)
+        )
+
+    def search(self, query, page_size, older=None):
+        expression = self.match_expression(query)
+        if not expression:
+            return KeysetPage([])
+        matching = RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [expression]
+        )
+        # the raw subquery runs on each shard, against the shard's own index
+        tweets = Tweet.objects.filter(pk__in=matching).annotate(
+            score=self.score(query, F("created_at"), Length("content"))
+        )
+        paginator = ShardedKeysetPaginator(
+            tweets.values("id", "score"), page_size, keys=("score", "id")
+        )
+        return self.paginate(paginator, older=older)
+
+
+class NgramTableBackend(SearchBackend):
+    """Portable inverted index in the SearchTerm table.
+
+    A tweet matches when it has every bigram of the query, found by index
+    range scans on ``term``. The terms carry the tweet's ``created_at`` and
+    length, so pages are read from this table alone, whatever database
+    (shard) the tweets are on.
+    """
+
+    def index(self, tweets):
+        tweets = list(tweets)
+        self.remove([tweet.pk for tweet in tweets])
+        SearchTerm.objects.bulk_create(
+            [
+                SearchTerm(
+                    term=term,
+                    tweet=tweet,
+                    created_at=tweet.created_at,
+                    tweet_length=len(tweet.content),
+                )
+                for tweet in tweets
+                for term in set(index_terms(tweet.content))
+            ],
+            batch_size=1000,
+        )
+
+    def remove(self, tweet_ids):
+        SearchTerm.objects.filter(tweet_id__in=tweet_ids).delete()
+
+    def search(self, query, page_size, older=None):
+        words = query_terms(query)
+        if not words:
+            return KeysetPage([])
+        # one row per tweet: a term of the first word, then the other words
+        # by tweet id
+        terms, prefix = words[0]
+        if prefix:
+            rows = SearchTerm.objects.filter(term__startswith=terms[0])
+        else:
+            rows = SearchTerm.objects.filter(term=terms[0])
+        for terms, prefix in words:
+            if prefix:
+                matching = SearchTerm.objects.filter(term__startswith=terms[0])
+            else:
+                matching = (
+                    SearchTerm.objects.filter(term__in=set(terms))
+                    .values("tweet")
+                    .annotate(matched=Count("term"))
+                    .filter(matched=len(set(terms)))
+                )
+            rows = rows.filter(tweet_id__in=matching.values("tweet"))
+        rows = rows.annotate(
+            score=self.score(query, F("created_at"), F("tweet_length"))
+        )
+        paginator = KeysetPaginator(
+            rows.values("tweet_id", "score").distinct(),
+            page_size,
+            keys=("score", "tweet_id"),
+        )
+        return self.paginate(paginator, older=older, id_key="tweet_id")
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    if settings.TWEETS_SEARCH_BACKEND:
+        return import_string(settings.TWEETS_SEARCH_BACKEND)()
+    if connection.vendor == "sqlite":
+        return Fts5Backend()
+    return NgramTableBackend()
@@ -0,0 +1,50 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mysite.cache import timeline_pages, tweet_cards, tweet_versions
+
+from .events import publish_authored_tweet
+from .models import Tweet
+from .search import get_search_backend
+from .templatetags.tweet_tags import card_ident
+
+
+@receiver(post_save, sender=Tweet)
+@receiver(post_delete, sender=Tweet)
+def invalidate_author_timeline(sender, instance, **kwargs):
+    # Followers' cached pages drop the deleted tweet when they are read and
+    # pick up new ones as the fan-out job reaches them.
+    timeline_pages.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=Tweet)
+@receiver(post_delete, sender=Tweet)
+def invalidate_tweet_card(sender, instance, **kwargs):
+    # Like changes need no invalidation: the count and the liked flag are part
+    # of the key, so a new like simply renders under a new key.
+    tweet_cards.invalidate(
+        card_ident(instance.pk, instance.like_count, False),
+        card_ident(instance.pk, instance.like_count, True),
+    )
+
+
+@receiver(post_delete, sender=Tweet)
+def invalidate_tweet_version(sender, instance, **kwargs):
+    # cached home pages may still list the tweet; their ETags must change
+    tweet_versions.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Tweet)
+def publish_tweet(sender, instance, created, **kwargs):
+    if created:
+        publish_authored_tweet(instance)
+
+
+@receiver(post_save, sender=Tweet)
+def index_tweet(sender, instance, **kwargs):
+    get_search_backend().index([instance])
+
+
+@receiver(post_delete, sender=Tweet)
+def unindex_tweet(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
@@ -0,0 +1,117 @@
+import asyncio
+import io
+import json
+from importlib import import_module
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.handlers.asgi import ASGIRequest
+
+from mysite.events import get_broker
+
+from .events import author_channel, timeline_channel, tweet_channel
+from .timeline import fan_out_on_read_followees
+
+
+async def authenticate(scope):
+    request = ASGIRequest(scope, io.BytesIO())
+    engine = import_module(settings.SESSION_ENGINE)
+    request.session = engine.SessionStore(
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    return await sync_to_async(get_user)(request)
+
+
+def ids(value):
+    return [int(part) for part in value.split(",") if part.isdigit()]
+
+
+def get_channels(user, query):
+    """Channels a page asks for: ``timeline`` for the viewer's home timeline,
+    ``user`` for one author's new tweets and ``tweets`` for like counts."""
+    channels = []
+    if query.get("timeline"):
+        channels.append(timeline_channel(user.pk))
+        # big accounts are not fanned out, so listen to them directly
+        channels.extend(map(author_channel, fan_out_on_read_followees(user)))
+    channels.extend(map(author_channel, ids(query.get("user", ""))[:1]))
+    tweet_ids = ids(query.get("tweets", ""))[: settings.EVENTS_MAX_TWEETS]
+    channels.extend(map(tweet_channel, tweet_ids))
+    return channels
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+def encode_event(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode()
+
+
+async def event_stream(scope, receive, send):
+    """Raw ASGI app streaming server-sent events to a logged-in page.
+
+    An idle connection is only a coroutine waiting on its subscription, so
+    one worker can hold thousands of them. Under WSGI the same URL answers
+    204, which tells EventSource not to retry and the page to poll instead.
+    """
+    user = await authenticate(scope)
+    if not user.is_authenticated:
+        await send({"type": "http.response.start", "status": 403, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    query = {
+        key: values[-1]
+        for key, values in parse_qs(scope["query_string"].decode()).items()
+    }
+    channels = await sync_to_async(get_channels)(user, query)
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        }
+    )
+    await send(
+        {
+            "type": "http.response.body",
+            "body": f"retry: {settings.EVENTS_RETRY * 1000}\n\n".encode(),
+            "more_body": True,
+        }
+    )
+    subscription = get_broker().subscribe(channels)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    # An event is waited for across keepalives rather than cancelled, since
+    # cancelling may lose one that is already on its way.
+    next_event = None
+    try:
+        while True:
+            if next_event is None:
+                next_event = asyncio.ensure_future(subscription.get())
+            done, _ = await asyncio.wait(
+                {next_event, disconnected},
+                timeout=settings.EVENTS_KEEPALIVE,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if disconnected in done:
+                break
+            if next_event in done:
+                _, event = next_event.result()
+                next_event = None
+                body = encode_event(event)
+            else:
+                body = b": keepalive\n\n"
+            await send({"type": "http.response.body", "body": body, "more_body": True})
+    finally:
+        if next_event is not None:
+            next_event.cancel()
+        disconnected.cancel()
+        await subscription.close()
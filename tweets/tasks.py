@@ -0,0 +1,98 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from accounts.models import FriendShip
+from jobs.queue import enqueue, register
+
+from . import timeline, trends
+from .models import Like, Tweet
+
+User = get_user_model()
+
+
+@register("tweets.fan_out_tweet")
+def fan_out_tweet(tweet_id):
+    tweet = Tweet.objects.filter(pk=tweet_id).first_across_shards()
+    if tweet is not None:
+        timeline.fan_out_tweet(tweet)
+
+
+@register("tweets.backfill_timeline")
+def backfill_timeline(user_id, followed_id):
+    with transaction.atomic():
+        # the follow may have been undone, and the inbox cleaned, while the
+        # job was queued; locking it makes an unfollow wait for the backfill
+        follows = (
+            FriendShip.objects.select_for_update()
+            .filter(follow_id=user_id, followed_id=followed_id)
+            .exists()
+        )
+        if not follows:
+            return
+        users = User.objects.in_bulk([user_id, followed_id])
+        if len(users) == 2:
+            timeline.backfill_timeline(users[user_id], users[followed_id])
+
+
+@register("tweets.recount_likes")
+def recount_likes(first_pk, last_pk):
+    if settings.TWEET_SHARDS:
+        return _recount_likes_on_shards(first_pk, last_pk)
+    counts = (
+        Like.objects.filter(tweet=OuterRef("pk"))
+        .values("tweet")
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    return Tweet.objects.filter(pk__gte=first_pk, pk__lte=last_pk).update(
+        like_count=Coalesce(Subquery(counts), 0)
+    )
+
+
+def _recount_likes_on_shards(first_pk, last_pk):
+    # The likes of a tweet are on its likers' shards, so no subquery can
+    # count them: add up the counts of every shard, then update each shard's
+    # tweets, one UPDATE per distinct count.
+    counts = Counter()
+    likes = Like.objects.filter(tweet_id__gte=first_pk, tweet_id__lte=last_pk)
+    for queryset in likes.on_all_shards():
+        counts.update(
+            dict(
+                queryset.values("tweet_id")
+                .annotate(count=Count("*"))
+                .values_list("tweet_id", "count")
+            )
+        )
+    updated = 0
+    tweets = Tweet.objects.filter(pk__gte=first_pk, pk__lte=last_pk)
+    for queryset in tweets.on_all_shards():
+        by_count = defaultdict(list)
+        for pk in queryset.values_list("pk", flat=True):
+            by_count[counts[pk]].append(pk)
+        for count, pks in by_count.items():
+            updated += queryset.filter(pk__in=pks).update(like_count=count)
+    return updated
+
+
+@register("tweets.refresh_trends")
+def refresh_trends():
+    trends.refresh_trends()
+    if settings.JOBS_EAGER:
+        # eager jobs run at once, so a recurring one would never stop
+        return
+    schedule_trends_refresh(
+        timezone.now() + timedelta(seconds=settings.TRENDS_REFRESH_SECONDS)
+    )
+
+
+def schedule_trends_refresh(run_after):
+    # one job per slot, however many workers reschedule it
+    slot = int(run_after.timestamp()) // settings.TRENDS_REFRESH_SECONDS
+    enqueue("tweets.refresh_trends", run_after=run_after, key=f"refresh_trends:{slot}")
@@ -0,0 +1,53 @@
+from django import template
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.html import escape, format_html
+from django.utils.safestring import mark_safe
+
+from mysite.cache import tweet_cards
+
+from ..entities import HASHTAG, normalize_hashtag
+
+register = template.Library()
+
+
+def card_ident(tweet_id, like_count, liked):
+    return f"{tweet_id}:{like_count}:{int(liked)}"
+
+
+@register.simple_tag
+def render_tweet_cards(tweets, viewer):
+    """Render tweets/card.html for every tweet, reusing cached fragments.
+
+    A card only depends on the tweet, its like count and whether the viewer
+    liked it, so those make up the key. All cards of a page are fetched with
+    a single get_many and the misses are stored with a single set_many.
+    """
+    idents = [
+        card_ident(tweet.pk, tweet.like_count, viewer.has_liked(tweet))
+        for tweet in tweets
+    ]
+    cards = tweet_cards.get_many(idents)
+    rendered = {}
+    for tweet, ident in zip(tweets, idents):
+        if ident not in cards:
+            cards[ident] = rendered[ident] = render_to_string(
+                "tweets/card.html",
+                {"tweet": tweet, "liked": viewer.has_liked(tweet)},
+            )
+    tweet_cards.set_many(rendered)
+    return mark_safe("".join(cards[ident] for ident in idents))
+
+
+@register.filter
+def hashtag_links(content):
+    """Escape tweet content and link its hashtags to their listings."""
+    parts = []
+    last = 0
+    for match in HASHTAG.finditer(content):
+        parts.append(escape(content[last : match.start()]))
+        url = reverse("tweets:hashtag", args=[normalize_hashtag(match.group(1))])
+        parts.append(format_html('<a href="{}">{}</a>', url, match.group()))
+        last = match.end()
+    parts.append(escape(content[last:]))
+    return mark_safe("".join(parts))
@@ -1,14 +1,1368 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, connections
+from django.db.models import Count, F
+from django.http import Http404, HttpResponse
+from django.test import (
+    AsyncRequestFactory,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from mysite import settings
+from accounts.models import FriendShip
+from jobs.models import Job
+from jobs.queue import claim_batch, run_job
+from mysite import settings, snowflake
+from mysite.cache import metrics, timeline_pages, trends, tweet_cards
+from mysite.events import LocalBroker, get_broker
+from mysite.health import connection_health_middleware
+from mysite.replicas import ReplicaRouter, sticky_primary_middleware
+from mysite.sharding import (
+    ShardedKeysetPaginator,
+    ShardRouter,
+    jump_hash,
+    merge_newest_first,
+    shard_for_user,
+)
+from mysite.snowflake import (
+    EPOCH_MS,
+    MAX_SEQUENCE,
+    MAX_WORKER,
+    SEQUENCE_BITS,
+    SnowflakeGenerator,
+    WorkerLease,
+    next_id,
+    snowflake_time_ms,
+)
 
-from .models import Like, Tweet
+from . import async_views, tasks
+from .entities import extract_hashtags, extract_mentions, save_entities
+from .likes import like_batch, like_tweet, unlike_tweet
+from .models import (
+    Hashtag,
+    Like,
+    Mention,
+    TimelineEntry,
+    TrendBucket,
+    Tweet,
+    TweetHashtag,
+)
+from .search import FTS_TABLE, get_search_backend, index_terms
+from .stream import event_stream
+from .templatetags.tweet_tags import card_ident
+from .timeline import add_to_own_timeline, fan_out_tweet, home_timeline_page
+from .trends import compute_trends, refresh_trends
 
 User = get_user_model()
 
 
+@override_settings(TWEETS_PAGE_SIZE=2)
+class TestHomeViewPagination(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="test@test.test", password="testpassword"
+        )
+        self.client.login(username="testuser", password="testpassword")
+        now = timezone.now()
+        # two tweets share a timestamp so the id tie-breaker is exercised
+        self.tweets = [
+            Tweet.objects.create(user=self.user, content="tweet0", created_at=now),
+            Tweet.objects.create(user=self.user, content="tweet1", created_at=now),
+            Tweet.objects.create(
+                user=self.user,
+                content="tweet2",
+                created_at=now + timedelta(minutes=1),
+            ),
+            Tweet.objects.create(
+                user=self.user,
+                content="tweet3",
+                created_at=now + timedelta(minutes=2),
+            ),
+            Tweet.objects.create(
+                user=self.user,
+                content="tweet4",
+                created_at=now + timedelta(minutes=3),
+            ),
+        ]
+        for tweet in self.tweets:
+            add_to_own_timeline(tweet)
+
+    def test_success_get_first_page(self):
+        response = self.client.get(reverse("tweets:home"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(response.context["tweets"]), [self.tweets[4], self.tweets[3]]
+        )
+        self.assertTrue(response.context["page"].has_older)
+        self.assertFalse(response.context["page"].has_newer)
+
+    def test_success_get_older_and_newer_pages(self):
+        response = self.client.get(reverse("tweets:home"))
+        older = response.context["page"].older_cursor
+        response = self.client.get(reverse("tweets:home"), {"older": older})
+        self.assertEqual(
+            list(response.context["tweets"]), [self.tweets[2], self.tweets[1]]
+        )
+        older = response.context["page"].older_cursor
+        response = self.client.get(reverse("tweets:home"), {"older": older})
+        self.assertEqual(list(response.context["tweets"]), [self.tweets[0]])
+        self.assertFalse(response.context["page"].has_older)
+        self.assertTrue(response.context["page"].has_newer)
+
+        newer = response.context["page"].newer_cursor
+        response = self.client.get(reverse("tweets:home"), {"newer": newer})
+        self.assertEqual(
+            list(response.context["tweets"]), [self.tweets[2], self.tweets[1]]
+        )
+        self.assertTrue(response.context["page"].has_newer)
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(reverse("tweets:home"), {"older": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_success_get_liked_ids_limited_to_page(self):
+        Like.objects.create(user=self.user, tweet=self.tweets[4])
+        Like.objects.create(user=self.user, tweet=self.tweets[0])
+        response = self.client.get(reverse("tweets:home"))
+        self.assertEqual(response.context["viewer"].liked_ids, {self.tweets[4].id})
+
+
+@override_settings(JOBS_EAGER=True)
+class TestHomeTimeline(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(
+            username="testuser1", email="test@test.test", password="testpassword"
+        )
+        self.user2 = User.objects.create_user(
+            username="testuser2", email="test@test.test", password="testpassword"
+        )
+        self.user3 = User.objects.create_user(
+            username="testuser3", email="test@test.test", password="testpassword"
+        )
+        FriendShip.objects.create(follow=self.user1, followed=self.user2)
+
+    def post_tweet(self, username, content):
+        self.client.login(username=username, password="testpassword")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("tweets:create"), {"content": content})
+        self.client.get(reverse("accounts:logout"))
+        return Tweet.objects.get(content=content)
+
+    def get_home(self, username):
+        self.client.login(username=username, password="testpassword")
+        return list(self.client.get(reverse("tweets:home")).context["tweets"])
+
+    def test_success_fan_out_to_followers(self):
+        tweet2 = self.post_tweet("testuser2", "tweet2")
+        tweet3 = self.post_tweet("testuser3", "tweet3")
+        self.assertEqual(self.get_home("testuser1"), [tweet2])
+        self.assertEqual(self.get_home("testuser2"), [tweet2])
+        self.assertEqual(self.get_home("testuser3"), [tweet3])
+
+    def test_success_backfill_on_follow(self):
+        tweet3 = self.post_tweet("testuser3", "tweet3")
+        self.client.login(username="testuser1", password="testpassword")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("accounts:follow", kwargs={"username": "testuser3"})
+            )
+        self.assertEqual(self.get_home("testuser1"), [tweet3])
+
+    def test_success_skip_backfill_after_unfollow(self):
+        tweet3 = self.post_tweet("testuser3", "tweet3")
+        self.client.login(username="testuser1", password="testpassword")
+        # the backfill job is still queued when user1 unfollows
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(
+                reverse("accounts:follow", kwargs={"username": "testuser3"})
+            )
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": "testuser3"}))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.get_home("testuser1"), [])
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.user1, tweet=tweet3).exists()
+        )
+
+    def test_success_remove_on_unfollow(self):
+        self.post_tweet("testuser2", "tweet2")
+        self.client.login(username="testuser1", password="testpassword")
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": "testuser2"}))
+        self.assertEqual(self.get_home("testuser1"), [])
+
+    def test_success_remove_on_delete(self):
+        tweet2 = self.post_tweet("testuser2", "tweet2")
+        self.client.login(username="testuser2", password="testpassword")
+        self.client.post(reverse("tweets:delete", kwargs={"pk": tweet2.pk}))
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=0)
+    def test_success_fan_out_on_read(self):
+        tweet1 = self.post_tweet("testuser1", "tweet1")
+        tweet2 = self.post_tweet("testuser2", "tweet2")
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.user1, tweet=tweet2).exists()
+        )
+        self.assertEqual(self.get_home("testuser1"), [tweet2, tweet1])
+
+    def test_success_rebuild_timelines_command(self):
+        tweet1 = Tweet.objects.create(user=self.user1, content="tweet1")
+        tweet2 = Tweet.objects.create(user=self.user2, content="tweet2")
+        call_command("rebuild_timelines", stdout=StringIO())
+        self.assertEqual(self.get_home("testuser1"), [tweet2, tweet1])
+        self.assertEqual(self.get_home("testuser2"), [tweet2])
+
+
+@override_settings(JOBS_EAGER=True)
+class TestHomeSinceView(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="test@test.test", password="testpassword"
+        )
+        self.client.login(username="testuser", password="testpassword")
+        now = timezone.now()
+        self.tweets = []
+        for i in range(4):
+            tweet = Tweet.objects.create(
+                user=self.user,
+                content=f"tweet{i}",
+                created_at=now + timedelta(minutes=i),
+            )
+            add_to_own_timeline(tweet)
+            self.tweets.append(tweet)
+
+    def get_since(self, tweet_id):
+        return self.client.get(reverse("tweets:home_since"), {"since_id": tweet_id})
+
+    def test_success_get(self):
+        response = self.get_since(self.tweets[1].pk)
+        data = response.json()
+        self.assertFalse(data["reload"])
+        self.assertEqual(data["count"], 2)
+        self.assertEqual(data["latest_id"], str(self.tweets[3].pk))
+        self.assertLess(data["html"].index("tweet3"), data["html"].index("tweet2"))
+        self.assertNotIn("tweet1", data["html"])
+
+    def test_success_get_nothing_new(self):
+        data = self.get_since(self.tweets[3].pk).json()
+        self.assertEqual(data["count"], 0)
+        self.assertEqual(data["latest_id"], str(self.tweets[3].pk))
+
+    @override_settings(TIMELINE_SINCE_LIMIT=2)
+    def test_success_reload_when_too_far_behind(self):
+        self.assertTrue(self.get_since(self.tweets[0].pk).json()["reload"])
+        self.assertFalse(self.get_since(self.tweets[1].pk).json()["reload"])
+
+    def test_success_reload_when_tweet_deleted(self):
+        tweet_id = self.tweets[1].pk
+        self.tweets[1].delete()
+        self.assertTrue(self.get_since(tweet_id).json()["reload"])
+
+    def test_success_get_without_since_id(self):
+        data = self.client.get(reverse("tweets:home_since")).json()
+        self.assertFalse(data["reload"])
+        self.assertEqual(data["count"], 4)
+        self.assertEqual(data["latest_id"], str(self.tweets[3].pk))
+
+    def test_success_get_without_since_id_nothing_new(self):
+        User.objects.create_user(username="other", password="testpassword")
+        self.client.login(username="other", password="testpassword")
+        data = self.client.get(reverse("tweets:home_since")).json()
+        self.assertEqual(data["count"], 0)
+        self.assertEqual(data["latest_id"], "")
+
+    def test_success_home_polls_with_empty_timeline(self):
+        User.objects.create_user(username="other", password="testpassword")
+        self.client.login(username="other", password="testpassword")
+        response = self.client.get(reverse("tweets:home"))
+        self.assertContains(response, reverse("tweets:home_since"))
+
+    def test_failure_get_with_invalid_since_id(self):
+        response = self.get_since("invalid")
+        self.assertEqual(response.status_code, 400)
+
+
+class TestLocalBroker(TestCase):
+    def test_success_publish(self):
+        broker = LocalBroker()
+
+        async def scenario():
+            subscription = broker.subscribe(["a", "b"])
+            broker.publish("a", {"n": 1})
+            broker.publish("c", {"n": 2})
+            broker.publish("b", {"n": 3})
+            events = [await subscription.get(), await subscription.get()]
+            await subscription.close()
+            return events
+
+        self.assertEqual(async_to_sync(scenario)(), [("a", {"n": 1}), ("b", {"n": 3})])
+        self.assertEqual(broker.subscriptions, {})
+
+
+class TestConnectionHealth(TestCase):
+    def setUp(self):
+        self.connection = mock.Mock(connection=object(), in_atomic_block=False)
+        patcher = mock.patch(
+            "mysite.health.connections",
+            mock.MagicMock(
+                settings={"default": {"CONN_HEALTH_CHECKS": True}, "other": {}},
+                __getitem__=lambda _, alias: self.connection,
+            ),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self):
+        middleware = connection_health_middleware(lambda request: HttpResponse())
+        return middleware(RequestFactory().get("/"))
+
+    def test_success_close_broken_connection(self):
+        self.connection.is_usable.return_value = False
+        self.assertEqual(self.request().status_code, 200)
+        self.connection.close.assert_called_once_with()
+
+    def test_success_keep_working_connection(self):
+        self.connection.is_usable.return_value = True
+        self.request()
+        self.connection.close.assert_not_called()
+
+    def test_success_check_async(self):
+        self.connection.is_usable.return_value = False
+
+        async def view(request):
+            return HttpResponse()
+
+        middleware = connection_health_middleware(view)
+        async_to_sync(middleware)(AsyncRequestFactory().get("/"))
+        self.connection.close.assert_called_once_with()
+
+
+@override_settings(DATABASE_REPLICAS=["replica1", "replica2"])
+class TestReplicaRouter(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+
+    def read_alias(self, request):
+        def view(request):
+            response = HttpResponse()
+            response.alias = self.router.db_for_read(Tweet)
+            return response
+
+        return sticky_primary_middleware(view)(request)
+
+    def test_success_read_replica(self):
+        response = self.read_alias(self.factory.get("/"))
+        self.assertIn(response.alias, ["replica1", "replica2"])
+        self.assertNotIn(settings.REPLICA_STICKY_COOKIE, response.cookies)
+
+    def test_success_write_primary(self):
+        response = self.read_alias(self.factory.post("/"))
+        self.assertEqual(response.alias, "default")
+        self.assertEqual(self.router.db_for_write(Tweet), "default")
+        cookie = response.cookies[settings.REPLICA_STICKY_COOKIE]
+        self.assertEqual(cookie["max-age"], settings.REPLICA_STICKY_SECONDS)
+
+    def test_success_read_own_writes(self):
+        request = self.factory.get("/")
+        request.COOKIES[settings.REPLICA_STICKY_COOKIE] = "1"
+        self.assertEqual(self.read_alias(request).alias, "default")
+
+    def test_success_read_replica_async(self):
+        async def view(request):
+            response = HttpResponse()
+            response.alias = await sync_to_async(self.router.db_for_read)(Tweet)
+            return response
+
+        middleware = sticky_primary_middleware(view)
+        response = async_to_sync(middleware)(AsyncRequestFactory().get("/"))
+        self.assertIn(response.alias, ["replica1", "replica2"])
+
+    def test_success_primary_outside_requests(self):
+        self.assertEqual(self.router.db_for_read(Tweet), "default")
+        self.assertTrue(self.router.allow_migrate("default", "tweets"))
+        self.assertFalse(self.router.allow_migrate("replica1", "tweets"))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_success_no_replicas(self):
+        self.assertEqual(self.read_alias(self.factory.get("/")).alias, "default")
+
+
+class TestGenerateWorkload(TestCase):
+    options = {"users": 40, "tweets": 60, "likes": 300, "follows": 5, "workers": 1}
+
+    def assertConsistent(self):
+        self.assertEqual(User.objects.count(), 40)
+        self.assertEqual(Tweet.objects.count(), 60)
+        self.assertEqual(Like.objects.count(), 300)
+        self.assertFalse(
+            Tweet.objects.annotate(likes=Count("like"))
+            .exclude(likes=F("like_count"))
+            .exists()
+        )
+        self.assertFalse(
+            User.objects.annotate(following=Count("follow"))
+            .exclude(following=F("following_count"))
+            .exists()
+        )
+        self.assertFalse(
+            User.objects.annotate(followers=Count("followed"))
+            .exclude(followers=F("followers_count"))
+            .exists()
+        )
+        self.assertFalse(FriendShip.objects.filter(follow=F("followed")).exists())
+        # likes keep the times they were generated with, after their tweet
+        self.assertFalse(
+            Like.objects.filter(created_at__lt=F("tweet__created_at")).exists()
+        )
+        self.assertLess(
+            Like.objects.earliest("created_at").created_at,
+            timezone.now() - timedelta(days=1),
+        )
+
+    def test_success_generate_into_database(self):
+        call_command(
+            "generate_workload", batch_size=25, stdout=StringIO(), **self.options
+        )
+        self.assertConsistent()
+        self.assertTrue(
+            self.client.login(username="load1", password="password"),
+        )
+
+    def test_success_generate_fixture(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "workload.jsonl.gz")
+            call_command(
+                "generate_workload", output=path, stdout=StringIO(), **self.options
+            )
+            self.assertFalse(User.objects.exists())
+            call_command("loaddata", path, stdout=StringIO())
+        self.assertConsistent()
+
+    def test_success_generate_without_leasing(self):
+        # the command numbers its rows, so it needs no snowflake worker id
+        with self.settings(SNOWFLAKE_IDS=True):
+            with mock.patch.object(WorkerLease, "current") as current:
+                call_command("generate_workload", stdout=StringIO(), **self.options)
+        current.assert_not_called()
+        self.assertConsistent()
+
+    def test_failure_too_many_likes(self):
+        with self.assertRaises(CommandError):
+            call_command("generate_workload", **{**self.options, "likes": 40 * 60 + 1})
+        self.assertFalse(User.objects.exists())
+
+
+class TestSnowflake(TransactionTestCase):
+    # leases are written on a connection of their own, which cannot write
+    # while a TestCase transaction holds the in-memory database
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="test@test.test", password="testpassword"
+        )
+
+    def test_success_ids_increase(self):
+        # the clock stalls, then steps back
+        ticks = iter([EPOCH_MS + 5] * (MAX_SEQUENCE + 2) + [EPOCH_MS + 6, EPOCH_MS + 1])
+        generate = SnowflakeGenerator(7, clock=lambda: next(ticks))
+        ids = [generate() for _ in range(MAX_SEQUENCE + 3)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual(snowflake_time_ms(ids[0]), EPOCH_MS + 5)
+        self.assertEqual(snowflake_time_ms(ids[-1]), EPOCH_MS + 6)
+        self.assertEqual(ids[0] >> SEQUENCE_BITS & MAX_WORKER, 7)
+
+    def lease(self, seconds=60, clock=time.time):
+        lease = WorkerLease(seconds, clock=clock)
+        self.addCleanup(lease.release)
+        return lease
+
+    def test_success_models_use_snowflakes(self):
+        with self.settings(SNOWFLAKE_IDS=True):
+            tweet = Tweet(user=self.user, content="tweet")
+            self.assertEqual(
+                tweet.pk >> SEQUENCE_BITS & MAX_WORKER,
+                snowflake._generator.lease.worker_id,
+            )
+            tweet.save()
+            self.assertTrue(like_tweet(self.user, tweet.pk))
+        like = Like.objects.get()
+        self.assertGreater(like.pk, tweet.pk)
+        now = timezone.now().timestamp() * 1000
+        self.assertAlmostEqual(snowflake_time_ms(tweet.pk), now, delta=5000)
+        with self.settings(SNOWFLAKE_IDS=False):
+            self.assertIsNone(Tweet(user=self.user, content="tweet").pk)
+
+    def test_success_ids_above_2_53_stay_exact(self):
+        # JavaScript numbers round such ids, so they travel as strings
+        tweet = Tweet.objects.create(pk=2**53 + 1, user=self.user, content="tweet")
+        add_to_own_timeline(tweet)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("tweets:home"))
+        self.assertContains(response, f'let latestId = "{tweet.pk}";')
+        response = self.client.post(
+            reverse("tweets:like_batch"),
+            {"operations": [{"tweet_id": str(tweet.pk), "action": "like"}]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.json()["results"][0]["tweet_id"], str(tweet.pk))
+        response = self.client.post(reverse("tweets:unlike", kwargs={"pk": tweet.pk}))
+        self.assertEqual(int(response.json()["tweet_id"]), tweet.pk)
+        response = self.client.get(reverse("tweets:home_since"), {"since_id": tweet.pk})
+        self.assertEqual(response.json()["latest_id"], str(tweet.pk))
+
+    def test_success_leases_differ(self):
+        ids = {self.lease().current() for _ in range(3)}
+        self.assertEqual(len(ids), 3)
+
+    def test_success_forked_process_leases_own_id(self):
+        with self.settings(SNOWFLAKE_IDS=True):
+            parent = next_id() >> SEQUENCE_BITS & MAX_WORKER
+            with mock.patch("os.getpid", return_value=os.getpid() + 1):
+                child = next_id() >> SEQUENCE_BITS & MAX_WORKER
+                self.addCleanup(snowflake._generator.lease.release)
+        self.assertNotEqual(parent, child)
+
+    def test_success_lease_renewed_or_replaced(self):
+        now = time.time()
+        lease = self.lease(clock=lambda: now)
+        worker_id = lease.current()
+        now += 31
+        self.assertEqual(lease.current(), worker_id)
+        with lease.cursor() as (cursor, sql):
+            # another process took the id while this one was paused
+            cursor.execute(
+                f"UPDATE {sql['table']} SET {sql['holder']} = 'other' "
+                f"WHERE {sql['worker_id']} = %s",
+                [worker_id],
+            )
+        self.assertEqual(lease.current(), worker_id)
+        now += 31
+        self.assertNotEqual(lease.current(), worker_id)
+
+    def test_success_release(self):
+        lease = self.lease()
+        worker_id = lease.current()
+        lease.release()
+        with lease.cursor() as (cursor, sql):
+            cursor.execute(
+                f"SELECT {sql['worker_id']} FROM {sql['table']} "
+                f"WHERE {sql['expires_at']} > %s",
+                [sql["adapt"](timezone.now())],
+            )
+            self.assertNotIn((worker_id,), cursor.fetchall())
+
+    def test_failure_worker_id_out_of_range(self):
+        with self.assertRaises(ImproperlyConfigured):
+            SnowflakeGenerator(MAX_WORKER + 1)
+
+
+class TestSharding(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="test@test.test", password="testpassword"
+        )
+
+    def test_success_jump_hash(self):
+        placed = [jump_hash(key, 4) for key in range(10000)]
+        self.assertEqual(placed, [jump_hash(key, 4) for key in range(10000)])
+        for bucket in range(4):
+            self.assertAlmostEqual(placed.count(bucket) / 10000, 0.25, delta=0.03)
+        # a fifth bucket only takes keys, and about a fifth of them
+        moved = [key for key in range(10000) if jump_hash(key, 5) != placed[key]]
+        self.assertTrue(all(jump_hash(key, 5) == 4 for key in moved))
+        self.assertAlmostEqual(len(moved) / 10000, 0.2, delta=0.03)
+
+    def test_success_route_by_user(self):
+        router = ShardRouter()
+        tweet = Tweet(user=self.user, content="tweet")
+        with self.settings(TWEET_SHARDS=["shard0", "shard1"]):
+            shard = shard_for_user(self.user.pk)
+            self.assertIn(shard, ["shard0", "shard1"])
+            self.assertEqual(router.db_for_write(Tweet, instance=tweet), shard)
+            self.assertEqual(router.db_for_read(Like, instance=self.user), shard)
+            self.assertIsNone(router.db_for_read(Tweet))
+            self.assertIsNone(router.db_for_read(TimelineEntry, instance=tweet))
+            self.assertTrue(router.allow_migrate(shard, "tweets", "tweet"))
+            self.assertFalse(router.allow_migrate(shard, "tweets", "timelineentry"))
+            self.assertIsNone(router.allow_migrate("default", "tweets", "tweet"))
+        self.assertIsNone(shard_for_user(self.user.pk))
+        self.assertIsNone(router.db_for_write(Tweet, instance=tweet))
+
+    def test_success_merge_newest_first(self):
+        tweets = [
+            Tweet.objects.create(user=self.user, content=f"tweet{i}") for i in range(5)
+        ]
+        shards = [tweets[3::-2], tweets[4::-2]]
+        self.assertEqual(
+            list(merge_newest_first(shards, key=lambda tweet: tweet.pk)),
+            tweets[::-1],
+        )
+        paginator = ShardedKeysetPaginator(Tweet.objects.all(), 2)
+        page = paginator.get_page()
+        self.assertEqual(page.object_list, tweets[:2:-1])
+        page = paginator.get_page(older=page.older_cursor)
+        self.assertEqual(page.object_list, tweets[2:0:-1])
+
+    def test_failure_rebalance_without_shards(self):
+        with self.assertRaises(CommandError):
+            call_command("rebalance_shards", stdout=StringIO())
+
+
+class ShardedTestCase(TestCase):
+    """Runs with TWEET_SHARDS set to one in-memory shard that, like a real
+    one, has only the Tweet and Like tables and their search index."""
+
+    shard = "shard_test"
+
+    def setUp(self):
+        connections.settings[self.shard] = {
+            **connections["default"].settings_dict,
+            "NAME": f"file:{self.shard}?mode=memory&cache=shared",
+            "OPTIONS": {},
+        }
+        connection = connections[self.shard]
+        self.addCleanup(self.drop_shard)
+        with connection.schema_editor() as editor:
+            editor.create_model(Tweet)
+            editor.create_model(Like)
+        with connection.cursor() as cursor:
+            # the shard has no users table for the foreign keys to point at
+            cursor.execute("PRAGMA foreign_keys = OFF")
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(body, tokenize='unicode61')"
+            )
+        sharded = self.settings(TWEET_SHARDS=[self.shard])
+        sharded.enable()
+        self.addCleanup(sharded.disable)
+        self.user = User.objects.create_user(
+            username="testuser", email="test@test.test", password="testpassword"
+        )
+        self.client.force_login(self.user)
+
+    def _should_check_constraints(self, connection):
+        # rows on default point at tweets on the shard, as in production,
+        # where foreign keys are off once there are shards
+        return False
+
+    def drop_shard(self):
+        # closing the last connection frees the in-memory database
+        connections[self.shard].connection.close()
+        del connections[self.shard]
+        del connections.settings[self.shard]
+
+
+class TestShardedWrites(ShardedTestCase):
+    def test_success_delete_tweet(self):
+        # saved through the instance, as the create view does, to be routed
+        tweet = Tweet(user=self.user, content="tweet #tag")
+        tweet.save()
+        save_entities([tweet])
+        add_to_own_timeline(tweet)
+        like_tweet(self.user, tweet.pk)
+        response = self.client.post(reverse("tweets:delete", kwargs={"pk": tweet.pk}))
+        self.assertRedirects(response, reverse("tweets:home"))
+        self.assertFalse(Tweet.objects.using(self.shard).exists())
+        self.assertFalse(Like.objects.using(self.shard).exists())
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertFalse(TweetHashtag.objects.exists())
+
+    def test_success_like_batch(self):
+        tweet = Tweet(user=self.user, content="tweet")
+        tweet.save()
+        response = self.client.post(
+            reverse("tweets:like_batch"),
+            {"operations": [{"tweet_id": tweet.pk, "action": "like"}]},
+            content_type="application/json",
+        )
+        self.assertEqual(
+            response.json()["results"],
+            [{"tweet_id": str(tweet.pk), "liked": True, "count": 1}],
+        )
+        self.assertTrue(
+            Like.objects.using(self.shard).filter(tweet_id=tweet.pk).exists()
+        )
+
+    def test_success_profile_page(self):
+        tweet = Tweet(user=self.user, content="tweet")
+        tweet.save()
+        response = self.client.get(
+            reverse("accounts:user_profile", kwargs={"slug_username": "testuser"})
+        )
+        self.assertEqual(response.context["tweets"], [tweet])
+        self.assertEqual(response.context["tweets"][0].user, self.user)
+
+    def test_success_fan_out_job(self):
+        follower = User.objects.create_user(
+            username="follower", email="follower@test.test", password="testpassword"
+        )
+        FriendShip.objects.create(follow=follower, followed=self.user)
+        tweet = Tweet(user=self.user, content="tweet")
+        tweet.save()
+        tasks.fan_out_tweet(tweet.pk)
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=follower, tweet_id=tweet.pk).exists()
+        )
+
+    def test_success_recount_and_backfill(self):
+        tweet = Tweet(user=self.user, content="tweet #tag", like_count=5)
+        tweet.save()
+        Like(user=self.user, tweet=tweet).save()
+        call_command("rebuild_like_counts", stdout=StringIO())
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.like_count, 1)
+        call_command("backfill_entities", stdout=StringIO())
+        self.assertTrue(TweetHashtag.objects.filter(tweet_id=tweet.pk).exists())
+
+    def test_success_rebalance(self):
+        # created without an instance hint, so on default
+        tweet = Tweet.objects.create(user=self.user, content="tweet")
+        call_command("rebalance_shards", stdout=StringIO())
+        self.assertFalse(Tweet.objects.using("default").exists())
+        self.assertEqual(Tweet.objects.using(self.shard).get().pk, tweet.pk)
+        page = get_search_backend().search("tweet", 10)
+        self.assertEqual(page.object_list, [tweet.pk])
+
+
+class TestShardedReads(ShardedTestCase):
+    def setUp(self):
+        super().setUp()
+        get_search_backend.cache_clear()
+        self.addCleanup(get_search_backend.cache_clear)
+        self.tweet = Tweet(user=self.user, content="東京タワー #東京")
+        self.tweet.save()
+
+    def test_success_search(self):
+        for backend in ["tweets.search.Fts5Backend", "tweets.search.NgramTableBackend"]:
+            with self.subTest(backend=backend):
+                with self.settings(TWEETS_SEARCH_BACKEND=backend):
+                    get_search_backend.cache_clear()
+                    get_search_backend().index([self.tweet])
+                    response = self.client.get(reverse("tweets:search"), {"q": "タワー"})
+                self.assertEqual(response.context["tweets"], [self.tweet])
+
+    def test_success_api(self):
+        response = self.client.get(
+            reverse("tweets:api_user_tweets", kwargs={"username": "testuser"})
+        )
+        self.assertEqual(
+            [tweet["id"] for tweet in response.json()["tweets"]], [str(self.tweet.pk)]
+        )
+        response = self.client.get(
+            reverse("tweets:api_detail", kwargs={"pk": self.tweet.pk})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["user"], "testuser")
+
+    def test_success_hashtag_and_trends(self):
+        save_entities([self.tweet])
+        like_tweet(self.user, self.tweet.pk)
+        response = self.client.get(reverse("tweets:hashtag", args=["東京"]))
+        self.assertEqual(response.context["tweets"], [self.tweet])
+        response = self.client.get(reverse("tweets:trends"), {"window": "24h"})
+        self.assertEqual(response.context["tweets"], [self.tweet])
+
+
+class TestEventStream(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(
+            username="testuser1", email="test@test.test", password="testpassword"
+        )
+        self.user2 = User.objects.create_user(
+            username="testuser2", email="test@test.test", password="testpassword"
+        )
+        FriendShip.objects.create(follow=self.user1, followed=self.user2)
+        self.tweet = Tweet.objects.create(user=self.user2, content="tweet")
+
+    def stream(self, query, publish):
+        """Run the stream with ``query``, call ``publish`` once it is
+        subscribed and return what it sent until the client disconnected."""
+        self.client.login(username="testuser1", password="testpassword")
+        cookie = self.client.cookies["sessionid"].OutputString(attrs=[])
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": reverse("tweets:events"),
+            "query_string": query.encode(),
+            "headers": [(b"cookie", cookie.encode())],
+        }
+        sent = []
+
+        async def scenario():
+            disconnect = asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                sent.append(message)
+                if b"data:" in message.get("body", b""):
+                    disconnect.set()
+
+            stream = asyncio.ensure_future(event_stream(scope, receive, send))
+            while len(sent) < 2:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.01)
+            await publish()
+            await asyncio.wait_for(stream, 5)
+
+        async_to_sync(scenario)()
+        return sent
+
+    def test_success_stream_like_count(self):
+        async def publish():
+            get_broker().publish(
+                f"tweet:{self.tweet.pk}",
+                {"type": "like", "id": str(self.tweet.pk), "count": 3},
+            )
+
+        sent = self.stream(f"tweets={self.tweet.pk}", publish)
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertEqual(
+            sent[-1]["body"],
+            f'event: like\ndata: {{"type": "like", "id": "{self.tweet.pk}", "count": 3}}\n\n'.encode(),
+        )
+
+    def test_success_stream_new_tweet(self):
+        def post():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse("tweets:create"), {"content": "new"})
+
+        async def publish():
+            await sync_to_async(post)()
+
+        sent = self.stream(f"user={self.user1.pk}", publish)
+        tweet = Tweet.objects.get(content="new")
+        self.assertEqual(
+            sent[-1]["body"],
+            f'event: tweet\ndata: {{"type": "tweet", "id": "{tweet.pk}"}}\n\n'.encode(),
+        )
+
+    def test_failure_stream_without_login(self):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": reverse("tweets:events"),
+            "query_string": b"",
+            "headers": [],
+        }
+        async_to_sync(event_stream)(scope, None, send)
+        self.assertEqual(sent[0]["status"], 403)
+
+    def test_success_get_under_wsgi(self):
+        self.client.login(username="testuser1", password="testpassword")
+        response = self.client.get(reverse("tweets:events"))
+        self.assertEqual(response.status_code, 204)
+
+
+class TestSearch(TestCase):
+    backend = "tweets.search.Fts5Backend"
+
+    def setUp(self):
+        get_search_backend.cache_clear()
+        self.addCleanup(get_search_backend.cache_clear)
+        self.settings_override = override_settings(TWEETS_SEARCH_BACKEND=self.backend)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.user = User.objects.create_user(
+            username="testuser", email="test@test.test", password="testpassword"
+        )
+        self.client.login(username="testuser", password="testpassword")
+        now = timezone.now()
+        self.tweets = [
+            Tweet.objects.create(
+                user=self.user, content=content, created_at=now + timedelta(days=i)
+            )
+            for i, content in enumerate(
+                ["東京タワーに行った", "京都に行きたい", "Hello World!", "ＨＥＬＬＯ again"]
+            )
+        ]
+
+    def search(self, query, **params):
+        response = self.client.get(reverse("tweets:search"), {"q": query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.context["page"]
+
+    def test_success_index_terms(self):
+        self.assertEqual(index_terms("東京 Hi!"), ["東京", "京", "hi", "i"])
+
+    def test_success_search_japanese(self):
+        self.assertEqual(list(self.search("東京").object_list), [self.tweets[0]])
+        self.assertEqual(list(self.search("タワー").object_list), [self.tweets[0]])
+        self.assertEqual(
+            list(self.search("京").object_list), [self.tweets[1], self.tweets[0]]
+        )
+        self.assertEqual(list(self.search("京阪").object_list), [])
+
+    def test_success_search_latin(self):
+        self.assertEqual(
+            list(self.search("hello").object_list), [self.tweets[3], self.tweets[2]]
+        )
+        self.assertEqual(list(self.search("world HELLO").object_list), [self.tweets[2]])
+
+    def test_success_search_paginated(self):
+        self.assertEqual(len(self.search("に行").object_list), 2)
+        with self.settings(TWEETS_PAGE_SIZE=1):
+            first = self.search("に行")
+            self.assertTrue(first.has_older)
+            second = self.search("に行", older=first.older_cursor)
+            self.assertFalse(second.has_older)
+        self.assertEqual(
+            first.object_list + second.object_list, [self.tweets[1], self.tweets[0]]
+        )
+
+    def test_success_rank_by_relevance_and_recency(self):
+        start = self.tweets[-1].created_at + timedelta(days=1)
+        only = Tweet.objects.create(user=self.user, content="大阪", created_at=start)
+        # an hour newer, but mostly about something else
+        longer = Tweet.objects.create(
+            user=self.user,
+            content="今日は大阪で会議がありました",
+            created_at=start + timedelta(hours=1),
+        )
+        # relevant too, but two days older
+        old = Tweet.objects.create(
+            user=self.user, content="大阪", created_at=start - timedelta(days=2)
+        )
+        self.assertEqual(list(self.search("大阪").object_list), [only, longer, old])
+        tweets, older = [], None
+        with self.settings(TWEETS_PAGE_SIZE=1):
+            for _ in range(3):
+                page = self.search("大阪", **({"older": older} if older else {}))
+                tweets += page.object_list
+                older = page.older_cursor
+        self.assertEqual(tweets, [only, longer, old])
+
+    def test_success_cursor_survives_new_tweets(self):
+        # enough other tweets for index statistics such as bm25 to matter
+        for i in range(20):
+            Tweet.objects.create(user=self.user, content=f"関係ない話{i}")
+        with self.settings(TWEETS_PAGE_SIZE=1):
+            first = self.search("に行")
+            for i in range(5):
+                Tweet.objects.create(
+                    user=self.user,
+                    content=f"京都に行った{i}回目",
+                    created_at=self.tweets[-1].created_at + timedelta(hours=i + 1),
+                )
+            second = self.search("に行", older=first.older_cursor)
+        self.assertEqual(first.object_list, [self.tweets[1]])
+        self.assertEqual(second.object_list, [self.tweets[0]])
+
+    def test_success_remove_deleted_tweet(self):
+        self.tweets[0].delete()
+        self.assertEqual(list(self.search("東京").object_list), [])
+
+    def test_success_reindex_edited_tweet(self):
+        self.tweets[0].content = "大阪城"
+        self.tweets[0].save()
+        self.assertEqual(list(self.search("東京").object_list), [])
+        self.assertEqual(list(self.search("大阪").object_list), [self.tweets[0]])
+
+    def test_success_rebuild_search_index_command(self):
+        get_search_backend().remove([tweet.pk for tweet in self.tweets])
+        self.assertEqual(list(self.search("東京").object_list), [])
+        out = StringIO()
+        call_command("rebuild_search_index", batch_size=3, stdout=out)
+        self.assertIn("4件", out.getvalue())
+        self.assertEqual(list(self.search("東京").object_list), [self.tweets[0]])
+
+    def test_failure_search_with_invalid_cursor(self):
+        response = self.client.get(reverse("tweets:search"), {"q": "東京", "older": "!!"})
+        self.assertEqual(response.status_code, 404)
+
+
+class TestNgramTableSearch(TestSearch):
+    backend = "tweets.search.NgramTableBackend"
+
+
+class TestEntities(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="test@test.test", password="testpassword"
+        )
+        self.alice = User.objects.create_user(
+            username="alice", email="test@test.test", password="testpassword"
+        )
+        self.client.login(username="testuser", password="testpassword")
+
+    def post_tweet(self, content):
+        self.client.post(reverse("tweets:create"), {"content": content})
+        return Tweet.objects.get(content=content)
+
+    def test_success_extract(self):
+        content = "今日は＃東京 #Django と#python, a@b.com @alice. @bobさん &#123;"
+        self.assertEqual(extract_hashtags(content), ["東京", "django", "python"])
+        self.assertEqual(extract_mentions(content), [["alice"], ["bobさん", "bob"]])
+
+    def test_success_save_on_create(self):
+        tweet = self.post_tweet("#Django と #django と @aliceさん @nobody")
+        self.assertEqual(
+            list(TweetHashtag.objects.values_list("hashtag__name", "tweet")),
+            [("django", tweet.pk)],
+        )
+        self.assertEqual(
+            list(Mention.objects.values_list("user", "tweet")),
+            [(self.alice.pk, tweet.pk)],
+        )
+
+    def test_success_get_hashtag(self):
+        tweets = [self.post_tweet(f"#東京 tweet{i}") for i in range(3)]
+        self.post_tweet("no tags")
+        with self.settings(TWEETS_PAGE_SIZE=2):
+            response = self.client.get(reverse("tweets:hashtag", kwargs={"name": "東京"}))
+            self.assertEqual(list(response.context["tweets"]), tweets[:0:-1])
+            response = self.client.get(
+                reverse("tweets:hashtag", kwargs={"name": "東京"}),
+                {"older": response.context["page"].older_cursor},
+            )
+        self.assertEqual(list(response.context["tweets"]), tweets[:1])
+        self.assertContains(
+            response, '<a href="%s">#東京</a>' % reverse("tweets:hashtag", args=["東京"])
+        )
+
+    def test_success_get_mentions(self):
+        tweet = self.post_tweet("@testuser hi")
+        self.post_tweet("@alice hi")
+        response = self.client.get(reverse("tweets:mentions"))
+        self.assertEqual(list(response.context["tweets"]), [tweet])
+
+    def test_success_get_not_exist_hashtag(self):
+        response = self.client.get(reverse("tweets:hashtag", kwargs={"name": "none"}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["tweets"]), [])
+
+    def test_success_backfill_entities_command(self):
+        tweets = [
+            Tweet.objects.create(user=self.user, content=f"#tag{i % 2} @alice")
+            for i in range(5)
+        ]
+        out = StringIO()
+        call_command("backfill_entities", batch_size=2, stdout=out)
+        call_command("backfill_entities", batch_size=2, stdout=out)
+        self.assertIn("5件", out.getvalue())
+        self.assertEqual(Hashtag.objects.count(), 2)
+        self.assertEqual(TweetHashtag.objects.count(), 5)
+        self.assertEqual(
+            set(Mention.objects.values_list("tweet", flat=True)),
+            {tweet.pk for tweet in tweets},
+        )
+
+
+class TestTrends(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="test@test.test", password="testpassword"
+        )
+        self.client.login(username="testuser", password="testpassword")
+        trends.delete(*settings.TRENDS_WINDOWS)
+
+    def post_tweet(self, content):
+        self.client.post(reverse("tweets:create"), {"content": content})
+        return Tweet.objects.get(content=content)
+
+    def test_success_count_posts_and_likes(self):
+        tweet1 = self.post_tweet("#a one")
+        tweet2 = self.post_tweet("#a #b two")
+        self.post_tweet("#b three")
+        like_tweet(self.user, tweet2.pk)
+        like_tweet(self.user, tweet1.pk)
+        unlike_tweet(self.user, tweet1.pk)
+        with self.settings(TRENDS_POST_WEIGHT=2):
+            self.assertEqual(
+                compute_trends(60),
+                {"hashtags": [("a", 5), ("b", 5)], "tweets": [(tweet2.pk, 1)]},
+            )
+
+    def test_success_count_batch_likes(self):
+        tweet = self.post_tweet("#a one")
+        self.client.post(
+            reverse("tweets:like_batch"),
+            json.dumps({"operations": [{"tweet_id": tweet.pk, "action": "like"}]}),
+            content_type="application/json",
+        )
+        self.assertEqual(compute_trends(60)["tweets"], [(tweet.pk, 1)])
+
+    def test_success_expire_buckets(self):
+        self.post_tweet("#a one")
+        later = timezone.now() + timedelta(
+            minutes=max(settings.TRENDS_WINDOWS.values())
+        )
+        refresh_trends()
+        self.assertEqual(trends.get("1h")["hashtags"], [("a", 2)])
+        with self.settings(TRENDS_BUCKET_SECONDS=1):
+            with mock.patch("django.utils.timezone.now", return_value=later):
+                refresh_trends()
+        self.assertEqual(TrendBucket.objects.count(), 0)
+        self.assertEqual(trends.get("1h")["hashtags"], [])
+
+    def test_success_get_trends(self):
+        tweet = self.post_tweet("#東京 one")
+        like_tweet(self.user, tweet.pk)
+        response = self.client.get(reverse("tweets:trends"), {"window": "24h"})
+        self.assertEqual(response.context["window"], "24h")
+        self.assertEqual(response.context["hashtags"], [("東京", 3)])
+        self.assertEqual(response.context["tweets"], [tweet])
+        self.assertContains(response, reverse("tweets:hashtag", args=["東京"]))
+
+    def test_success_refresh_trends_command(self):
+        self.post_tweet("#a one")
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("refresh_trends", schedule=True, stdout=out)
+        self.assertIn("トレンドを更新しました", out.getvalue())
+        self.assertEqual(trends.get("24h")["hashtags"], [("a", 2)])
+        self.assertTrue(Job.objects.filter(name="tweets.refresh_trends").exists())
+
+    def test_failure_get_unknown_window(self):
+        response = self.client.get(reverse("tweets:trends"), {"window": "1y"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["window"], "1h")
+
+
+class TestTimelineCache(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(
+            username="testuser1", email="test@test.test", password="testpassword"
+        )
+        self.user2 = User.objects.create_user(
+            username="testuser2", email="test@test.test", password="testpassword"
+        )
+        FriendShip.objects.create(follow=self.user1, followed=self.user2)
+        self.client.login(username="testuser1", password="testpassword")
+        metrics.reset()
+
+    def get_home(self):
+        return list(self.client.get(reverse("tweets:home")).context["tweets"])
+
+    def test_success_cache_first_page(self):
+        self.assertEqual(self.get_home(), [])
+        self.assertEqual(timeline_pages.get(self.user1.pk)["ids"], [])
+        with self.assertNumQueries(0):
+            home_timeline_page(self.user1, settings.TWEETS_PAGE_SIZE)
+        self.assertEqual(metrics.stats()["timeline_page"], {"hits": 2, "misses": 1})
+
+    def test_success_invalidate_on_fan_out(self):
+        self.assertEqual(self.get_home(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            tweet = Tweet.objects.create(user=self.user2, content="tweet")
+            fan_out_tweet(tweet)
+        self.assertEqual(self.get_home(), [tweet])
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=0)
+    def test_success_invalidate_on_fan_out_on_read(self):
+        self.assertEqual(self.get_home(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            tweet = Tweet.objects.create(user=self.user2, content="tweet")
+            fan_out_tweet(tweet)
+        self.assertFalse(TimelineEntry.objects.filter(tweet=tweet).exists())
+        self.assertEqual(self.get_home(), [tweet])
+
+    def test_success_invalidate_on_unfollow(self):
+        tweet = Tweet.objects.create(user=self.user2, content="tweet")
+        fan_out_tweet(tweet)
+        self.assertEqual(self.get_home(), [tweet])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("accounts:unfollow", kwargs={"username": "testuser2"})
+            )
+        self.assertEqual(self.get_home(), [])
+
+    def test_success_drop_deleted_tweet(self):
+        tweet = Tweet.objects.create(user=self.user2, content="tweet")
+        fan_out_tweet(tweet)
+        self.assertEqual(self.get_home(), [tweet])
+        tweet.delete()
+        self.assertEqual(self.get_home(), [])
+
+    def test_success_cache_stats_command(self):
+        self.get_home()
+        out = StringIO()
+        call_command("cache_stats", stdout=out)
+        self.assertIn("timeline_page: hits=0 misses=1", out.getvalue())
+
+
+class TestTweetCardCache(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="test@test.test", password="testpassword"
+        )
+        self.client.login(username="testuser", password="testpassword")
+        self.tweet = Tweet.objects.create(user=self.user, content="tweet")
+        add_to_own_timeline(self.tweet)
+        metrics.reset()
+
+    def test_success_reuse_cards(self):
+        self.client.get(reverse("tweets:home"))
+        self.assertIsNotNone(tweet_cards.get(card_ident(self.tweet.pk, 0, False)))
+        response = self.client.get(
+            reverse("accounts:user_profile", kwargs={"slug_username": "testuser"})
+        )
+        self.assertContains(response, "0件のイイね")
+        self.assertEqual(metrics.stats()["tweet_card"], {"hits": 2, "misses": 1})
+
+    def test_success_new_card_on_like(self):
+        self.client.get(reverse("tweets:home"))
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        response = self.client.get(reverse("tweets:home"))
+        self.assertContains(response, "1件のイイね")
+        self.assertContains(
+            response, reverse("tweets:unlike", kwargs={"pk": self.tweet.pk})
+        )
+
+    def test_success_invalidate_on_edit(self):
+        self.client.get(reverse("tweets:home"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tweet.content = "edited"
+            self.tweet.save()
+        self.assertIsNone(tweet_cards.get(card_ident(self.tweet.pk, 0, False)))
+        self.assertContains(self.client.get(reverse("tweets:home")), "edited")
+
+
+class TestTweetApi(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="test@test.test", password="testpassword"
+        )
+        self.client.login(username="testuser", password="testpassword")
+        self.tweet = Tweet.objects.create(user=self.user, content="tweet")
+        add_to_own_timeline(self.tweet)
+        self.urls = [
+            reverse("tweets:api_home"),
+            reverse("tweets:api_user_tweets", kwargs={"username": "testuser"}),
+            reverse("tweets:api_detail", kwargs={"pk": self.tweet.pk}),
+        ]
+
+    def test_success_get(self):
+        response = self.client.get(self.urls[0])
+        self.assertEqual(response.status_code, 200)
+        tweets = response.json()["tweets"]
+        self.assertEqual([tweet["id"] for tweet in tweets], [str(self.tweet.pk)])
+        self.assertEqual(tweets[0]["user"], "testuser")
+        self.assertEqual(response.json(), self.client.get(self.urls[1]).json())
+        self.assertEqual(self.client.get(self.urls[2]).json(), tweets[0])
+
+    def test_success_not_modified(self):
+        for url in self.urls:
+            etag = self.client.get(url).headers["ETag"]
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers["ETag"], etag)
+
+    def test_success_modified_by_like(self):
+        etags = [self.client.get(url).headers["ETag"] for url in self.urls]
+        with self.captureOnCommitCallbacks(execute=True):
+            like_tweet(self.user, self.tweet.pk)
+        for url, etag in zip(self.urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_success_modified_by_new_tweet(self):
+        etag = self.client.get(self.urls[0]).headers["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            add_to_own_timeline(Tweet.objects.create(user=self.user, content="new"))
+        response = self.client.get(self.urls[0], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["tweets"]), 2)
+
+    def test_success_not_modified_without_reading_tweets(self):
+        etag = self.client.get(self.urls[0]).headers["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.urls[0], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any('"content"' in query["sql"] for query in queries))
+
+    def test_success_modified_by_delete(self):
+        etag = self.client.get(self.urls[0]).headers["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            Tweet.objects.filter(pk=self.tweet.pk).get().delete()
+        # the cached first page still lists the tweet
+        response = self.client.get(self.urls[0], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["tweets"], [])
+
+    def test_success_etag_per_url(self):
+        # the same tweets at another URL are another representation
+        etag = self.client.get(self.urls[1]).headers["ETag"]
+        response = self.client.get(self.urls[1], {"v": "2"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_failure_get_with_not_exist_tweet(self):
+        response = self.client.get(reverse("tweets:api_detail", kwargs={"pk": 0}))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestAsyncViews(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="test@test.test", password="testpassword"
+        )
+        self.tweet = Tweet.objects.create(user=self.user, content="tweet")
+        add_to_own_timeline(self.tweet)
+        self.factory = AsyncRequestFactory()
+
+    def call(self, view, method, user=None, **kwargs):
+        request = getattr(self.factory, method)("/")
+        request.user = user or self.user
+        return async_to_sync(view)(request, **kwargs)
+
+    def test_success_get_home(self):
+        response = self.call(async_views.home_view, "get")
+        self.assertContains(response, "tweet")
+        self.assertContains(response, "0件のイイね")
+
+    def test_success_get_detail(self):
+        response = self.call(async_views.tweet_detail_view, "get", pk=self.tweet.pk)
+        self.assertContains(response, "ツイート削除はこちら")
+
+    def test_success_like_and_unlike(self):
+        response = self.call(async_views.like_view, "post", pk=self.tweet.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["count"], 1)
+        response = self.call(async_views.unlike_view, "post", pk=self.tweet.pk)
+        self.assertEqual(json.loads(response.content)["count"], 0)
+        self.assertFalse(Like.objects.exists())
+
+    def test_failure_like_not_exist_tweet(self):
+        with self.assertRaises(Http404):
+            self.call(async_views.like_view, "post", pk=0)
+
+    def test_failure_without_login(self):
+        response = self.call(async_views.home_view, "get", user=AnonymousUser())
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith(reverse(settings.LOGIN_URL)))
+
+    def test_failure_get_like(self):
+        response = self.call(async_views.like_view, "get", pk=self.tweet.pk)
+        self.assertEqual(response.status_code, 405)
+
+
 class TestTweetCreateView(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -60,6 +1414,13 @@ class TestTweetDetailView(TestCase):
         response = self.client.get(reverse("tweets:detail", kwargs={"pk": tweet.pk}))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(tweet, response.context["tweet"])
+        self.assertFalse(response.context["viewer"].has_liked(tweet))
+
+    def test_success_get_liked_tweet(self):
+        tweet = Tweet.objects.get(content="tweet")
+        Like.objects.create(user=self.user, tweet=tweet)
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": tweet.pk}))
+        self.assertTrue(response.context["viewer"].has_liked(tweet))
 
 
 class TestTweetDeleteView(TestCase):
@@ -113,6 +1474,9 @@ class TestFavoriteView(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertTrue(Like.objects.filter(tweet=self.tweet).exists())
+        self.assertEqual(response.json()["count"], 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
 
     def test_failure_post_with_not_exist_tweet(self):
         response = self.client.post(reverse("tweets:like", kwargs={"pk": 2}))
@@ -126,6 +1490,8 @@ class TestFavoriteView(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertEqual(Like.objects.filter(tweet=self.tweet).count(), 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
 
 
 class TestUnfavoriteView(TestCase):
@@ -145,6 +1511,7 @@ class TestUnfavoriteView(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertFalse(Like.objects.filter(tweet=self.tweet).exists())
+        self.assertEqual(response.json()["count"], 0)
 
     def test_failure_post_with_not_exist_tweet(self):
         response = self.client.post(reverse("tweets:unlike", kwargs={"pk": 2}))
@@ -157,3 +1524,231 @@ class TestUnfavoriteView(TestCase):
             reverse("tweets:unlike", kwargs={"pk": self.tweet.pk})
         )
         self.assertEqual(response.status_code, 200)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 0)
+
+
+class TestLikeWritePath(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="test@test.test", password="testpassword"
+        )
+        self.tweet = Tweet.objects.create(user=self.user, content="tweet")
+
+    def test_success_like_once(self):
+        # savepoint, insert, counter, trend hashtags, trend upsert, release
+        with self.assertNumQueries(6):
+            self.assertTrue(like_tweet(self.user, self.tweet.pk))
+        with self.assertNumQueries(3):
+            self.assertFalse(like_tweet(self.user, self.tweet.pk))
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
+
+    def test_failure_like_with_taken_id(self):
+        other = Tweet.objects.create(user=self.user, content="other")
+        like = Like.objects.create(user=self.user, tweet=other)
+        with self.settings(SNOWFLAKE_IDS=True):
+            with mock.patch("tweets.likes.next_id", return_value=like.pk):
+                with self.assertRaises(IntegrityError):
+                    like_tweet(self.user, self.tweet.pk)
+
+    def test_success_unlike_once(self):
+        like_tweet(self.user, self.tweet.pk)
+        self.assertTrue(unlike_tweet(self.user, self.tweet.pk))
+        self.assertFalse(unlike_tweet(self.user, self.tweet.pk))
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 0)
+
+    def test_failure_like_not_exist_tweet(self):
+        self.assertFalse(like_tweet(self.user, 0))
+        self.assertFalse(Like.objects.exists())
+
+
+class TestConcurrentLikes(TransactionTestCase):
+    threads = 8
+
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(
+                username=f"testuser{i}", email="test@test.test", password="testpassword"
+            )
+            for i in range(self.threads)
+        ]
+        self.tweet = Tweet.objects.create(user=self.users[0], content="tweet")
+
+    def hammer(self, toggles, batch=False):
+        barrier = threading.Barrier(self.threads * 2)
+
+        def toggle(user, liked):
+            barrier.wait()
+            try:
+                for _ in range(toggles):
+                    while True:
+                        try:
+                            if batch:
+                                like_batch(user, {self.tweet.pk: liked})
+                            elif liked:
+                                like_tweet(user, self.tweet.pk)
+                            else:
+                                unlike_tweet(user, self.tweet.pk)
+                            break
+                        except OperationalError:
+                            # sqlite's shared test database reports contention
+                            # instead of waiting; the transaction rolled back.
+                            continue
+                    liked = not liked
+            finally:
+                connection.close()
+
+        # Two threads per user, out of phase, so every like races an unlike
+        # and every insert races a duplicate insert.
+        with ThreadPoolExecutor(self.threads * 2) as executor:
+            futures = [
+                executor.submit(toggle, user, liked)
+                for user in self.users
+                for liked in (True, False)
+            ]
+        for future in futures:
+            future.result()
+
+    def test_success_counts_stay_exact(self):
+        self.hammer(toggles=25)
+        self.tweet.refresh_from_db()
+        self.assertEqual(
+            self.tweet.like_count, Like.objects.filter(tweet=self.tweet).count()
+        )
+
+    def test_success_batch_counts_stay_exact(self):
+        self.hammer(toggles=25, batch=True)
+        self.tweet.refresh_from_db()
+        self.assertEqual(
+            self.tweet.like_count, Like.objects.filter(tweet=self.tweet).count()
+        )
+
+
+class TestLikeBatchView(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", email="test@test.test", password="testpassword"
+        )
+        self.client.login(username="testuser", password="testpassword")
+        self.tweet1 = Tweet.objects.create(user=self.user, content="tweet1")
+        self.tweet2 = Tweet.objects.create(user=self.user, content="tweet2")
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet2.pk}))
+
+    def post(self, operations):
+        return self.client.post(
+            reverse("tweets:like_batch"),
+            {"operations": operations},
+            content_type="application/json",
+        )
+
+    def test_success_post(self):
+        with self.assertNumQueries(13):
+            response = self.post(
+                [
+                    {"tweet_id": self.tweet1.pk, "action": "like"},
+                    {"tweet_id": self.tweet2.pk, "action": "unlike"},
+                ]
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["results"],
+            [
+                {"tweet_id": str(self.tweet1.pk), "liked": True, "count": 1},
+                {"tweet_id": str(self.tweet2.pk), "liked": False, "count": 0},
+            ],
+        )
+        self.assertEqual(
+            list(Like.objects.values_list("tweet_id", flat=True)), [self.tweet1.pk]
+        )
+
+    def test_success_post_likes_in_one_statement(self):
+        tweets = [
+            Tweet.objects.create(user=self.user, content=f"tweet{i}")
+            for i in range(3, 6)
+        ]
+        operations = [
+            {"tweet_id": tweet.pk, "action": "like"} for tweet in tweets + [self.tweet2]
+        ]
+        operations.append({"tweet_id": self.tweet1.pk, "action": "unlike"})
+        # one INSERT for the likes and one DELETE for the unlikes, however many
+        with self.assertNumQueries(12):
+            response = self.post(operations)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Like.objects.count(), 4)
+        self.assertEqual(
+            list(Tweet.objects.order_by("pk").values_list("like_count", flat=True)),
+            [0, 1, 1, 1, 1],
+        )
+
+    def test_success_post_with_repeated_operations(self):
+        response = self.post(
+            [
+                {"tweet_id": self.tweet1.pk, "action": "like"},
+                {"tweet_id": self.tweet1.pk, "action": "unlike"},
+                {"tweet_id": self.tweet2.pk, "action": "like"},
+            ]
+        )
+        self.assertEqual(
+            response.json()["results"],
+            [
+                {"tweet_id": str(self.tweet1.pk), "liked": False, "count": 0},
+                {"tweet_id": str(self.tweet2.pk), "liked": True, "count": 1},
+            ],
+        )
+        self.tweet2.refresh_from_db()
+        self.assertEqual(self.tweet2.like_count, 1)
+
+    def test_success_post_skips_not_exist_tweet(self):
+        response = self.post([{"tweet_id": 0, "action": "like"}])
+        self.assertEqual(response.json()["results"], [])
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_failure_post_with_invalid_operations(self):
+        response = self.post([{"tweet_id": self.tweet1.pk, "action": "retweet"}])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Like.objects.filter(tweet=self.tweet1).exists())
+
+    @override_settings(LIKE_BATCH_MAX_SIZE=1)
+    def test_failure_post_with_too_many_operations(self):
+        response = self.post(
+            [
+                {"tweet_id": self.tweet1.pk, "action": "like"},
+                {"tweet_id": self.tweet2.pk, "action": "unlike"},
+            ]
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class TestRebuildLikeCountsCommand(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(
+            username="testuser1", email="test@test.test", password="testpassword"
+        )
+        self.user2 = User.objects.create_user(
+            username="testuser2", email="test@test.test", password="testpassword"
+        )
+        self.tweet1 = Tweet.objects.create(user=self.user1, content="tweet1")
+        self.tweet2 = Tweet.objects.create(user=self.user1, content="tweet2")
+        Like.objects.create(user=self.user1, tweet=self.tweet1)
+        Like.objects.create(user=self.user2, tweet=self.tweet1)
+        Tweet.objects.filter(pk=self.tweet2.pk).update(like_count=5)
+
+    def test_success_rebuild(self):
+        call_command("rebuild_like_counts", batch_size=1, stdout=StringIO())
+        self.tweet1.refresh_from_db()
+        self.tweet2.refresh_from_db()
+        self.assertEqual(self.tweet1.like_count, 2)
+        self.assertEqual(self.tweet2.like_count, 0)
+
+    def test_success_rebuild_enqueue(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command(
+                "rebuild_like_counts", batch_size=1, enqueue=True, stdout=StringIO()
+            )
+        self.assertEqual(Job.objects.filter(name="tweets.recount_likes").count(), 2)
+        for job_id in claim_batch(10):
+            run_job(job_id)
+        self.tweet1.refresh_from_db()
+        self.assertEqual(self.tweet1.like_count, 2)
@@ -0,0 +1,187 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from accounts.models import FriendShip
+from mysite.cache import author_posts, timeline_pages
+from mysite.pagination import KeysetPage, KeysetPaginator, MergedKeysetPaginator
+from mysite.sharding import ShardedKeysetPaginator
+
+from .events import publish_new_tweet
+from .models import TimelineEntry, Tweet
+
+User = get_user_model()
+
+
+def fans_out_on_read(user_id):
+    # Accounts with more followers than the threshold are not copied into
+    # inboxes; their followers merge their tweets in at read time instead.
+    return User.objects.filter(
+        pk=user_id, followers_count__gt=settings.TIMELINE_FANOUT_THRESHOLD
+    ).exists()
+
+
+def fan_out_on_read_followees(user):
+    return list(
+        FriendShip.objects.filter(
+            follow=user,
+            followed__followers_count__gt=settings.TIMELINE_FANOUT_THRESHOLD,
+        ).values_list("followed_id", flat=True)
+    )
+
+
+def _insert(entries):
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+    timeline_pages.invalidate(*{entry.user_id for entry in entries})
+
+
+def _bulk_insert(tweet, user_ids):
+    batch_size = settings.TIMELINE_FANOUT_BATCH_SIZE
+    batch = []
+    for user_id in user_ids:
+        batch.append(
+            TimelineEntry(
+                user_id=user_id,
+                tweet=tweet,
+                author_id=tweet.user_id,
+                created_at=tweet.created_at,
+            )
+        )
+        if len(batch) >= batch_size:
+            _insert(batch)
+            publish_new_tweet(tweet, [entry.user_id for entry in batch])
+            batch = []
+    if batch:
+        _insert(batch)
+        publish_new_tweet(tweet, [entry.user_id for entry in batch])
+
+
+def add_to_own_timeline(tweet):
+    _bulk_insert(tweet, [tweet.user_id])
+
+
+def fan_out_tweet(tweet):
+    if fans_out_on_read(tweet.user_id):
+        # too many followers to invalidate one by one: their cached pages
+        # hold the author's token and are dropped when it changes
+        author_posts.invalidate(tweet.user_id)
+        return
+    follower_ids = (
+        FriendShip.objects.filter(followed_id=tweet.user_id)
+        .values_list("follow_id", flat=True)
+        .iterator(chunk_size=settings.TIMELINE_FANOUT_BATCH_SIZE)
+    )
+    _bulk_insert(tweet, follower_ids)
+
+
+def backfill_timeline(user, followed):
+    if followed.pk != user.pk and fans_out_on_read(followed.pk):
+        return
+    tweets = Tweet.objects.for_user(followed.pk).order_by("-created_at", "-id")[
+        : settings.TIMELINE_BACKFILL_SIZE
+    ]
+    _insert(
+        [
+            TimelineEntry(
+                user=user,
+                tweet=tweet,
+                author_id=tweet.user_id,
+                created_at=tweet.created_at,
+            )
+            for tweet in tweets
+        ]
+    )
+
+
+def remove_from_timeline(user, followed):
+    TimelineEntry.objects.filter(user=user, author=followed).delete()
+    timeline_pages.invalidate(user.pk)
+
+
+def home_timeline(user, page_size, followee_ids=None):
+    """Paginate the ids of the tweets on the user's home timeline.
+    ``followee_ids`` are the fan-out-on-read accounts the user follows."""
+    entries = KeysetPaginator(
+        TimelineEntry.objects.filter(user=user).values("created_at", "tweet_id"),
+        page_size,
+        keys=("created_at", "tweet_id"),
+    )
+    sources = [(entries, lambda row: row["tweet_id"])]
+    if followee_ids is None:
+        followee_ids = fan_out_on_read_followees(user)
+    if followee_ids:
+        tweets = ShardedKeysetPaginator(
+            Tweet.objects.filter(user_id__in=followee_ids).values("created_at", "id"),
+            page_size,
+        )
+        sources.append((tweets, lambda row: row["id"]))
+    return MergedKeysetPaginator(sources, page_size)
+
+
+def home_timeline_ids(user, page_size, older=None, newer=None):
+    # Only the first page is cached: it is by far the most requested, and a
+    # single key per user keeps invalidation to one delete.
+    if older is not None or newer is not None:
+        return home_timeline(user, page_size).get_page(older=older, newer=newer)
+    cached = timeline_pages.get(user.pk)
+    if (
+        cached is not None
+        and cached["page_size"] == page_size
+        and not _authors_posted(cached["authors"])
+    ):
+        return KeysetPage(
+            cached["ids"],
+            has_older=cached["has_older"],
+            older_cursor=cached["older_cursor"],
+            newer_cursor=cached["newer_cursor"],
+        )
+    followee_ids = fan_out_on_read_followees(user)
+    # taken before the page is read, so a post in between shows next time
+    authors = author_posts.versions(followee_ids) if followee_ids else {}
+    page = home_timeline(user, page_size, followee_ids).get_page()
+    timeline_pages.set(
+        user.pk,
+        {
+            "page_size": page_size,
+            "ids": page.object_list,
+            "has_older": page.has_older,
+            "older_cursor": page.older_cursor,
+            "newer_cursor": page.newer_cursor,
+            "authors": authors,
+        },
+    )
+    return page
+
+
+def _authors_posted(authors):
+    return bool(authors) and author_posts.versions(list(authors)) != authors
+
+
+def home_timeline_since(user, tweet_id, limit):
+    """Return a page of the ids of up to ``limit`` tweets newer than
+    ``tweet_id``, newest first, or None if that tweet is gone. Without
+    ``tweet_id`` (the client shows no tweet yet) every tweet is new.
+
+    ``has_older`` is set when there are more new tweets than ``limit``, so
+    the page does not join up with what the client already shows.
+    """
+    paginator = home_timeline(user, limit)
+    if tweet_id is None:
+        return paginator.get_page()
+    created_at = (
+        Tweet.objects.filter(pk=tweet_id)
+        .values_list("created_at", flat=True)
+        .first_across_shards()
+    )
+    if created_at is None:
+        return None
+    return paginator.get_page(after=paginator.encode((created_at, tweet_id)))
+
+
+def load_tweets(page):
+    tweets = Tweet.objects.with_users().in_bulk_across_shards(page.object_list)
+    page.object_list = [tweets[pk] for pk in page.object_list if pk in tweets]
+    return page
+
+
+def home_timeline_page(user, page_size, older=None, newer=None):
+    return load_tweets(home_timeline_ids(user, page_size, older=older, newer=newer))
@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from mysite.cache import trends
+
+from .models import Hashtag, TrendBucket, Tweet, TweetHashtag
+
+
+def current_bucket(now=None):
+    size = settings.TRENDS_BUCKET_SECONDS
+    ts = int((now or timezone.now()).timestamp())
+    return datetime.fromtimestamp(ts - ts % size, tz=dt_timezone.utc)
+
+
+def _upsert_sql(rows):
+    table = connection.ops.quote_name(TrendBucket._meta.db_table)
+    values = ", ".join(["(%s, %s, %s, %s, %s)"] * rows)
+    insert = (
+        f"INSERT INTO {table} (kind, object_id, bucket, posts, likes) VALUES {values}"
+    )
+    if connection.vendor == "mysql":
+        return (
+            f"{insert} ON DUPLICATE KEY UPDATE "
+            "posts = posts + VALUES(posts), likes = likes + VALUES(likes)"
+        )
+    return (
+        f"{insert} ON CONFLICT (kind, object_id, bucket) DO UPDATE SET "
+        f"posts = {table}.posts + excluded.posts, "
+        f"likes = {table}.likes + excluded.likes"
+    )
+
+
+def _add(counts):
+    """Add ``{(kind, object_id): (posts, likes)}`` to the current buckets in
+    one statement."""
+    counts = {key: value for key, value in counts.items() if any(value)}
+    if not counts:
+        return
+    bucket = TrendBucket._meta.get_field("bucket").get_db_prep_value(
+        current_bucket(), connection
+    )
+    params = []
+    for (kind, object_id), (posts, likes) in counts.items():
+        params += [kind, object_id, bucket, posts, likes]
+    with connection.cursor() as cursor:
+        cursor.execute(_upsert_sql(len(counts)), params)
+
+
+def record_post(tweet):
+    hashtag_ids = TweetHashtag.objects.filter(tweet=tweet).values_list(
+        "hashtag_id", flat=True
+    )
+    _add({(TrendBucket.Kind.HASHTAG, pk): (1, 0) for pk in hashtag_ids})
+
+
+def record_likes(deltas):
+    """Count ``{tweet_id: +1/-1}`` towards the tweets and their hashtags.
+
+    Unlikes count negatively, so that toggling a like does not make a tweet
+    trend.
+    """
+    counts = {}
+    for tweet_id, delta in deltas.items():
+        counts[(TrendBucket.Kind.TWEET, tweet_id)] = (0, delta)
+    tags = TweetHashtag.objects.filter(tweet_id__in=deltas).values_list(
+        "tweet_id", "hashtag_id"
+    )
+    for tweet_id, hashtag_id in tags:
+        key = (TrendBucket.Kind.HASHTAG, hashtag_id)
+        posts, likes = counts.get(key, (0, 0))
+        counts[key] = (posts, likes + deltas[tweet_id])
+    _add(counts)
+
+
+def compute_trends(minutes):
+    """Top hashtags and tweets of the last ``minutes``, from the buckets
+    alone. Posts weigh TRENDS_POST_WEIGHT likes."""
+    since = current_bucket() - timedelta(minutes=minutes)
+    k = settings.TRENDS_TOP_K
+    rows = (
+        TrendBucket.objects.filter(bucket__gt=since)
+        .values("kind", "object_id")
+        .annotate(score=Sum(F("posts") * settings.TRENDS_POST_WEIGHT + F("likes")))
+        .filter(score__gt=0)
+    )
+    top_tags = list(
+        rows.filter(kind=TrendBucket.Kind.HASHTAG)
+        .order_by("-score", "object_id")
+        .values_list("object_id", "score")[:k]
+    )
+    names = Hashtag.objects.in_bulk([pk for pk, _ in top_tags])
+    return {
+        "hashtags": [(names[pk].name, score) for pk, score in top_tags if pk in names],
+        "tweets": list(
+            rows.filter(kind=TrendBucket.Kind.TWEET)
+            .order_by("-score", "object_id")
+            .values_list("object_id", "score")[:k]
+        ),
+    }
+
+
+def refresh_trends():
+    for name, minutes in settings.TRENDS_WINDOWS.items():
+        trends.set(name, compute_trends(minutes))
+    # buckets older than the longest window can no longer matter
+    oldest = current_bucket() - timedelta(minutes=max(settings.TRENDS_WINDOWS.values()))
+    TrendBucket.objects.filter(bucket__lte=oldest).delete()
+
+
+def get_trends(name):
+    """The cached top-K of window ``name``, tweets loaded: O(K) per request.
+    The cache is kept warm by the tweets.refresh_trends job."""
+    top = trends.get_or_set(name, lambda: compute_trends(settings.TRENDS_WINDOWS[name]))
+    tweets = Tweet.objects.with_users().in_bulk_across_shards(
+        [pk for pk, _ in top["tweets"]]
+    )
+    return {
+        "hashtags": top["hashtags"],
+        "tweets": [(tweets[pk], score) for pk, score in top["tweets"] if pk in tweets],
+    }
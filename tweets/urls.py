@@ -1,13 +1,34 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import api, async_views, views
 
 app_name = "tweets"
+
+if settings.TWEETS_ASYNC_VIEWS:
+    home_view = async_views.home_view
+    detail_view = async_views.tweet_detail_view
+    like_view, unlike_view = async_views.like_view, async_views.unlike_view
+else:
+    home_view = views.HomeView.as_view()
+    detail_view = views.TweetDetailView.as_view()
+    like_view, unlike_view = views.like_view, views.unlike_view
+
 urlpatterns = [
-    path("home/", views.HomeView.as_view(), name="home"),
+    path("home/", home_view, name="home"),
+    path("home/since/", views.home_since_view, name="home_since"),
+    path("events/", views.events_view, name="events"),
+    path("search/", views.SearchView.as_view(), name="search"),
+    path("tags/<str:name>/", views.HashtagView.as_view(), name="hashtag"),
+    path("mentions/", views.MentionListView.as_view(), name="mentions"),
+    path("trends/", views.TrendsView.as_view(), name="trends"),
     path("create/", views.TweetCreateView.as_view(), name="create"),
-    path("<int:pk>/", views.TweetDetailView.as_view(), name="detail"),
+    path("<int:pk>/", detail_view, name="detail"),
     path("<int:pk>/delete/", views.TweetDeleteView.as_view(), name="delete"),
-    path("<int:pk>/like/", views.like_view, name="like"),
-    path("<int:pk>/unlike/", views.unlike_view, name="unlike"),
+    path("<int:pk>/like/", like_view, name="like"),
+    path("<int:pk>/unlike/", unlike_view, name="unlike"),
+    path("likes/", views.like_batch_view, name="like_batch"),
+    path("api/home/", api.home_timeline_api, name="api_home"),
+    path("api/users/<str:username>/", api.user_tweets_api, name="api_user_tweets"),
+    path("api/<int:pk>/", api.tweet_detail_api, name="api_detail"),
 ]
@@ -0,0 +1,52 @@
+from accounts.models import FriendShip
+
+from .models import Like
+
+
+class ViewerState:
+    """What the requesting user has liked and followed, for the objects
+    rendered in the current response.
+
+    Each ``load`` call runs at most one query per relation, bounded by the
+    ids passed in, and the results are kept in sets so the templates can do
+    constant-time membership checks per card.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.liked_ids = set()
+        self.following_ids = set()
+        self._loaded_tweet_ids = set()
+        self._loaded_user_ids = set()
+
+    def load(self, tweets=(), users=()):
+        tweet_ids = {tweet.id for tweet in tweets} - self._loaded_tweet_ids
+        user_ids = {user.id for user in users} - self._loaded_user_ids
+        if self.user.is_authenticated:
+            if tweet_ids:
+                self.liked_ids.update(
+                    Like.objects.for_user(self.user.pk)
+                    .filter(tweet_id__in=tweet_ids)
+                    .values_list("tweet_id", flat=True)
+                )
+            if user_ids:
+                self.following_ids.update(
+                    FriendShip.objects.filter(
+                        follow=self.user, followed_id__in=user_ids
+                    ).values_list("followed_id", flat=True)
+                )
+        self._loaded_tweet_ids |= tweet_ids
+        self._loaded_user_ids |= user_ids
+        return self
+
+    def has_liked(self, tweet):
+        return tweet.id in self.liked_ids
+
+    def is_following(self, user):
+        return user.id in self.following_ids
+
+
+def get_viewer_state(request):
+    if not hasattr(request, "_viewer_state"):
+        request._viewer_state = ViewerState(request.user)
+    return request._viewer_state
@@ -1,27 +1,176 @@
+import json
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.urls import reverse_lazy
-from django.views.decorators.http import require_POST
-from django.views.generic import CreateView, DeleteView, DetailView, ListView
+from django.views.decorators.http import require_POST, require_safe
+from django.views.generic import (
+    CreateView,
+    DeleteView,
+    DetailView,
+    ListView,
+    TemplateView,
+)
+
+from accounts.suggestions import get_suggestions
+from jobs.queue import enqueue
+from mysite.pagination import KeysetPaginator
 
-from .models import Like, Tweet
+from .entities import normalize_hashtag, save_entities
+from .events import publish_like_count
+from .likes import like_batch, like_tweet, unlike_tweet
+from .models import Hashtag, Mention, Tweet, TweetHashtag
+from .search import get_search_backend
+from .templatetags.tweet_tags import render_tweet_cards
+from .timeline import (
+    add_to_own_timeline,
+    home_timeline_page,
+    home_timeline_since,
+    load_tweets,
+)
+from .trends import get_trends, record_post
+from .viewer import get_viewer_state
+
+LIKE_ACTIONS = {"like": True, "unlike": False}
 
 
 class HomeView(LoginRequiredMixin, ListView):
     template_name = "tweets/home.html"
     context_object_name = "tweets"
-    queryset = (
-        Tweet.objects.select_related("user")
-        .prefetch_related("like_set")
-        .order_by("-created_at")
+
+    def get_queryset(self):
+        self.page = home_timeline_page(
+            self.request.user,
+            settings.TWEETS_PAGE_SIZE,
+            older=self.request.GET.get("older"),
+            newer=self.request.GET.get("newer"),
+        )
+        return self.page.object_list
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["page"] = self.page
+        context["viewer"] = get_viewer_state(self.request).load(
+            tweets=self.page.object_list
+        )
+        context["suggestions"] = get_suggestions(self.request.user)
+        return context
+
+
+@login_required
+@require_safe
+def home_since_view(request):
+    try:
+        # no since_id when the page was rendered with an empty timeline
+        since_id = int(request.GET["since_id"]) if "since_id" in request.GET else None
+    except ValueError:
+        return HttpResponseBadRequest()
+    page = home_timeline_since(request.user, since_id, settings.TIMELINE_SINCE_LIMIT)
+    if page is None or page.has_older:
+        # too far behind (or the anchor tweet is gone): reload the page
+        return JsonResponse({"reload": True})
+    tweets = load_tweets(page).object_list
+    viewer = get_viewer_state(request).load(tweets=tweets)
+    return JsonResponse(
+        {
+            "reload": False,
+            "latest_id": str(tweets[0].pk if tweets else since_id or ""),
+            "count": len(tweets),
+            "html": render_tweet_cards(tweets, viewer),
+        }
     )
 
+
+def events_view(request):
+    # Served by tweets.stream.event_stream under ASGI. 204 tells EventSource
+    # to give up, and the page falls back to polling.
+    return HttpResponse(status=204)
+
+
+class SearchView(LoginRequiredMixin, TemplateView):
+    template_name = "tweets/search.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        query = self.request.GET.get("q", "").strip()
+        page = get_search_backend().search(
+            query, settings.TWEETS_PAGE_SIZE, older=self.request.GET.get("older")
+        )
+        context["query"] = query
+        context["page"] = load_tweets(page)
+        context["tweets"] = page.object_list
+        context["viewer"] = get_viewer_state(self.request).load(tweets=page.object_list)
+        return context
+
+
+class EntityTweetListView(LoginRequiredMixin, TemplateView):
+    """Tweets listed through an entity table (hashtags, mentions), newest
+    first. ``get_entities`` returns the rows for one entity; paging walks
+    its ``(entity, created_at, tweet)`` index."""
+
+    template_name = "tweets/tweet_list.html"
+
+    def get_entities(self):
+        raise NotImplementedError
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["liked_list"] = Like.objects.filter(user=self.request.user).values_list(
-            "tweet", flat=True
+        paginator = KeysetPaginator(
+            self.get_entities().values("created_at", "tweet_id"),
+            settings.TWEETS_PAGE_SIZE,
+            keys=("created_at", "tweet_id"),
+        )
+        page = paginator.get_page(
+            older=self.request.GET.get("older"), newer=self.request.GET.get("newer")
+        )
+        page.object_list = [row["tweet_id"] for row in page.object_list]
+        context["page"] = load_tweets(page)
+        context["tweets"] = page.object_list
+        context["viewer"] = get_viewer_state(self.request).load(tweets=page.object_list)
+        return context
+
+
+class HashtagView(EntityTweetListView):
+    def get_entities(self):
+        hashtag = Hashtag.objects.filter(
+            name=normalize_hashtag(self.kwargs["name"])
+        ).first()
+        return TweetHashtag.objects.filter(hashtag=hashtag)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["heading"] = f"#{self.kwargs['name']}"
+        return context
+
+
+class MentionListView(EntityTweetListView):
+    def get_entities(self):
+        return Mention.objects.filter(user=self.request.user)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["heading"] = "あなたへのメンション"
+        return context
+
+
+class TrendsView(LoginRequiredMixin, TemplateView):
+    template_name = "tweets/trends.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        window = self.request.GET.get("window")
+        if window not in settings.TRENDS_WINDOWS:
+            window = next(iter(settings.TRENDS_WINDOWS))
+        top = get_trends(window)
+        context["window"] = window
+        context["windows"] = list(settings.TRENDS_WINDOWS)
+        context["hashtags"] = top["hashtags"]
+        context["tweets"] = [tweet for tweet, _ in top["tweets"]]
+        context["viewer"] = get_viewer_state(self.request).load(
+            tweets=context["tweets"]
         )
         return context
 
@@ -34,18 +183,32 @@ class TweetCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.user_id = self.request.user.id
-        return super().form_valid(form)
+        with transaction.atomic():
+            response = super().form_valid(form)
+            save_entities([self.object])
+            record_post(self.object)
+            add_to_own_timeline(self.object)
+            enqueue(
+                "tweets.fan_out_tweet",
+                {"tweet_id": self.object.pk},
+                key=f"fan_out_tweet:{self.object.pk}",
+            )
+        return response
 
 
 class TweetDetailView(LoginRequiredMixin, DetailView):
     model = Tweet
     template_name = "tweets/detail.html"
 
+    def get_object(self, queryset=None):
+        tweet = Tweet.objects.filter(pk=self.kwargs["pk"]).first_across_shards()
+        if tweet is None:
+            raise Http404()
+        return tweet
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["like"] = Like.objects.filter(
-            user=self.request.user, tweet=self.get_object()
-        ).exists()
+        context["viewer"] = get_viewer_state(self.request).load(tweets=[self.object])
         return context
 
 
@@ -55,39 +218,78 @@ class TweetDeleteView(LoginRequiredMixin, DeleteView):
     success_url = reverse_lazy("tweets:home")
 
     def get_queryset(self, *args, **kwargs):
-        return super().get_queryset(*args, **kwargs).filter(user=self.request.user)
+        return Tweet.objects.for_user(self.request.user.pk)
 
 
 @login_required
 @require_POST
 def like_view(request, pk):
-    tweet = get_object_or_404(Tweet, pk=pk)
-    Like.objects.get_or_create(tweet=tweet, user=request.user)
-    liked = True
-
-    context = {
-        "tweet_id": tweet.id,
-        "liked": liked,
-        "count": tweet.like_set.count(),
-    }
-
-    return JsonResponse(context)
+    changed = like_tweet(request.user, pk)
+    return like_state_response(pk, True, changed)
 
 
 @login_required
 @require_POST
 def unlike_view(request, pk):
-    tweet = get_object_or_404(Tweet, pk=pk)
-    if like := Like.objects.filter(tweet=tweet, user=request.user).select_related(
-        "tweet", "user"
-    ):
-        like.delete()
-    liked = False
+    changed = unlike_tweet(request.user, pk)
+    return like_state_response(pk, False, changed)
+
+
+def like_state_response(pk, liked, changed):
+    count = (
+        Tweet.objects.filter(pk=pk)
+        .values_list("like_count", flat=True)
+        .first_across_shards()
+    )
+    if count is None:
+        raise Http404()
+    if changed:
+        publish_like_count(pk, count)
 
     context = {
-        "tweet_id": tweet.id,
+        "tweet_id": str(pk),
         "liked": liked,
-        "count": tweet.like_set.count(),
+        "changed": changed,
+        "count": count,
     }
 
     return JsonResponse(context)
+
+
+def parse_like_operations(body):
+    """Return ``{tweet_id: liked}`` for a batch request body. Later operations
+    on the same tweet override earlier ones."""
+    try:
+        operations = json.loads(body)["operations"]
+        actions = {
+            int(operation["tweet_id"]): LIKE_ACTIONS[operation["action"]]
+            for operation in operations
+        }
+    except (TypeError, KeyError) as e:
+        raise ValueError("invalid like operations") from e
+    if len(actions) > settings.LIKE_BATCH_MAX_SIZE:
+        raise ValueError("too many like operations")
+    return actions
+
+
+@login_required
+@require_POST
+def like_batch_view(request):
+    try:
+        actions = parse_like_operations(request.body)
+    except ValueError:
+        return HttpResponseBadRequest()
+    with transaction.atomic():
+        changed = like_batch(request.user, actions)
+        counts = {}
+        tweets = Tweet.objects.filter(pk__in=actions).values_list("id", "like_count")
+        for queryset in tweets.on_all_shards():
+            counts.update(queryset)
+        for pk in changed:
+            publish_like_count(pk, counts[pk])
+
+    results = [
+        {"tweet_id": str(pk), "liked": actions[pk], "count": counts[pk]}
+        for pk in sorted(counts)
+    ]
+    return JsonResponse({"results": results})
@@ -0,0 +1,231 @@
+"""Synthetic users, follows, tweets and likes for load tests.
+
+The work is cut into chunks that can be generated in any process and in any
+order: each chunk seeds its own random generator from the workload seed and
+its position, so a seed gives the same graph, tweets and likes however many
+workers run it. A chunk is either saved with bulk_create, by the process
+that started the workers, or serialized as JSON Lines for loaddata.
+"""
+import random
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.core import serializers
+
+from accounts.models import FriendShip
+from mysite.sharding import shard_for_user
+
+from .models import Like, Tweet
+
+User = get_user_model()
+
+WORDS = (
+    "今日 明日 昨日 ランチ コーヒー 仕事 勉強 映画 音楽 旅行 週末 天気 新しい 楽しい 眠い 忙しい いい感じ ありがとう おはよう おやすみ"
+).split()
+
+
+@dataclass(frozen=True)
+class Workload:
+    users: int
+    tweets: int
+    likes: int
+    follows: float
+    skew: float
+    seed: int
+    first_user_id: int
+    first_tweet_id: int
+    first_like_id: int
+    start: datetime
+    end: datetime
+    password: str
+    batch_size: int
+
+    def rng(self, kind, start):
+        return random.Random(f"{self.seed}:{kind}:{start}")
+
+    def user_id(self, i):
+        return self.first_user_id + i
+
+    def tweet_time(self, i):
+        # tweets are spread evenly over the period, so ids follow time
+        return self.start + (self.end - self.start) * i / max(self.tweets, 1)
+
+
+def zipf_cum_weights(n, skew):
+    return list(accumulate((rank + 1) ** -skew for rank in range(n)))
+
+
+@lru_cache(maxsize=1)
+def popularity(plan):
+    """Users ordered from most to least popular, with Zipf cumulative weights
+    for random.choices. Computed once per process."""
+    users = list(range(plan.users))
+    plan.rng("popularity", 0).shuffle(users)
+    return users, zipf_cum_weights(plan.users, plan.skew)
+
+
+def like_counts(plan):
+    """The number of likes of every tweet: Zipf over a random ranking of the
+    tweets, scaled to exactly ``plan.likes`` and capped at one like per
+    user."""
+    ranks = list(range(plan.tweets))
+    plan.rng("like_ranks", 0).shuffle(ranks)
+    weights = [(rank + 1) ** -plan.skew for rank in ranks]
+    total = sum(weights)
+    counts = array("q", (min(plan.users, int(plan.likes * w / total)) for w in weights))
+    # hand out the rounding remainder, most popular tweets first
+    missing = plan.likes - sum(counts)
+    for i in sorted(range(plan.tweets), key=ranks.__getitem__):
+        if not missing:
+            break
+        extra = min(missing, plan.users - counts[i])
+        counts[i] += extra
+        missing -= extra
+    return counts
+
+
+def chunks(total, size):
+    return [(start, min(start + size, total)) for start in range(0, total, size)]
+
+
+def build_users(plan, start, stop, following=None, followers=None):
+    return [
+        User(
+            pk=plan.user_id(i),
+            username=f"load{plan.user_id(i)}",
+            slug_username=f"load{plan.user_id(i)}",
+            email=f"load{plan.user_id(i)}@example.com",
+            password=plan.password,
+            date_joined=plan.start,
+            following_count=following[i - start] if following else 0,
+            followers_count=followers[i - start] if followers else 0,
+        )
+        for i in range(start, stop)
+    ]
+
+
+def build_follows(plan, start, stop):
+    """The follow edges of users ``start`` to ``stop``. Out-degrees follow a
+    Pareto distribution averaging ``plan.follows``; the followed users are
+    drawn by popularity, which gives a power-law in-degree."""
+    rng = plan.rng("follows", start)
+    users, cum_weights = popularity(plan)
+    # a Pareto(2) variate averages 2
+    scale = plan.follows / 2
+    follows = []
+    for i in range(start, stop):
+        degree = min(plan.users - 1, int(rng.paretovariate(2) * scale))
+        followed = set()
+        for _ in range(10):
+            missing = degree - len(followed)
+            if not missing:
+                break
+            followed.update(rng.choices(users, cum_weights=cum_weights, k=missing))
+            followed.discard(i)
+        if len(followed) < degree:
+            # the weighted draws keep hitting the same few popular users
+            rest = [j for j in range(plan.users) if j != i and j not in followed]
+            followed.update(rng.sample(rest, degree - len(followed)))
+        follows += [
+            FriendShip(follow_id=plan.user_id(i), followed_id=plan.user_id(j))
+            for j in sorted(followed)
+        ]
+    return follows
+
+
+def build_tweets(plan, start, stop, counts, first_like):
+    """Tweets ``start`` to ``stop`` with ``counts[i - start]`` likes each,
+    from distinct users, and those likes, numbered from ``first_like``.
+    Popular users post more."""
+    rng = plan.rng("tweets", start)
+    users, cum_weights = popularity(plan)
+    authors = rng.choices(users, cum_weights=cum_weights, k=stop - start)
+    tweets, likes = [], []
+    for i, author, count in zip(range(start, stop), authors, counts):
+        created_at = plan.tweet_time(i)
+        tweet = Tweet(
+            # id, not pk: Model() would still call the snowflake default
+            id=plan.first_tweet_id + i,
+            user_id=plan.user_id(author),
+            content=" ".join(rng.choices(WORDS, k=rng.randint(3, 12))),
+            created_at=created_at,
+            like_count=count,
+        )
+        tweets.append(tweet)
+        window = (plan.end - created_at).total_seconds()
+        for liker in rng.sample(range(plan.users), count):
+            likes.append(
+                Like(
+                    id=plan.first_like_id + first_like + len(likes),
+                    user_id=plan.user_id(liker),
+                    tweet_id=tweet.pk,
+                    created_at=created_at + timedelta(seconds=rng.random() * window),
+                )
+            )
+    return tweets, likes
+
+
+def save(objs, batch_size):
+    """bulk_create ``objs``, the sharded models on the shard of their user."""
+    batches = {}
+    for obj in objs:
+        alias = shard_for_user(obj.user_id) if isinstance(obj, (Tweet, Like)) else None
+        batches.setdefault((type(obj), alias), []).append(obj)
+    for (model, alias), batch in batches.items():
+        if model is Like:
+            save_likes(batch, alias, batch_size)
+        else:
+            model.objects.using(alias).bulk_create(batch, batch_size=batch_size)
+    return len(objs)
+
+
+def save_likes(likes, alias, batch_size):
+    """bulk_create ``likes`` with their generated timestamps, which the
+    insert would otherwise replace with the current time."""
+    with keep_timestamps(Like):
+        Like.objects.using(alias).bulk_create(likes, batch_size=batch_size)
+
+
+@contextmanager
+def keep_timestamps(model):
+    # auto_now_add is read when each row is inserted; the command inserts
+    # from this one thread
+    field = model._meta.get_field("created_at")
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def dump(objs):
+    return serializers.serialize("jsonl", objs) if objs else ""
+
+
+def run_chunk(task):
+    """Generate one chunk and return its objects (``to_db``), for the
+    caller to save, or its JSON Lines. Returns ``(objs, text, degrees)``;
+    follow chunks report the out- and in-degrees they added as two
+    Counters."""
+    plan, kind, start, stop, extra, to_db = task
+    degrees = None
+    if kind == "users":
+        objs = build_users(plan, start, stop, *extra)
+    elif kind == "follows":
+        objs = build_follows(plan, start, stop)
+        degrees = (
+            Counter(edge.follow_id for edge in objs),
+            Counter(edge.followed_id for edge in objs),
+        )
+    else:
+        tweets, likes = build_tweets(plan, start, stop, *extra)
+        objs = tweets + likes
+    if to_db:
+        return objs, "", degrees
+    return None, dump(objs), degrees